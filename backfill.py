@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+from telethon import types, utils
+
+logger = logging.getLogger(__name__)
+
+# 匹配的消息很少时，每扫描这么多条消息也保存一次检查点
+CHECKPOINT_INTERVAL = 1000
+
+# 可以按类型过滤的媒体，以及只有一种类型时使用的服务端过滤器
+MEDIA_TYPES = ("video", "audio", "photo", "document")
+SERVER_FILTERS = {
+    "video": types.InputMessagesFilterVideo,
+    "audio": types.InputMessagesFilterMusic,
+    "photo": types.InputMessagesFilterPhotos,
+    "document": types.InputMessagesFilterDocument,
+}
+
+
+def message_media_type(message):
+    """返回消息中媒体的类型，没有可下载的媒体时返回None"""
+    if message.photo:
+        return "photo"
+    if message.video:
+        return "video"
+    if message.audio or message.voice:
+        return "audio"
+    if message.document:
+        return "document"
+    return None
+
+
+class MediaFilter:
+    """
+    备份时的媒体过滤条件
+
+    由命令参数解析，例如 type=video,audio min_size=10 since=2024-01-01，
+    大小单位为MB，日期为UTC日期，until 当天的消息也包括在内。
+    """
+
+    def __init__(
+        self, media_types=None, min_size=None, max_size=None, since=None, until=None
+    ):
+        self.media_types = set(media_types or MEDIA_TYPES)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.since = since
+        self.until = until
+
+    @classmethod
+    def parse(cls, args):
+        """解析 key=value 形式的参数，参数错误时抛出 ValueError"""
+        options = {}
+        for arg in args:
+            key, sep, value = arg.partition("=")
+            if not sep or not value:
+                raise ValueError(f"无法识别的参数: {arg}")
+            if key == "type":
+                media_types = value.split(",")
+                unknown = set(media_types) - set(MEDIA_TYPES)
+                if unknown:
+                    raise ValueError(
+                        f"未知的媒体类型: {','.join(sorted(unknown))}，"
+                        f"可选: {','.join(MEDIA_TYPES)}"
+                    )
+                options["media_types"] = media_types
+            elif key in ("min_size", "max_size"):
+                options[key] = float(value) * 1024 * 1024
+            elif key in ("since", "until"):
+                date = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+                options[key] = date if key == "since" else date + timedelta(days=1)
+            else:
+                raise ValueError(f"未知的参数: {key}")
+        return cls(**options)
+
+    def server_filter(self):
+        """只过滤一种类型时由服务端过滤，减少需要拉取的消息"""
+        if len(self.media_types) == 1:
+            return SERVER_FILTERS[next(iter(self.media_types))]
+        return None
+
+    def matches(self, message):
+        if message_media_type(message) not in self.media_types:
+            return False
+        size = message.file.size if message.file else None
+        if self.min_size is not None and (size or 0) < self.min_size:
+            return False
+        if self.max_size is not None and size is not None and size > self.max_size:
+            return False
+        if self.since and message.date < self.since:
+            return False
+        if self.until and message.date >= self.until:
+            return False
+        return True
+
+    def key(self):
+        """规范化的过滤条件，检查点按会话和过滤条件分别保存，不过滤时为空字符串"""
+        parts = []
+        if self.media_types != set(MEDIA_TYPES):
+            parts.append(f"type={','.join(sorted(self.media_types))}")
+        for name in ("min_size", "max_size"):
+            value = getattr(self, name)
+            if value is not None:
+                parts.append(f"{name}={int(value)}")
+        if self.since:
+            parts.append(f"since={self.since:%Y-%m-%d}")
+        if self.until:
+            parts.append(f"until={self.until:%Y-%m-%d}")
+        return ";".join(parts)
+
+    def describe(self):
+        parts = [f"类型: {','.join(sorted(self.media_types))}"]
+        if self.min_size is not None:
+            parts.append(f"最小 {self.min_size / 1024 / 1024:g}MB")
+        if self.max_size is not None:
+            parts.append(f"最大 {self.max_size / 1024 / 1024:g}MB")
+        if self.since:
+            parts.append(f"从 {self.since:%Y-%m-%d}")
+        if self.until:
+            parts.append(f"到 {(self.until - timedelta(days=1)):%Y-%m-%d}")
+        return "，".join(parts)
+
+
+class BackfillCheckpoints:
+    """
+    每个会话已备份到的消息ID，下次备份只拉取之后的消息
+
+    检查点按会话和过滤条件（MediaFilter.key）分别保存：带过滤条件的备份跳过了
+    不匹配的消息，它的检查点不能用于其他过滤条件的备份。
+    """
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path)
+        # 旧版本的 checkpoints 表不区分过滤条件，其中的位置可能跳过了未下载的消息，不再使用
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS filter_checkpoints (
+                chat_id INTEGER NOT NULL,
+                filter_key TEXT NOT NULL,
+                last_message_id INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (chat_id, filter_key)
+            )
+            """)
+        self._db.commit()
+
+    def get(self, chat_id, filter_key=""):
+        row = self._db.execute(
+            "SELECT last_message_id FROM filter_checkpoints "
+            "WHERE chat_id = ? AND filter_key = ?",
+            (chat_id, filter_key),
+        ).fetchone()
+        return row[0] if row else 0
+
+    def set(self, chat_id, message_id, filter_key=""):
+        self._db.execute(
+            "INSERT OR REPLACE INTO filter_checkpoints "
+            "(chat_id, filter_key, last_message_id, updated_at) VALUES (?, ?, ?, ?)",
+            (chat_id, filter_key, message_id, time.time()),
+        )
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+class Backfill:
+    """
+    使用用户账号备份一个会话中的历史媒体
+
+    按消息ID从旧到新遍历会话（每次请求拉取一批消息），符合过滤条件的消息
+    交给 download 下载，同时下载的数量受 concurrency 限制。每批消息处理完成后
+    保存检查点；有消息下载失败时检查点停在第一条失败的消息之前，下次使用相同
+    过滤条件备份时从该处继续（已下载的文件会被去重索引跳过）。
+    """
+
+    def __init__(
+        self,
+        client,
+        entity,
+        media_filter,
+        checkpoints,
+        download,
+        concurrency=4,
+        batch_size=100,
+    ):
+        self.client = client
+        self.entity = entity
+        self.chat_id = utils.get_peer_id(entity)
+        self.media_filter = media_filter
+        self.filter_key = media_filter.key()
+        self.checkpoints = checkpoints
+        self.download = download  # async download(message)
+        self.concurrency = max(1, int(concurrency))
+        self.batch_size = max(1, int(batch_size))
+
+        self.scanned = 0
+        self.matched = 0
+        self.completed = 0
+        self.failed = 0
+        self._first_failed_id = None
+        self._on_progress = None
+
+    def _notify(self):
+        if self._on_progress:
+            self._on_progress(self)
+
+    async def _download_one(self, semaphore, message):
+        async with semaphore:
+            try:
+                await self.download(message)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                if self._first_failed_id is None or message.id < self._first_failed_id:
+                    self._first_failed_id = message.id
+                logger.error(f"备份消息 {message.id} 失败: {str(e)}")
+            finally:
+                self._notify()
+
+    async def _process_batch(self, batch, last_id):
+        """下载一批消息并更新检查点"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(
+            *[self._download_one(semaphore, message) for message in batch]
+        )
+        if self._first_failed_id is not None:
+            checkpoint = self._first_failed_id - 1
+        else:
+            checkpoint = last_id
+        if checkpoint > self.checkpoints.get(self.chat_id, self.filter_key):
+            self.checkpoints.set(self.chat_id, checkpoint, self.filter_key)
+
+    def start_id(self):
+        """本次备份的起点：同一过滤条件的检查点，不过滤的备份完成的部分同样不需要再扫描"""
+        return max(
+            self.checkpoints.get(self.chat_id, self.filter_key),
+            self.checkpoints.get(self.chat_id),
+        )
+
+    async def run(self, on_progress=None):
+        """执行备份，每条消息下载完成和每批消息处理完成后调用 on_progress(self)"""
+        self._on_progress = on_progress
+        min_id = self.start_id()
+        logger.info(
+            f"开始备份会话 {self.chat_id}，从消息 {min_id} 之后开始，"
+            f"过滤条件: {self.media_filter.describe()}"
+        )
+        batch = []
+        last_id = min_id
+        async for message in self.client.iter_messages(
+            self.entity,
+            reverse=True,
+            min_id=min_id,
+            offset_date=self.media_filter.since,
+            filter=self.media_filter.server_filter(),
+        ):
+            # until 之后的消息都不需要，reverse 遍历时可以提前结束
+            if self.media_filter.until and message.date >= self.media_filter.until:
+                break
+            self.scanned += 1
+            last_id = message.id
+            if self.media_filter.matches(message):
+                self.matched += 1
+                batch.append(message)
+            if len(batch) >= self.batch_size or self.scanned % CHECKPOINT_INTERVAL == 0:
+                await self._process_batch(batch, last_id)
+                batch = []
+                self._notify()
+        await self._process_batch(batch, last_id)
+        self._notify()
+        logger.info(
+            f"会话 {self.chat_id} 备份完成: 扫描 {self.scanned} 条消息，"
+            f"下载 {self.completed}/{self.matched}，失败 {self.failed}"
+        )
+        return self
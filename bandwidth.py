@@ -0,0 +1,256 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 下载优先级：单个文件等交互任务优先于播放列表、频道备份等批量任务
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# 最近这段时间内有交互任务在下载时，批量任务按 bulk_share 让出带宽（秒）
+INTERACTIVE_WINDOW = 2.0
+
+_priority = contextvars.ContextVar("download_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def use_priority(priority):
+    """设置当前任务（及其创建的子任务）中下载的优先级"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶，rate 为每秒产生的令牌数，0 表示不限制
+
+    允许透支：reserve 立即扣除令牌并返回需要等待的秒数，
+    这样事件循环中的协程和 yt-dlp 下载线程可以分别用异步或阻塞的方式等待。
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self.capacity = 0
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        """修改速率，默认允许1秒的突发量"""
+        with self._lock:
+            self._refill()
+            limited = bool(self.rate)
+            self.rate = max(0, rate or 0)
+            self.capacity = burst or self.rate
+            # 从不限制改为限制时令牌桶是满的
+            self.tokens = min(self.tokens, self.capacity) if limited else self.capacity
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.last) * self.rate
+            )
+        self.last = now
+
+    def reserve(self, amount):
+        """扣除令牌，返回需要等待的秒数"""
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_acquire(self, amount=1):
+        """令牌足够时扣除并返回True，不足时不扣除"""
+        with self._lock:
+            if not self.rate:
+                return True
+            self._refill()
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+
+class Governor:
+    """
+    全局带宽和请求频率控制
+
+    所有下载都从全局和对应来源（telegram / youtube）的字节令牌桶中取令牌，
+    Telegram 的分片请求和状态消息的编辑另有请求数限制。
+    有交互任务正在下载时，批量任务还要从速率为 bulk_share 倍的批量令牌桶中取令牌，
+    剩余的带宽留给交互任务。
+    """
+
+    SOURCES = ("telegram", "youtube")
+
+    def __init__(self):
+        self.bytes = {name: TokenBucket() for name in ("global", *self.SOURCES)}
+        self.bulk = {source: TokenBucket() for source in self.SOURCES}
+        self.telegram_requests = TokenBucket()
+        self.edits = TokenBucket()
+        self.bulk_share = 1.0
+        self.rates = {}
+        self._last_interactive = 0.0
+
+    def configure(
+        self,
+        global_mbps=0,
+        telegram_mbps=0,
+        youtube_mbps=0,
+        telegram_requests_per_second=0,
+        edits_per_minute=0,
+        bulk_share=1.0,
+    ):
+        """设置各项限制，速率为0表示不限制"""
+        rates = {
+            "global": global_mbps,
+            "telegram": telegram_mbps,
+            "youtube": youtube_mbps,
+        }
+        for name, mbps in rates.items():
+            self.bytes[name].set_rate((mbps or 0) * 1024 * 1024)
+        self.telegram_requests.set_rate(telegram_requests_per_second or 0)
+        # 编辑消息的突发量为1，避免短时间内连续编辑
+        edit_rate = (edits_per_minute or 0) / 60
+        self.edits.set_rate(edit_rate, burst=1 if edit_rate else None)
+        self.bulk_share = min(1.0, max(0.01, float(bulk_share or 1.0)))
+        for source in self.SOURCES:
+            self.bulk[source].set_rate((self.rate_limit(source) or 0) * self.bulk_share)
+        self.rates = dict(
+            rates,
+            telegram_requests_per_second=telegram_requests_per_second,
+            edits_per_minute=edits_per_minute,
+        )
+
+    def describe(self):
+        def label(mbps):
+            return f"{mbps}MB/s" if mbps else "不限"
+
+        return (
+            f"全局 {label(self.rates.get('global'))}，"
+            f"Telegram {label(self.rates.get('telegram'))}，"
+            f"YouTube {label(self.rates.get('youtube'))}"
+        )
+
+    def rate_limit(self, source):
+        """来源的实际速率上限（字节/秒），不限制时返回None"""
+        rates = [
+            self.bytes[name].rate
+            for name in ("global", source)
+            if self.bytes[name].rate
+        ]
+        return min(rates) if rates else None
+
+    def _reserve(self, source, amount, priority):
+        now = time.monotonic()
+        delay = max(
+            self.bytes["global"].reserve(amount), self.bytes[source].reserve(amount)
+        )
+        if priority == INTERACTIVE:
+            self._last_interactive = now
+        elif now - self._last_interactive < INTERACTIVE_WINDOW:
+            delay = max(delay, self.bulk[source].reserve(amount))
+        if source == "telegram":
+            delay = max(delay, self.telegram_requests.reserve(1))
+        if delay > 0:
+            metrics.THROTTLED_SECONDS.inc(delay, source=source)
+        return delay
+
+    async def acquire(self, source, amount, priority=None):
+        """下载 amount 字节前调用，超过限制时等待"""
+        delay = self._reserve(source, amount, priority or current_priority())
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wrap_hook(self, hook, source="youtube"):
+        """
+        包装 yt-dlp 的 progress hook，在下载线程中按已下载的字节数限速
+
+        优先级在创建时从当前任务中读取，因为下载线程中无法获取协程的上下文。
+        """
+        priority = current_priority()
+        downloaded = {}
+
+        def wrapped(d):
+            if d.get("status") == "downloading":
+                key = d.get("tmpfilename") or d.get("filename")
+                current = d.get("downloaded_bytes") or 0
+                amount = current - downloaded.get(key, 0)
+                downloaded[key] = current
+                if amount > 0:
+                    delay = self._reserve(source, amount, priority)
+                    if delay > 0:
+                        time.sleep(delay)
+            if hook:
+                hook(d)
+
+        return wrapped
+
+    def wrap_callback(self, callback, source="telegram"):
+        """
+        包装 Telethon 的进度回调 callback(received, total)，按收到的字节数限速
+
+        用于由 Telethon 直接下载的图片等媒体：每收到一个分片调用一次，
+        等待期间 Telethon 不会请求下一个分片。callback 可以为None。
+        """
+        received = 0
+
+        async def wrapped(current, total):
+            nonlocal received
+            amount = current - received
+            received = current
+            if amount > 0:
+                await self.acquire(source, amount)
+            if callback:
+                callback(current, total)
+
+        return wrapped
+
+    def try_edit(self):
+        """定期更新状态消息前调用，超过编辑频率时跳过本次更新"""
+        return self.edits.try_acquire()
+
+    async def acquire_edit(self):
+        """必须送达的消息编辑（如最终结果），超过编辑频率时等待"""
+        delay = self.edits.reserve(1)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+GOVERNOR = Governor()
+
+
+def active_profile(profiles, now):
+    """
+    返回当前时间生效的时段配置
+
+    每个时段从 time 开始生效，直到下一个时段开始；当天第一个时段之前沿用前一天最后一个时段。
+    """
+    current = None
+    latest = None
+    for profile in profiles:
+        start = profile["start"]
+        if latest is None or start > latest["start"]:
+            latest = profile
+        if start <= (now.hour, now.minute) and (
+            current is None or start > current["start"]
+        ):
+            current = profile
+    return current or latest
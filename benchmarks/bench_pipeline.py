@@ -0,0 +1,580 @@
+"""
+离线测试完整下载流程的性能（不需要 Telegram 账号和网络）
+
+每个场景在独立的子进程中运行：将程序复制到临时目录并生成配置文件后导入 main，
+使用模拟的 Telegram 消息和客户端、替换了网络请求的并行下载器，以及连接本地
+HTTP 服务的 yt-dlp 模拟提取器，经过与线上相同的 download_video、下载队列、
+process_download 和 find_and_move_youtube_video 流程。
+
+场景:
+    telegram_single   顺序处理多条转发的文件
+    telegram_burst    同时转发多条文件，经过 download_video 和下载队列
+    telegram_large    单个大文件，多连接并行下载
+    telegram_album    转发一个相册，相册中的文件作为一个任务并发下载
+    youtube_single    顺序下载多个 YouTube 视频
+    youtube_playlist  下载一个播放列表
+
+用法:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --scenarios telegram_burst --burst 100 --size 4
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import yaml
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = (
+    "telegram_single",
+    "telegram_burst",
+    "telegram_large",
+    "telegram_album",
+    "youtube_single",
+    "youtube_playlist",
+)
+
+PAYLOAD = os.urandom(1024 * 1024)
+
+FILE_SIZES = {}  # 模拟文档ID -> 文件大小
+
+
+def synthetic_bytes(offset, length):
+    """生成指定偏移和长度的模拟文件内容"""
+    start = offset % len(PAYLOAD)
+    data = PAYLOAD[start : start + length]
+    while len(data) < length:
+        data += PAYLOAD[: length - len(data)]
+    return data
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+# ---------------------------------------------------------------------------
+# 模拟 Telegram
+# ---------------------------------------------------------------------------
+
+
+class FakeMessage:
+    """模拟 Telethon 的 Message，只实现下载流程用到的属性和方法"""
+
+    def __init__(self, chat_id, message_id, text="", media=None):
+        self.chat_id = chat_id
+        self.id = message_id
+        self.text = text
+        self.raw_text = text
+        self.message = text
+        self.media = media
+        self.grouped_id = None
+        self.date = datetime.now()
+        self.client = None
+        self.replies = []
+        self.edits = 0
+
+    def get_entities_text(self):
+        return []
+
+    async def reply(self, text):
+        self.replies.append(text)
+        return FakeMessage(self.chat_id, -self.id, text)
+
+    async def edit(self, text):
+        self.edits += 1
+        self.text = text
+
+
+class FakeEvent:
+    """模拟 NewMessage 事件"""
+
+    def __init__(self, message):
+        self.message = message
+        self.chat_id = message.chat_id
+
+    async def reply(self, text):
+        return await self.message.reply(text)
+
+
+class FakeClient:
+    """模拟 TelegramClient，记录注册的事件处理器并按ID返回消息"""
+
+    def __init__(self):
+        self.handlers = []
+        self.messages = {}
+
+    def on(self, event):
+        def decorator(handler):
+            self.handlers.append(handler)
+            return handler
+
+        return decorator
+
+    async def get_messages(self, chat_id, ids=None):
+        if isinstance(ids, list):
+            return [self.messages.get((chat_id, message_id)) for message_id in ids]
+        return self.messages.get((chat_id, ids))
+
+    async def dispatch(self, message):
+        """像 Telethon 一样把新消息交给下载处理器"""
+        self.messages[(message.chat_id, message.id)] = message
+        event = FakeEvent(message)
+        for handler in self.handlers:
+            if handler.__name__ == "download_video":
+                await handler(event)
+
+
+def make_document_media(doc_id, size, name):
+    """构造与真实消息相同类型的文档媒体"""
+    from telethon.tl import types
+
+    document = types.Document(
+        id=doc_id,
+        access_hash=doc_id * 7,
+        file_reference=b"",
+        date=datetime.now(),
+        mime_type="video/mp4",
+        size=size,
+        dc_id=1,
+        attributes=[
+            types.DocumentAttributeVideo(duration=60, w=1280, h=720),
+            types.DocumentAttributeFilename(file_name=name),
+        ],
+    )
+    return types.MessageMediaDocument(document=document)
+
+
+def patch_parallel_downloader(latency, bandwidth):
+    """
+    替换并行下载器的网络请求，按请求延迟和单连接带宽模拟 GetFileRequest
+
+    Returns:
+        mock 补丁对象，在 with 代码块中生效
+    """
+    from telegram_download import ParallelDownloader
+
+    async def create_sender(self, dc_id):
+        return object()
+
+    async def close_sender(self, sender):
+        pass
+
+    async def fetch_part(self, sender, location, offset, limit):
+        length = max(0, min(limit, FILE_SIZES[location.id] - offset))
+        delay = latency + (length / bandwidth if bandwidth else 0)
+        await asyncio.sleep(delay)
+        return synthetic_bytes(offset, length)
+
+    return mock.patch.multiple(
+        ParallelDownloader,
+        _create_sender=create_sender,
+        _close_sender=close_sender,
+        _fetch_part=fetch_part,
+    )
+
+
+# ---------------------------------------------------------------------------
+# 模拟 YouTube
+# ---------------------------------------------------------------------------
+
+
+class SyntheticVideoHandler(BaseHTTPRequestHandler):
+    """返回 /video/<视频ID> 对应大小的模拟视频数据"""
+
+    sizes = {}
+    bandwidth = 0  # 单连接带宽（字节/秒），0 表示不限速
+    chunk_size = 256 * 1024
+
+    def do_GET(self):
+        video_id = self.path.rsplit("/", 1)[-1]
+        size = self.sizes.get(video_id)
+        if size is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        for offset in range(0, size, self.chunk_size):
+            length = min(self.chunk_size, size - offset)
+            if self.bandwidth:
+                time.sleep(length / self.bandwidth)
+            self.wfile.write(synthetic_bytes(offset, length))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_video_server(bandwidth):
+    SyntheticVideoHandler.bandwidth = bandwidth
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SyntheticVideoHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_stub_ydl_class(base_url, playlists):
+    """创建只包含模拟提取器的 YoutubeDL，视频地址指向本地HTTP服务"""
+    import yt_dlp
+    from yt_dlp.extractor.common import InfoExtractor
+
+    class StubVideoIE(InfoExtractor):
+        IE_NAME = "stub:video"
+        _VALID_URL = r"https?://(?:www\.)?youtube\.com/watch\?v=(?P<id>[\w-]{11})$"
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            size = SyntheticVideoHandler.sizes[video_id]
+            return {
+                "id": video_id,
+                "title": f"Synthetic video {video_id}",
+                "webpage_url": url,
+                "formats": [
+                    {
+                        "format_id": "synthetic",
+                        "url": f"{base_url}/video/{video_id}",
+                        "ext": "mp4",
+                        "filesize": size,
+                        "vcodec": "h264",
+                        "acodec": "aac",
+                    }
+                ],
+            }
+
+    class StubPlaylistIE(InfoExtractor):
+        IE_NAME = "stub:playlist"
+        _VALID_URL = r"https?://(?:www\.)?youtube\.com/playlist\?list=(?P<id>[\w-]+)"
+
+        def _real_extract(self, url):
+            playlist_id = self._match_id(url)
+            entries = (
+                self.url_result(
+                    f"https://www.youtube.com/watch?v={video_id}",
+                    StubVideoIE,
+                    video_id,
+                    f"Synthetic video {video_id}",
+                )
+                for video_id in playlists[playlist_id]
+            )
+            return self.playlist_result(
+                entries, playlist_id, f"Synthetic playlist {playlist_id}"
+            )
+
+    class StubYoutubeDL(yt_dlp.YoutubeDL):
+        def __init__(self, params=None):
+            super().__init__(params, auto_init=False)
+            self.add_info_extractor(StubPlaylistIE())
+            self.add_info_extractor(StubVideoIE())
+
+    return StubYoutubeDL
+
+
+# ---------------------------------------------------------------------------
+# 场景
+# ---------------------------------------------------------------------------
+
+
+def prepare_app(directory, args):
+    """将程序复制到临时目录并生成配置文件，所有数据库和下载文件都写入该目录"""
+    for path in glob.glob(os.path.join(REPO_DIR, "*.py")):
+        shutil.copy(path, directory)
+    config_dir = os.path.join(directory, "config")
+    os.makedirs(config_dir)
+    config = {
+        "api_id": 1,
+        "api_hash": "benchmark",
+        "bot_account": {"token": "benchmark"},
+        "youtube_download": {"workers": args.youtube_workers},
+        "telegram_download": {"connections": args.connections},
+        "job_queue": {"workers": args.workers, "per_chat_limit": args.workers},
+        # 默认不限速，只测量下载流程本身的性能
+        "rate_limit": {
+            "global_mbps": args.rate_limit,
+            "edits_per_minute": args.edits_per_minute,
+        },
+        "log_level": "WARNING",
+    }
+    with open(os.path.join(config_dir, "config.yaml"), "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f)
+
+
+class Recorder:
+    """记录每条消息从收到到处理完成的耗时"""
+
+    def __init__(self):
+        self.started = {}
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+
+    def start(self, key):
+        self.started[key] = time.perf_counter()
+
+    def finish(self, key, size):
+        self.latencies.append(time.perf_counter() - self.started.pop(key))
+        self.bytes += size
+
+
+async def run_sequential(main, messages, sizes):
+    recorder = Recorder()
+    for message, size in zip(messages, sizes):
+        recorder.start(message.id)
+        try:
+            # 链接消息和下载队列一样先经过链接分派
+            route = main.url_router.ROUTER.route(message.text) if message.text else None
+            await main.process_download(message, route=route)
+            # 移动文件失败等情况不会抛出异常，只会回复用户
+            if any("失败" in reply for reply in message.replies):
+                recorder.errors += 1
+        except Exception:
+            recorder.errors += 1
+        recorder.finish(message.id, size)
+    return recorder
+
+
+async def run_burst(main, messages, sizes):
+    """模拟同时收到多条消息：经过 download_video 入队，由下载队列并发处理"""
+    recorder = Recorder()
+    client = FakeClient()
+    main.register_handlers(client)
+    remaining = len(messages)
+    finished = asyncio.Event()
+    size_by_id = {message.id: size for message, size in zip(messages, sizes)}
+    process_download = main.process_download
+
+    async def timed_process_download(message, refresh=False, route=None):
+        nonlocal remaining
+        try:
+            await process_download(message, refresh=refresh, route=route)
+        except Exception:
+            recorder.errors += 1
+            raise
+        finally:
+            recorder.finish(message.id, size_by_id[message.id])
+            remaining -= 1
+            if not remaining:
+                finished.set()
+
+    main.job_queue.max_retries = 0
+    with mock.patch.object(main, "process_download", timed_process_download):
+        main.job_queue.start(lambda job: main.process_download_job(client, job))
+        try:
+            for message in messages:
+                recorder.start(message.id)
+                await client.dispatch(message)
+            await finished.wait()
+        finally:
+            await main.job_queue.stop()
+    return recorder
+
+
+def telegram_messages(count, size, first_id=1):
+    messages = []
+    for message_id in range(first_id, first_id + count):
+        doc_id = 10_000_000 + message_id
+        FILE_SIZES[doc_id] = size
+        media = make_document_media(doc_id, size, f"bench_{message_id}.mp4")
+        messages.append(FakeMessage(1000, message_id, media=media))
+    return messages, [size] * count
+
+
+async def run_scenario(name, args):
+    import main  # 导入时读取临时目录中的配置
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # 程序启动后会在后台生成链接分派表，这里提前生成，不计入耗时
+    main.url_router.ROUTER.warm_up()
+    mb = 1024 * 1024
+    tg_patch = patch_parallel_downloader(args.latency / 1000, args.bandwidth * mb)
+    server = start_video_server(args.bandwidth * mb)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    playlists = {}
+    ydl_patch = mock.patch("yt_dlp.YoutubeDL", make_stub_ydl_class(base_url, playlists))
+
+    start = time.perf_counter()
+    with tg_patch, ydl_patch:
+        if name == "telegram_single":
+            messages, sizes = telegram_messages(args.count, args.size * mb)
+            start = time.perf_counter()
+            recorder = await run_sequential(main, messages, sizes)
+        elif name == "telegram_burst":
+            messages, sizes = telegram_messages(args.burst, args.size * mb)
+            start = time.perf_counter()
+            recorder = await run_burst(main, messages, sizes)
+        elif name == "telegram_large":
+            messages, sizes = telegram_messages(1, args.large_size * mb)
+            start = time.perf_counter()
+            recorder = await run_sequential(main, messages, sizes)
+        elif name == "telegram_album":
+            messages, sizes = telegram_messages(args.album_size, args.size * mb)
+            for message in messages:
+                message.grouped_id = 1
+            # 相册按单个文件统计，耗时为从收到相册到该文件保存完成的时间
+            move_telegram_file = main.move_telegram_file
+            finished = []
+
+            async def timed_move_telegram_file(*move_args):
+                result = await move_telegram_file(*move_args)
+                finished.append(time.perf_counter() - start)
+                return result
+
+            recorder = Recorder()
+            start = time.perf_counter()
+            with mock.patch.object(
+                main, "move_telegram_file", timed_move_telegram_file
+            ):
+                try:
+                    await main.process_album(messages)
+                except Exception:
+                    pass
+            recorder.latencies = finished
+            recorder.bytes = args.size * mb * len(finished)
+            recorder.errors = len(messages) - len(finished)
+        elif name == "youtube_single":
+            messages, sizes = [], []
+            for i in range(args.count):
+                video_id = f"vid{i:08d}"
+                SyntheticVideoHandler.sizes[video_id] = args.size * mb
+                url = f"https://www.youtube.com/watch?v={video_id}"
+                messages.append(FakeMessage(1000, i + 1, text=url))
+                sizes.append(args.size * mb)
+            start = time.perf_counter()
+            recorder = await run_sequential(main, messages, sizes)
+        elif name == "youtube_playlist":
+            video_ids = [f"pl{i:09d}" for i in range(args.playlist_size)]
+            for video_id in video_ids:
+                SyntheticVideoHandler.sizes[video_id] = args.size * mb
+            playlists["PLbench"] = video_ids
+            url = "https://www.youtube.com/playlist?list=PLbench"
+            message = FakeMessage(1000, 1, text=url)
+            # 播放列表按单个视频统计，耗时为从收到链接到该视频保存完成的时间
+            record_download = main.record_download
+            finished = []
+
+            async def timed_record_download(*record_args):
+                result = await record_download(*record_args)
+                finished.append(time.perf_counter() - start)
+                return result
+
+            start = time.perf_counter()
+            with mock.patch.object(main, "record_download", timed_record_download):
+                recorder = await run_sequential(
+                    main, [message], [args.size * mb * len(video_ids)]
+                )
+            recorder.latencies = finished
+            recorder.errors += len(video_ids) - len(finished)
+        else:
+            raise ValueError(f"未知场景: {name}")
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    main.youtube_executor.shutdown(wait=False)
+
+    return {
+        "scenario": name,
+        "messages": len(recorder.latencies),
+        "errors": recorder.errors,
+        "elapsed": elapsed,
+        "messages_per_sec": len(recorder.latencies) / elapsed,
+        "mb_per_sec": recorder.bytes / mb / elapsed,
+        "p50": percentile(recorder.latencies, 50),
+        "p99": percentile(recorder.latencies, 99),
+        # Linux 下 ru_maxrss 的单位是KB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_one(name, args):
+    """在当前进程中运行单个场景并以JSON输出结果"""
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_app(directory, args)
+        sys.path.insert(0, directory)
+        os.chdir(directory)
+        result = asyncio.run(run_scenario(name, args))
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    parser.add_argument("--count", type=int, default=20, help="顺序处理的消息数")
+    parser.add_argument("--burst", type=int, default=50, help="同时转发的消息数")
+    parser.add_argument("--size", type=int, default=4, help="普通文件大小（MB）")
+    parser.add_argument("--large-size", type=int, default=256, help="大文件大小（MB）")
+    parser.add_argument("--album-size", type=int, default=10, help="相册文件数")
+    parser.add_argument("--playlist-size", type=int, default=20, help="播放列表视频数")
+    parser.add_argument("--connections", type=int, default=4, help="并行下载连接数")
+    parser.add_argument("--workers", type=int, default=4, help="下载队列worker数")
+    parser.add_argument(
+        "--youtube-workers", type=int, default=2, help="YouTube下载线程数"
+    )
+    parser.add_argument("--latency", type=float, default=20, help="请求延迟（毫秒）")
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=0,
+        help="单连接带宽上限（MB/s），0 表示不限速",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=0,
+        help="程序的全局限速（MB/s），0 表示不限速",
+    )
+    parser.add_argument(
+        "--edits-per-minute",
+        type=int,
+        default=0,
+        help="状态消息每分钟的编辑次数上限，0 表示不限制",
+    )
+    parser.add_argument("--run-one", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args.run_one, args)
+        return
+
+    # 每个场景在独立进程中运行，峰值内存互不影响
+    forwarded = sys.argv[1:]
+    print(
+        f"{'场景':<18}{'消息数':>6}{'失败':>5}{'消息/秒':>10}{'MB/s':>10}"
+        f"{'p50(s)':>9}{'p99(s)':>9}{'峰值内存(MB)':>14}"
+    )
+    for name in args.scenarios:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *forwarded, "--run-one", name],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{name:<18}{result['messages']:>6}{result['errors']:>5}"
+            f"{result['messages_per_sec']:>10.2f}{result['mb_per_sec']:>10.2f}"
+            f"{result['p50']:>9.3f}{result['p99']:>9.3f}"
+            f"{result['peak_rss_mb']:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+对比 Telethon download_media 与多连接并行下载的吞吐量
+
+本地启动一个模拟 Telegram 文件服务器的 TCP 服务：每个连接按请求返回指定偏移的数据，
+并模拟单次请求延迟和单连接带宽上限（与 Telegram 对单个连接的限速方式一致）。
+对比基准直接调用 Telethon 的 download_media，只把客户端的 MTProto 连接替换为
+连接模拟服务器的 StandInSender，分片大小、请求顺序和写文件方式都是 Telethon
+自己的实现（100MB 以内的文件每次只请求 128KB，请求延迟对它的影响比并行下载
+使用的 512KB 分片更大）。
+
+用法:
+    python benchmarks/bench_telegram_download.py --size 256 --connections 1 4 8
+"""
+
+import argparse
+import asyncio
+import functools
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon import TelegramClient, functions, types  # noqa: E402
+from telethon.sessions import StringSession  # noqa: E402
+
+from telegram_download import ParallelDownloader  # noqa: E402
+
+REQUEST = struct.Struct(">QI")  # offset, limit
+RESPONSE = struct.Struct(">I")  # length
+
+
+class StandInServer:
+    """模拟 Telegram 文件服务器"""
+
+    def __init__(self, size, latency, bandwidth):
+        self.size = size
+        self.latency = latency  # 单次请求延迟（秒）
+        self.bandwidth = bandwidth  # 单连接带宽（字节/秒）
+        self.payload = os.urandom(1024 * 1024)
+        self.server = None
+
+    def _read(self, offset, limit):
+        length = max(0, min(limit, self.size - offset))
+        start = offset % len(self.payload)
+        data = self.payload[start : start + length]
+        while len(data) < length:
+            data += self.payload[: length - len(data)]
+        return data
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                offset, limit = REQUEST.unpack(await reader.readexactly(REQUEST.size))
+                data = self._read(offset, limit)
+                await asyncio.sleep(self.latency + len(data) / self.bandwidth)
+                writer.write(RESPONSE.pack(len(data)) + data)
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class StandInSender:
+    """代替 MTProtoSender，把 GetFileRequest 转发给模拟服务器"""
+
+    def __init__(self, port):
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def send(self, request):
+        if not isinstance(request, functions.upload.GetFileRequest):
+            raise NotImplementedError(type(request).__name__)
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                "127.0.0.1", self.port
+            )
+        self._writer.write(REQUEST.pack(request.offset, request.limit))
+        await self._writer.drain()
+        (length,) = RESPONSE.unpack(await self._reader.readexactly(RESPONSE.size))
+        data = await self._reader.readexactly(length)
+        return types.upload.File(type=types.storage.FilePartial(), mtime=0, bytes=data)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+
+
+class StandInClient(TelegramClient):
+    """不连接 Telegram 的客户端，请求直接交给 StandInSender"""
+
+    def __init__(self, port):
+        super().__init__(StringSession(), api_id=1, api_hash="0" * 32)
+        self._sender = StandInSender(port)
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        return await sender.send(request)
+
+
+async def download_media(port, size, path):
+    """使用 Telethon 的 download_media 下载模拟服务器上的文档"""
+    client = StandInClient(port)
+    document = types.Document(
+        id=1,
+        access_hash=0,
+        file_reference=b"",
+        date=None,
+        mime_type="application/octet-stream",
+        size=size,
+        dc_id=client.session.dc_id,
+        attributes=[],
+    )
+    try:
+        await client.download_media(document, file=path)
+    finally:
+        await client._sender.close()
+
+
+class StandInDownloader(ParallelDownloader):
+    """连接本地模拟服务器的下载器，每个连接对应一个 TCP 连接"""
+
+    def __init__(self, port, connections):
+        super().__init__(None, connections)
+        self.port = port
+
+    async def _create_sender(self, dc_id):
+        return await asyncio.open_connection("127.0.0.1", self.port)
+
+    async def _close_sender(self, sender):
+        sender[1].close()
+        await sender[1].wait_closed()
+
+    async def _fetch_part(self, sender, location, offset, limit):
+        reader, writer = sender
+        writer.write(REQUEST.pack(offset, limit))
+        await writer.drain()
+        (length,) = RESPONSE.unpack(await reader.readexactly(RESPONSE.size))
+        return await reader.readexactly(length)
+
+
+async def run(args):
+    size = args.size * 1024 * 1024
+    server = StandInServer(size, args.latency / 1000, args.bandwidth * 1024 * 1024)
+    port = await server.start()
+    print(
+        f"文件大小: {args.size} MB, 请求延迟: {args.latency} ms, "
+        f"单连接带宽: {args.bandwidth} MB/s"
+    )
+    baseline = None
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            runs = [("download_media", 1, functools.partial(download_media, port))]
+            for connections in args.connections:
+                downloader = StandInDownloader(port, connections)
+                runs.append(
+                    (
+                        "ParallelDownloader",
+                        connections,
+                        functools.partial(downloader.download, 0, None),
+                    )
+                )
+            for label, connections, download in runs:
+                path = os.path.join(directory, f"bench_{label}_{connections}.bin")
+                start = time.perf_counter()
+                await download(size, path)
+                elapsed = time.perf_counter() - start
+                if os.path.getsize(path) != size:
+                    raise RuntimeError(f"{label} 下载的文件大小不正确")
+                os.remove(path)
+                baseline = baseline or elapsed
+                print(
+                    f"{label:<20} 连接数={connections:<3} 耗时={elapsed:7.2f}s "
+                    f"吞吐={args.size / elapsed:8.2f} MB/s "
+                    f"加速={baseline / elapsed:5.2f}x"
+                )
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=128, help="文件大小（MB）")
+    parser.add_argument(
+        "--connections",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="并行下载要测试的连接数，加速比以 download_media 为基准",
+    )
+    parser.add_argument("--latency", type=float, default=50, help="请求延迟（毫秒）")
+    parser.add_argument(
+        "--bandwidth", type=float, default=20, help="单连接带宽上限（MB/s）"
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from telethon import utils
+from telethon.errors import FloodWaitError
+
+import bandwidth
+import client_pool
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 投递状态
+STATE_PENDING = "pending"
+STATE_SENT = "sent"
+STATE_FAILED = "failed"
+
+
+def parse_targets(task):
+    """定时消息的发送目标，chat_id 可以是单个会话或列表，也可以使用 chat_ids"""
+    targets = task.get("chat_ids") or task.get("chat_id") or []
+    if not isinstance(targets, list):
+        targets = [targets]
+    return [str(target).strip() for target in targets if str(target).strip()]
+
+
+def last_scheduled_time(hour, minute, now=None):
+    """每天 hour:minute 执行的任务在 now 之前（含）最近一次应执行的时间戳"""
+    now = now or datetime.now()
+    scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if scheduled > now:
+        scheduled -= timedelta(days=1)
+    return scheduled.timestamp()
+
+
+class BroadcastStore:
+    """
+    定时消息的持久化状态
+
+    记录每个定时任务最近一次执行的时间（重启后据此补发错过的消息）、
+    每次执行中每个目标的投递状态（中断后继续发送未完成的目标），
+    以及目标会话解析后的ID（之后不需要再通过用户名解析）。
+    """
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                job_id TEXT PRIMARY KEY,
+                last_fire_time REAL NOT NULL
+            )
+            """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                fire_time REAL NOT NULL,
+                target TEXT NOT NULL,
+                message TEXT NOT NULL,
+                state TEXT NOT NULL,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                UNIQUE (job_id, fire_time, target)
+            )
+            """)
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_deliveries_state ON deliveries (state)"
+        )
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entities (
+                target TEXT PRIMARY KEY,
+                peer_id INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """)
+        self._db.commit()
+
+    def last_fire_time(self, job_id):
+        row = self._db.execute(
+            "SELECT last_fire_time FROM runs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_last_fire_time(self, job_id, fire_time):
+        self._db.execute(
+            "INSERT OR REPLACE INTO runs (job_id, last_fire_time) VALUES (?, ?)",
+            (job_id, fire_time),
+        )
+        self._db.commit()
+
+    def create_run(self, job_id, fire_time, targets, message):
+        """登记一次执行的所有目标，同一次执行重复登记时不会重复发送"""
+        now = time.time()
+        self._db.executemany(
+            "INSERT OR IGNORE INTO deliveries "
+            "(job_id, fire_time, target, message, state, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (job_id, fire_time, target, message, STATE_PENDING, now)
+                for target in targets
+            ],
+        )
+        self.set_last_fire_time(job_id, fire_time)
+
+    def pending(self, job_id=None):
+        """未完成的投递 (id, job_id, fire_time, target, message)"""
+        query = (
+            "SELECT id, job_id, fire_time, target, message FROM deliveries "
+            "WHERE state = ?"
+        )
+        params = [STATE_PENDING]
+        if job_id is not None:
+            query += " AND job_id = ?"
+            params.append(job_id)
+        return self._db.execute(query + " ORDER BY id", params).fetchall()
+
+    def finish(self, delivery_id, state, error=None):
+        self._db.execute(
+            "UPDATE deliveries SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+            (state, error, time.time(), delivery_id),
+        )
+        self._db.commit()
+
+    def get_peer_id(self, target):
+        row = self._db.execute(
+            "SELECT peer_id FROM entities WHERE target = ?", (target,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_peer_id(self, target, peer_id):
+        self._db.execute(
+            "INSERT OR REPLACE INTO entities (target, peer_id, updated_at) "
+            "VALUES (?, ?, ?)",
+            (target, peer_id, time.time()),
+        )
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+class Broadcaster:
+    """
+    向大量会话发送定时消息
+
+    同时发送的消息数受 concurrency 限制，发送频率受 messages_per_second 限制。
+    遇到 FloodWait 时所有发送暂停到限流结束，然后重试被限流的目标。
+    目标会话只在第一次发送时解析，解析结果保存在内存和数据库中。
+    """
+
+    def __init__(
+        self, client, store, concurrency=4, messages_per_second=1, misfire_grace=3600
+    ):
+        self.client = client
+        self.store = store
+        self.concurrency = max(1, int(concurrency))
+        self.rate = bandwidth.TokenBucket(messages_per_second or 0, burst=1)
+        self.misfire_grace = misfire_grace
+        self._entities = {}
+        self._paused_until = 0.0
+        self._locks = {}  # job_id -> 发送锁
+
+    async def _resolve(self, target):
+        """解析目标会话，依次使用内存缓存、数据库中的ID和用户名"""
+        entity = self._entities.get(target)
+        if entity is not None:
+            return entity
+        peer_id = self.store.get_peer_id(target)
+        if peer_id is None and target.lstrip("-").isdigit():
+            peer_id = int(target)
+        if peer_id is not None:
+            # Telethon 会话中缓存了访问过的会话，按ID获取不需要网络请求
+            entity = await self.client.get_input_entity(peer_id)
+        else:
+            entity = await self.client.get_input_entity(target)
+            self.store.set_peer_id(target, utils.get_peer_id(entity))
+        self._entities[target] = entity
+        return entity
+
+    async def _wait_turn(self):
+        """等待限流结束和发送频率限制"""
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        delay = self.rate.reserve(1)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _deliver(self, delivery):
+        """发送一条消息并记录结果，被限流时等待后重试"""
+        delivery_id, job_id, _, target, message = delivery
+        while True:
+            await self._wait_turn()
+            try:
+                entity = await self._resolve(target)
+                await self.client.send_message(entity, message)
+            except FloodWaitError as e:
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + e.seconds
+                )
+                # 同一会话的下载也会避开限流时间
+                client_pool.POOL.report_flood_wait(self.client, e.seconds)
+                logger.warning(f"定时消息 {job_id} 被限流，暂停 {e.seconds} 秒后继续")
+                continue
+            except Exception as e:
+                self.store.finish(delivery_id, STATE_FAILED, str(e))
+                metrics.SCHEDULED_MESSAGES.inc(status=STATE_FAILED)
+                logger.error(f"定时消息 {job_id} 发送到 {target} 失败: {str(e)}")
+                return False
+            self.store.finish(delivery_id, STATE_SENT)
+            metrics.SCHEDULED_MESSAGES.inc(status=STATE_SENT)
+            return True
+
+    async def _deliver_pending(self, job_id):
+        deliveries = self.store.pending(job_id)
+        if not deliveries:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(delivery):
+            async with semaphore:
+                return await self._deliver(delivery)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[deliver(d) for d in deliveries])
+        logger.info(
+            f"定时消息 {job_id} 发送完成: 成功 {sum(results)}/{len(results)}，"
+            f"耗时 {time.perf_counter() - start:.1f}s"
+        )
+
+    async def run(self, job_id):
+        """发送一个定时任务中所有未完成的投递，同一任务不会并发发送"""
+        lock = self._locks.setdefault(job_id, asyncio.Lock())
+        async with lock:
+            await self._deliver_pending(job_id)
+
+    async def fire(self, job_id, targets, message, hour, minute):
+        """定时任务触发，登记本次执行的所有目标后开始发送"""
+        fire_time = last_scheduled_time(hour, minute)
+        self.store.create_run(job_id, fire_time, targets, message)
+        await self.run(job_id)
+
+    def expire_pending(self, job_id=None):
+        """超过补发期限的未完成投递标记为失败"""
+        deadline = time.time() - self.misfire_grace
+        for delivery_id, _, fire_time, target, _ in self.store.pending(job_id):
+            if fire_time < deadline:
+                self.store.finish(delivery_id, STATE_FAILED, "超过补发期限")
+                logger.warning(f"定时消息发送到 {target} 已超过补发期限，不再发送")
+
+    async def catch_up(self, jobs):
+        """
+        启动时补发错过的定时消息并继续上次未完成的发送
+
+        jobs 为 (job_id, targets, message, hour, minute) 列表。
+        最近一次应执行的时间晚于上次执行且在补发期限内时立即执行一次；
+        第一次运行的任务只记录当前时间。
+        """
+        self.expire_pending()
+        now = time.time()
+        runs = []
+        for job_id, targets, message, hour, minute in jobs:
+            last_fire = self.store.last_fire_time(job_id)
+            scheduled = last_scheduled_time(hour, minute)
+            if last_fire is None:
+                self.store.set_last_fire_time(job_id, now)
+            elif last_fire < scheduled and now - scheduled <= self.misfire_grace:
+                logger.info(
+                    f"补发错过的定时消息 {job_id}（应于 "
+                    f"{datetime.fromtimestamp(scheduled):%Y-%m-%d %H:%M} 发送）"
+                )
+                self.store.create_run(job_id, scheduled, targets, message)
+            if self.store.pending(job_id):
+                runs.append(self.run(job_id))
+        await asyncio.gather(*runs)
@@ -0,0 +1,150 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from telethon import types
+from telethon.errors import FloodWaitError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PooledClient:
+    """连接池中的一个会话及其当前负载"""
+
+    def __init__(self, name, client, bot=False):
+        self.name = name
+        self.client = client
+        self.bot = bot
+        self.in_flight = 0
+        self.flood_until = 0.0
+        self.unreachable = set()  # 该会话无法访问的频道ID
+
+    def healthy(self):
+        return time.monotonic() >= self.flood_until and self.client.is_connected()
+
+
+def _media_id(message):
+    media = message.media
+    if hasattr(media, "document"):
+        return media.document.id
+    if hasattr(media, "photo"):
+        return media.photo.id
+    return None
+
+
+def _channel_source(message):
+    """
+    返回可以在其他会话中获取同一条消息的 (频道, 消息ID)，没有时返回None
+
+    私聊和普通群组中的消息ID对每个账号都不同，只有频道和超级群组的消息可以跨会话获取。
+    """
+    fwd = message.fwd_from
+    if fwd and isinstance(fwd.from_id, types.PeerChannel) and fwd.channel_post:
+        return fwd.from_id, fwd.channel_post
+    if isinstance(message.peer_id, types.PeerChannel):
+        return message.peer_id, message.id
+    return None
+
+
+class ClientPool:
+    """
+    机器人和用户账号会话的连接池
+
+    下载Telegram文件时选择正在下载的文件最少、且没有被限流的会话，
+    在该会话中重新获取同一条消息后下载。其他会话无法访问该消息时使用收到消息的会话。
+    """
+
+    def __init__(self):
+        self.members = []
+
+    def add(self, name, client, bot=False):
+        self.members.append(PooledClient(name, client, bot))
+        metrics.CLIENT_IN_FLIGHT.set(0, client=name)
+        logger.info(f"会话 {name} 已加入下载连接池")
+
+    def _member(self, client):
+        for member in self.members:
+            if member.client is client:
+                return member
+        return None
+
+    def report_flood_wait(self, client, seconds):
+        """记录会话被限流，限流期间不再分配新的下载"""
+        member = self._member(client)
+        if member:
+            member.flood_until = max(member.flood_until, time.monotonic() + seconds)
+            metrics.FLOOD_WAITS.inc(client=member.name)
+            logger.warning(f"会话 {member.name} 被限流 {seconds} 秒")
+
+    def _candidates(self, origin):
+        """按负载排序的候选会话，负载相同时优先使用收到消息的会话"""
+        healthy = [member for member in self.members if member.healthy()]
+        healthy.sort(key=lambda member: (member.in_flight, member is not origin))
+        if origin not in healthy:
+            # 收到消息的会话被限流时仍作为最后的选择
+            healthy.append(origin)
+        return healthy
+
+    async def _resolve(self, member, message, source):
+        """在指定会话中获取同一条消息，无法访问时返回None"""
+        channel, message_id = source
+        if channel.channel_id in member.unreachable:
+            return None
+        try:
+            resolved = await member.client.get_messages(channel, ids=message_id)
+        except FloodWaitError as e:
+            self.report_flood_wait(member.client, e.seconds)
+            return None
+        except Exception as e:
+            logger.debug(f"会话 {member.name} 无法访问频道 {channel.channel_id}: {e}")
+            member.unreachable.add(channel.channel_id)
+            return None
+        if resolved is None or _media_id(resolved) != _media_id(message):
+            return None
+        return resolved
+
+    @asynccontextmanager
+    async def lease(self, message):
+        """
+        为下载选择会话，返回在该会话中获取的消息
+
+        下载期间该会话的负载加一，下载时被限流会记录到会话上。
+        """
+        origin = self._member(message.client)
+        if origin is None:
+            # 不在连接池中的会话（例如测试中的模拟客户端）直接使用原消息
+            yield message
+            return
+
+        member, resolved = origin, message
+        source = _channel_source(message)
+        if source:
+            for candidate in self._candidates(origin):
+                if candidate is origin:
+                    # 负载更低的会话都无法访问该消息
+                    break
+                # 获取消息期间先占用该会话，避免同时开始的下载都选中它
+                candidate.in_flight += 1
+                other = await self._resolve(candidate, message, source)
+                candidate.in_flight -= 1
+                if other is not None:
+                    member, resolved = candidate, other
+                    break
+
+        if member is not origin:
+            logger.info(f"使用会话 {member.name} 下载消息 {message.id}")
+        member.in_flight += 1
+        metrics.CLIENT_IN_FLIGHT.set(member.in_flight, client=member.name)
+        try:
+            yield resolved
+        except FloodWaitError as e:
+            self.report_flood_wait(member.client, e.seconds)
+            raise
+        finally:
+            member.in_flight -= 1
+            metrics.CLIENT_IN_FLIGHT.set(member.in_flight, client=member.name)
+
+
+POOL = ClientPool()
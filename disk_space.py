@@ -0,0 +1,184 @@
+import asyncio
+import errno
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 空间不足时重新检查剩余空间的间隔（秒），其他下载释放预留空间时会立即检查
+CHECK_INTERVAL = 5
+
+
+def free_bytes(directory):
+    """目录所在文件系统中普通用户可用的字节数和总字节数"""
+    stat = os.statvfs(directory)
+    return stat.f_bavail * stat.f_frsize, stat.f_blocks * stat.f_frsize
+
+
+def preallocate(fd, size):
+    """
+    为文件预分配 size 字节的磁盘空间，空间不足时立即抛出 OSError
+
+    预分配可以减少并行写入不同偏移位置造成的碎片；文件系统不支持时只设置文件大小。
+    glibc 在不支持 fallocate 的文件系统上会逐块写入来模拟，大文件耗时较长，
+    需要在线程池中调用。
+    """
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except AttributeError:
+        pass  # 部分平台（如 macOS）没有 posix_fallocate
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+            raise
+    # posix_fallocate 不会缩小文件，上次下载留下的文件可能更大
+    if os.fstat(fd).st_size != size:
+        os.ftruncate(fd, size)
+
+
+def estimate_ytdlp_size(info):
+    """根据 yt-dlp 选择的格式估算下载需要的磁盘空间，无法估算时返回0"""
+    size = info.get("filesize") or info.get("filesize_approx")
+    if not size and info.get("tbr") and info.get("duration"):
+        # tbr 的单位为 KBit/s
+        size = info["tbr"] * 1000 / 8 * info["duration"]
+    size = int(size or 0)
+    if "+" in str(info.get("format_id") or ""):
+        # 合并音视频时各部分和合并后的文件同时存在
+        size *= 2
+    return size
+
+
+class Reservation:
+    """一次下载预留的磁盘空间，已经写入磁盘的部分不再计入预留"""
+
+    def __init__(self, device, size):
+        self.device = device
+        self.size = size
+        self.consumed = 0
+
+    @property
+    def remaining(self):
+        return max(0, self.size - self.consumed)
+
+    def consume(self, amount):
+        """记录已经写入（或预分配）的总字节数"""
+        self.consumed = max(self.consumed, amount)
+
+    def wrap_hook(self, hook):
+        """包装 yt-dlp 的 progress hook，按所有文件已下载的字节数减少预留"""
+        downloaded = {}
+
+        def wrapped(d):
+            if d.get("status") in ("downloading", "finished"):
+                key = d.get("tmpfilename") or d.get("filename")
+                current = d.get("downloaded_bytes") or d.get("total_bytes") or 0
+                downloaded[key] = max(downloaded.get(key, 0), current)
+                self.consume(sum(downloaded.values()))
+            if hook:
+                hook(d)
+
+        return wrapped
+
+
+class SpaceManager:
+    """
+    下载前的磁盘空间准入控制
+
+    每个下载开始前按文件大小预留空间，剩余空间减去其他下载尚未写入的预留后
+    低于 min_free 时等待，直到其他下载完成或超时。超时后抛出 ENOSPC，由下载队列稍后重试。
+    """
+
+    def __init__(self):
+        self.min_free = 0
+        self.wait_timeout = 0
+        self._reservations = []
+        self._lock = threading.Lock()
+        self._released = None
+
+    def configure(self, min_free_mb=0, wait_timeout_minutes=0):
+        self.min_free = max(0, (min_free_mb or 0) * 1024 * 1024)
+        self.wait_timeout = max(0, (wait_timeout_minutes or 0) * 60)
+
+    def outstanding(self, device=None):
+        """尚未写入磁盘的预留空间"""
+        with self._lock:
+            return sum(
+                reservation.remaining
+                for reservation in self._reservations
+                if device is None or reservation.device == device
+            )
+
+    def _admit(self, directory, device, size):
+        """空间足够时登记预留并返回 Reservation，否则返回剩余空间"""
+        available, total = free_bytes(directory)
+        if size + self.min_free > total:
+            raise OSError(
+                errno.ENOSPC,
+                f"文件大小 {size / 1024 / 1024:.1f}MB 超过磁盘容量 {directory}",
+            )
+        with self._lock:
+            outstanding = sum(
+                reservation.remaining
+                for reservation in self._reservations
+                if reservation.device == device
+            )
+            available -= outstanding
+            if available - size < self.min_free:
+                return None, available
+            reservation = Reservation(device, size)
+            self._reservations.append(reservation)
+        return reservation, available
+
+    @asynccontextmanager
+    async def reserve(self, directory, size):
+        """
+        在 directory 所在的磁盘上预留 size 字节，空间不足时等待
+
+        返回的 Reservation 需要在写入时调用 consume，退出时释放剩余的预留。
+        """
+        size = max(0, int(size or 0))
+        if not self.min_free and not size:
+            yield Reservation(None, 0)
+            return
+        if self._released is None:
+            self._released = asyncio.Event()
+        device = os.stat(directory).st_dev
+        start = time.monotonic()
+        reservation, available = self._admit(directory, device, size)
+        if reservation is None:
+            logger.warning(
+                f"{directory} 剩余空间不足（可用 {available / 1024 / 1024:.1f}MB，"
+                f"需要 {size / 1024 / 1024:.1f}MB，"
+                f"保留 {self.min_free / 1024 / 1024:.0f}MB），等待其他下载完成"
+            )
+        while reservation is None:
+            waited = time.monotonic() - start
+            if self.wait_timeout and waited >= self.wait_timeout:
+                metrics.DISK_WAIT_SECONDS.inc(waited)
+                raise OSError(errno.ENOSPC, f"等待磁盘空间超时: {directory}")
+            interval = CHECK_INTERVAL
+            if self.wait_timeout:
+                interval = min(interval, self.wait_timeout - waited)
+            self._released.clear()
+            try:
+                await asyncio.wait_for(self._released.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            reservation, available = self._admit(directory, device, size)
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            metrics.DISK_WAIT_SECONDS.inc(waited)
+        try:
+            yield reservation
+        finally:
+            with self._lock:
+                self._reservations.remove(reservation)
+            self._released.set()
+
+
+SPACE = SpaceManager()
@@ -1,7 +1,4 @@
 #!/bin/bash
 
-# 运行Python程序
-python main.py || true
-
-# 保持容器运行
-tail -f /dev/null 
\ No newline at end of file
+# 运行Python程序，程序退出后由容器的重启策略重新启动（未完成的下载任务会自动恢复）
+exec python main.py
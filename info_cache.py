@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(url):
+    """生成缓存键，YouTube单个视频使用视频ID，其他链接使用规范化后的URL"""
+    from yt_dlp.extractor.youtube import YoutubeIE
+
+    url = url.strip()
+    if "://" not in url:
+        url = f"https://{url}"
+    if YoutubeIE.suitable(url):
+        return f"youtube:{YoutubeIE._match_id(url)}"
+    parts = urlsplit(url)
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, "")
+    )
+
+
+class InfoCache:
+    """
+    yt-dlp 解析结果的缓存
+
+    按最近使用顺序保留最多 max_entries 条结果，超过 ttl 秒的结果视为过期
+    （视频的下载地址有时效，ttl 不宜过长）。指定 db_path 时结果同时保存到
+    SQLite，重启后仍然有效。缓存会在下载线程中读写，所有操作都需要加锁。
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, db_path=None):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (过期时间, info)
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS info_cache (
+                    key TEXT PRIMARY KEY,
+                    info TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """)
+            self._db.commit()
+            self._load()
+
+    def _load(self):
+        """从数据库加载未过期的结果"""
+        now = time.time()
+        self._db.execute("DELETE FROM info_cache WHERE expires_at <= ?", (now,))
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT key, info, expires_at FROM info_cache ORDER BY expires_at"
+        ).fetchall()
+        for key, info, expires_at in rows[-self.max_entries :]:
+            try:
+                self._entries[key] = (expires_at, json.loads(info))
+            except ValueError:
+                logger.warning(f"缓存记录 {key} 已损坏，忽略")
+        if self._entries:
+            logger.info(f"已加载 {len(self._entries)} 条视频解析缓存")
+
+    def get(self, url):
+        """返回缓存的解析结果，不存在或已过期时返回None"""
+        key = cache_key(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._delete(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, url, info):
+        """缓存解析结果，info 需要是可以转换为JSON的字典（见 YoutubeDL.sanitize_info）"""
+        key = cache_key(url)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires_at, info)
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO info_cache (key, info, expires_at) "
+                    "VALUES (?, ?, ?)",
+                    (key, json.dumps(info), expires_at),
+                )
+            while len(self._entries) > self.max_entries:
+                self._delete(next(iter(self._entries)), commit=False)
+            if self._db is not None:
+                self._db.commit()
+
+    def remove(self, url):
+        with self._lock:
+            self._delete(cache_key(url))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM info_cache")
+                self._db.commit()
+
+    def _delete(self, key, commit=True):
+        """删除一条记录，调用方需要持有锁"""
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM info_cache WHERE key = ?", (key,))
+            if commit:
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
@@ -0,0 +1,194 @@
+import hashlib
+import logging
+import os
+import threading
+
+from media_index import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# 校验失败时自动重新下载的次数
+RETRIES = 1
+
+# 乱序到达的分片在内存中最多缓存的字节数，超过后轮到时再从文件中读回
+MAX_BUFFER = 64 * 1024 * 1024
+
+# 合并后的文件小于各部分大小之和的该比例时认为合并失败
+MERGE_MIN_RATIO = 0.9
+
+
+class IntegrityError(Exception):
+    """下载的文件不完整或已损坏"""
+
+
+class OrderedHasher:
+    """
+    在写入过程中按文件顺序计算 SHA-256，分片可以乱序写入
+
+    写入的分片先缓存在内存中，轮到它时再计算；缓存超过 max_buffer 时不再缓存，
+    轮到时从文件中读回（刚写入的数据通常仍在页缓存中）。
+    断点续传时已有的分片同样在轮到时从文件中读取。
+    """
+
+    def __init__(self, fd, size, part_size, done=(), max_buffer=MAX_BUFFER):
+        self.fd = fd
+        self.size = size
+        self.part_size = part_size
+        self.part_count = (size + part_size - 1) // part_size
+        self.max_buffer = max_buffer
+        self._sha256 = hashlib.sha256()
+        self._next = 0
+        self._ready = set(done)
+        self._buffer = {}
+        self._buffered = 0
+
+    def _length(self, index):
+        return min(self.part_size, self.size - index * self.part_size)
+
+    def add(self, index, data):
+        """分片 index 已写入文件"""
+        self._ready.add(index)
+        if index != self._next and self._buffered + len(data) <= self.max_buffer:
+            self._buffer[index] = data
+            self._buffered += len(data)
+        elif index == self._next:
+            self._sha256.update(data)
+            self._next += 1
+        self._advance()
+
+    def _advance(self):
+        while self._next in self._ready and self._next < self.part_count:
+            data = self._buffer.pop(self._next, None)
+            if data is None:
+                data = os.pread(
+                    self.fd, self._length(self._next), self._next * self.part_size
+                )
+            else:
+                self._buffered -= len(data)
+            self._sha256.update(data)
+            self._next += 1
+
+    def hexdigest(self):
+        """所有分片都已写入时返回文件的 SHA-256，否则抛出 IntegrityError"""
+        self._advance()
+        if self._next != self.part_count:
+            raise IntegrityError(f"文件缺少分片 {self._next}，共 {self.part_count} 个")
+        return self._sha256.hexdigest()
+
+
+class StreamHasher:
+    """
+    在 yt-dlp 的 progress hook 中计算下载文件的 SHA-256
+
+    每次回调时读取文件中新写入的部分（刚写入的数据仍在页缓存中，不会再读一遍磁盘），
+    下载完成时按最终文件名记录哈希和大小。
+    """
+
+    def __init__(self):
+        self._files = {}  # 下载中的临时文件名 -> [sha256, 已计算的字节数]
+        self._tmpnames = {}  # 最终文件名 -> 临时文件名
+        self.digests = {}  # 完成的文件名 -> (sha256, 大小, 文件标识)
+        self._lock = threading.Lock()
+
+    def _update(self, path):
+        state = self._files.get(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return state
+        if state is None or size < state[1]:
+            # 下载重新开始时文件会被截断
+            state = self._files[path] = [hashlib.sha256(), 0]
+        if size > state[1]:
+            with open(path, "rb") as file:
+                file.seek(state[1])
+                while True:
+                    chunk = file.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    state[0].update(chunk)
+                    state[1] += len(chunk)
+        return state
+
+    def hook(self, d):
+        status = d.get("status")
+        with self._lock:
+            if status == "downloading":
+                filename = d.get("filename")
+                path = d.get("tmpfilename") or filename
+                if path:
+                    if filename:
+                        self._tmpnames[filename] = path
+                    self._update(path)
+            elif status == "finished":
+                # 完成时临时文件已经重命名为最终文件名，finished 事件中只有 filename
+                filename = d.get("filename")
+                if not filename:
+                    return
+                tmpfilename = self._tmpnames.pop(filename, filename)
+                state = self._files.pop(tmpfilename, None)
+                if state is None:
+                    return
+                self._files[filename] = state
+                state = self._update(filename)
+                self._files.pop(filename, None)
+                self.digests[filename] = (
+                    state[0].hexdigest(),
+                    state[1],
+                    _identity(filename),
+                )
+
+    def wrap_hook(self, hook):
+        """包装 yt-dlp 的 progress hook，hook 可以为None"""
+
+        def wrapped(d):
+            try:
+                self.hook(d)
+            except Exception as e:
+                logger.warning(f"计算文件哈希失败: {str(e)}")
+            if hook:
+                hook(d)
+
+        return wrapped
+
+
+def _identity(path):
+    """文件的 inode 和修改时间，后处理（如修复容器）替换或改写文件后会变化"""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def verify_ytdlp_download(info, path, hasher):
+    """
+    检查 yt-dlp 下载的文件是否完整，返回文件的 SHA-256
+
+    文件未经后处理时哈希在下载过程中已经计算好，大小与 yt-dlp 报告的大小不一致时认为
+    文件不完整；合并或后处理过的文件重新读取计算哈希，合并的文件明显小于各部分之和时
+    认为合并失败。
+    """
+    if not path or not os.path.exists(path):
+        raise IntegrityError("未找到下载完成的文件")
+    size = os.path.getsize(path)
+    if size == 0:
+        raise IntegrityError(f"下载的文件为空: {path}")
+
+    download = (info.get("requested_downloads") or [info])[0]
+    streamed = hasher.digests.get(path)
+    if streamed and streamed[2] == _identity(path):
+        sha256, hashed_size, _ = streamed
+        expected = download.get("filesize")
+        if hashed_size != size or (expected and size != expected):
+            raise IntegrityError(
+                f"文件大小不一致: {path} 实际 {size}，"
+                f"期望 {expected or hashed_size}"
+            )
+        return sha256
+
+    formats = download.get("requested_formats") or info.get("requested_formats")
+    if formats:
+        sizes = [fmt.get("filesize") for fmt in formats]
+        if all(sizes) and size < sum(sizes) * MERGE_MIN_RATIO:
+            raise IntegrityError(
+                f"合并后的文件不完整: {path} 大小 {size}，各部分之和 {sum(sizes)}"
+            )
+    return file_sha256(path)
@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import deque
+
+import metrics
+import structured_log
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+STATE_PENDING = "pending"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+class JobError(Exception):
+    """任务执行失败且已通知用户，由队列决定是否重试"""
+
+
+class PermanentJobError(JobError):
+    """任务不可能成功（消息已删除、不支持的链接、没有可下载的文件等），不再重试"""
+
+
+class DownloadJob:
+    """下载任务"""
+
+    def __init__(
+        self,
+        job_id,
+        source,
+        chat_id,
+        message_id,
+        url=None,
+        retries=0,
+        message_ids=None,
+    ):
+        self.id = job_id
+        self.source = source  # telegram、album 或 youtube
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.url = url
+        self.retries = retries
+        self.message_ids = message_ids or [message_id]  # 相册中所有消息的ID
+        self.not_before = 0.0  # 重试的任务在该时间（time.monotonic）之前不执行
+
+    def __repr__(self):
+        return (
+            f"DownloadJob(id={self.id}, source={self.source}, "
+            f"chat_id={self.chat_id}, message_id={self.message_id})"
+        )
+
+
+class JobQueue:
+    """
+    持久化的下载任务队列
+
+    任务记录保存在 SQLite 中，程序重启后未完成的任务会重新入队。
+    固定数量的worker并发处理任务，同一会话同时处理的任务数受 per_chat_limit 限制，
+    不同会话之间轮流调度，避免单个会话占满所有worker。
+    失败的任务等待 retry_delay 秒后重试，之后每次重试的等待时间加倍；
+    抛出 PermanentJobError 的任务不再重试。
+    """
+
+    def __init__(
+        self, db_path, workers=4, per_chat_limit=2, max_retries=2, retry_delay=30
+    ):
+        self.db_path = db_path
+        self.workers = max(1, int(workers))
+        self.per_chat_limit = max(1, int(per_chat_limit))
+        self.max_retries = max(0, int(max_retries))
+        self.retry_delay = max(0, retry_delay or 0)
+
+        self._pending = {}  # chat_id -> deque[DownloadJob]
+        self._active = {}  # chat_id -> 正在处理的任务数
+        self._order = deque()  # 轮询顺序
+        self._cond = None
+        self._tasks = []
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                url TEXT,
+                state TEXT NOT NULL,
+                retries INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state)")
+        # 旧版本的数据库没有 message_ids 列
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        if "message_ids" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN message_ids TEXT")
+        self._db.commit()
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        self._db.execute(
+            f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+        )
+        self._db.commit()
+
+    def _push(self, job):
+        """将任务放入内存中的待处理队列"""
+        if job.chat_id not in self._pending:
+            self._pending[job.chat_id] = deque()
+            self._order.append(job.chat_id)
+        self._pending[job.chat_id].append(job)
+
+    def _pop_ready(self):
+        """
+        按会话轮询取出一个可执行的任务
+
+        所有会话都达到并发上限或只剩下未到重试时间的任务时返回None。
+        """
+        now = time.monotonic()
+        for _ in range(len(self._order)):
+            chat_id = self._order[0]
+            self._order.rotate(-1)
+            if self._active.get(chat_id, 0) >= self.per_chat_limit:
+                continue
+            jobs = self._pending[chat_id]
+            job = next((job for job in jobs if job.not_before <= now), None)
+            if job is None:
+                continue
+            jobs.remove(job)
+            if not jobs:
+                del self._pending[chat_id]
+                self._order.remove(chat_id)
+            self._active[chat_id] = self._active.get(chat_id, 0) + 1
+            return job
+        return None
+
+    def _retry_wait(self):
+        """距离最早的重试任务可以执行还需等待的秒数，没有等待重试的任务时返回None"""
+        now = time.monotonic()
+        delays = [
+            job.not_before - now
+            for jobs in self._pending.values()
+            for job in jobs
+            if job.not_before > now
+        ]
+        return max(0, min(delays)) if delays else None
+
+    async def enqueue(self, source, chat_id, message_id, url=None, message_ids=None):
+        """添加下载任务，返回任务ID，message_ids 为相册中所有消息的ID"""
+        now = time.time()
+        cursor = self._db.execute(
+            "INSERT INTO jobs (source, chat_id, message_id, url, message_ids, state, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                source,
+                chat_id,
+                message_id,
+                url,
+                ",".join(map(str, message_ids)) if message_ids else None,
+                STATE_PENDING,
+                now,
+                now,
+            ),
+        )
+        self._db.commit()
+        job = DownloadJob(
+            cursor.lastrowid, source, chat_id, message_id, url, message_ids=message_ids
+        )
+        async with self._cond:
+            self._push(job)
+            self._update_gauges()
+            self._cond.notify()
+        logger.info(f"任务已入队: {job}")
+        return job.id
+
+    def pending_count(self):
+        """内存中等待处理的任务数"""
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def active_count(self):
+        """正在处理的任务数"""
+        return sum(self._active.values())
+
+    def _update_gauges(self):
+        """更新队列长度和活动worker数指标"""
+        metrics.QUEUE_DEPTH.set(self.pending_count())
+        metrics.ACTIVE_WORKERS.set(self.active_count())
+
+    def _recover(self):
+        """将上次未完成的任务重新入队"""
+        rows = self._db.execute(
+            "SELECT id, source, chat_id, message_id, url, retries, message_ids "
+            "FROM jobs WHERE state IN (?, ?) ORDER BY id",
+            (STATE_PENDING, STATE_RUNNING),
+        ).fetchall()
+        for *row, message_ids in rows:
+            self._update(row[0], state=STATE_PENDING)
+            if message_ids:
+                message_ids = [int(message_id) for message_id in message_ids.split(",")]
+            self._push(DownloadJob(*row, message_ids=message_ids))
+        self._update_gauges()
+        if rows:
+            logger.info(f"恢复了 {len(rows)} 个未完成的下载任务")
+
+    async def _worker(self, handler):
+        while True:
+            async with self._cond:
+                job = self._pop_ready()
+                while job is None:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), self._retry_wait())
+                    except asyncio.TimeoutError:
+                        pass
+                    job = self._pop_ready()
+                self._update_gauges()
+
+            self._update(job.id, state=STATE_RUNNING)
+            start = time.monotonic()
+            try:
+                # 处理任务期间的日志都带有任务ID和来源
+                with structured_log.bind(
+                    job_id=job.id, source=job.source, chat_id=job.chat_id
+                ):
+                    await handler(job)
+                    logger.info(
+                        f"任务 {job.id} 完成",
+                        extra={"duration": time.monotonic() - start},
+                    )
+                self._update(job.id, state=STATE_DONE, error=None)
+                metrics.JOBS.inc(source=job.source, status=STATE_DONE)
+            except asyncio.CancelledError:
+                # 程序退出时保持running状态，下次启动时恢复
+                raise
+            except PermanentJobError as e:
+                metrics.DOWNLOAD_FAILURES.inc(source=job.source)
+                logger.error(f"任务 {job.id} 失败，不再重试: {str(e)}")
+                self._update(job.id, state=STATE_FAILED, error=str(e))
+                metrics.JOBS.inc(source=job.source, status=STATE_FAILED)
+            except Exception as e:
+                metrics.DOWNLOAD_FAILURES.inc(source=job.source)
+                job.retries += 1
+                if job.retries <= self.max_retries:
+                    metrics.RETRIES.inc(source=job.source)
+                    delay = self.retry_delay * 2 ** (job.retries - 1)
+                    job.not_before = time.monotonic() + delay
+                    logger.warning(
+                        f"任务 {job.id} 失败，{delay:.0f} 秒后第 {job.retries} 次重试: "
+                        f"{str(e)}"
+                    )
+                    self._update(
+                        job.id, state=STATE_PENDING, retries=job.retries, error=str(e)
+                    )
+                    async with self._cond:
+                        self._push(job)
+                else:
+                    logger.error(f"任务 {job.id} 重试次数已用完: {str(e)}")
+                    self._update(
+                        job.id, state=STATE_FAILED, retries=job.retries, error=str(e)
+                    )
+                    metrics.JOBS.inc(source=job.source, status=STATE_FAILED)
+            finally:
+                async with self._cond:
+                    self._active[job.chat_id] -= 1
+                    if not self._active[job.chat_id]:
+                        del self._active[job.chat_id]
+                    self._update_gauges()
+                    self._cond.notify_all()
+
+    def start(self, handler):
+        """恢复未完成的任务并启动worker，handler为处理单个任务的协程函数"""
+        self._cond = asyncio.Condition()
+        self._recover()
+        self._tasks = [
+            asyncio.create_task(self._worker(handler)) for _ in range(self.workers)
+        ]
+        logger.info(
+            f"下载队列已启动: {self.workers} 个worker，"
+            f"每个会话最多同时处理 {self.per_chat_limit} 个任务"
+        )
+
+    async def stop(self):
+        """停止所有worker并关闭数据库"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._db.close()
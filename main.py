@@ -1,19 +1,48 @@
+import time
+
+# 启动时间，用于统计启动各阶段的耗时
+STARTUP_BEGIN = time.perf_counter()
+
 import os
 import logging
-from telethon import TelegramClient, events
+from telethon import TelegramClient, events, types, utils
 import yaml
-import yt_dlp
 import re
-import shutil
 import asyncio
 import signal
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-
-# 配置日志
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+import functools
+import contextvars
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from job_queue import JobQueue, JobError, PermanentJobError
+from telegram_download import download_document_parallel, cleanup_stale_parts
+from media_index import MediaIndex, telegram_media_key, youtube_video_key
+from progress import ProgressReporter
+from storage import (
+    get_staging_dir,
+    staging_dirs,
+    cleanup_stale_files,
+    directory_size,
+    finalize_file,
+    finalize_file_async,
 )
+from youtube_session import YoutubeSession, is_permanent_error
+from info_cache import InfoCache
+from backfill import Backfill, BackfillCheckpoints, MediaFilter
+from broadcast import Broadcaster, BroadcastStore, parse_targets
+import metrics
+import bandwidth
+import client_pool
+import url_router
+import integrity
+import disk_space
+import postprocess
+import structured_log
+import telegram_download
+
+# 配置日志，读取配置文件后再按配置重新设置
+structured_log.configure()
 logger = logging.getLogger(__name__)
 
 # 获取程序所在目录的绝对路径
@@ -45,6 +74,7 @@ def load_config():
             "enabled": False,
             "phone": "",  # 用户的手机号
             "session_name": "user_session",  # 用户会话名称
+            "extra_accounts": [],  # 只用于分担下载的其他用户账号（phone、session_name）
         },
         "bot_account": {
             "token": "",  # 机器人 token
@@ -53,6 +83,10 @@ def load_config():
         "youtube_download": {
             "format": "best",
             "cookies": "",
+            "workers": 2,  # 同时进行的YouTube下载任务数
+            "playlist_concurrency": 2,  # 单个播放列表同时下载的视频数
+            "lazy_playlist": True,  # 逐个解析播放列表条目，解析到第一个视频即开始下载
+            "temp_max_age_hours": 6,  # 下载残留的临时文件保留时间，过期后删除
         },
         "scheduled_messages": [
             {
@@ -61,7 +95,72 @@ def load_config():
                 "time": "08:00",  # 每天发送消息的时间，24小时制
             }
         ],
+        "telegram_download": {
+            "connections": 4,  # 大文件并行下载的连接数，1表示单连接下载
+            "parallel_threshold_mb": 10,  # 超过该大小的文件使用并行下载
+            "part_max_age_hours": 24,  # 未完成的下载文件保留时间，过期后删除
+            "album_concurrency": 3,  # 相册中同时下载的文件数
+        },
+        "progress": {
+            "interval": 5,  # 进度消息的更新间隔（秒）
+            "log_interval": 30,  # 进度日志的输出间隔（秒）
+        },
+        "dedup": {
+            "hash_files": False,  # 计算文件哈希，合并不同来源的相同文件
+        },
+        "info_cache": {
+            "max_entries": 256,  # 缓存的视频解析结果数量上限
+            "ttl_minutes": 60,  # 解析结果的有效期（视频下载地址有时效）
+            "persist": False,  # 将解析结果保存到磁盘，重启后仍然有效
+        },
+        "job_queue": {
+            "workers": 4,  # 同时处理的下载任务数
+            "per_chat_limit": 2,  # 单个会话同时处理的任务数上限
+            "max_retries": 2,  # 失败任务的最大重试次数
+            "retry_delay": 30,  # 第一次重试前等待的秒数，之后每次重试等待时间加倍
+        },
+        "backfill": {
+            "concurrency": 4,  # 备份时同时下载的文件数
+            "batch_size": 100,  # 每批下载的消息数，每批完成后保存一次检查点
+            "allowed_users": [],  # 可以使用备份命令的用户ID，用户账号本身总是允许
+        },
+        "postprocess": {
+            "enabled": False,  # 是否在下载完成后转封装或转码
+            "ffmpeg": "ffmpeg",  # ffmpeg 可执行文件
+            "workers": 0,  # 同时处理的文件数，0表示CPU核心数
+            "timeout_minutes": 60,  # 单个文件的处理时间上限
+            "keep_original": False,  # 处理完成后保留原文件
+            "rules": [],  # 按扩展名或MIME类型匹配的处理规则
+        },
+        "disk_space": {
+            "min_free_mb": 1024,  # 下载目录所在磁盘至少保留的空间（MB），0表示不检查
+            "wait_timeout_minutes": 30,  # 空间不足时下载最多等待的时间，超时后任务失败并重试
+        },
+        "broadcast": {
+            "concurrency": 4,  # 定时消息同时发送的数量
+            "messages_per_second": 1,  # 定时消息的发送频率上限
+            "misfire_grace_minutes": 60,  # 错过的定时消息在该时间内补发
+        },
+        "rate_limit": {
+            "global_mbps": 0,  # 所有下载的总速率上限（MB/s），0表示不限制
+            "telegram_mbps": 0,  # Telegram下载的速率上限（MB/s）
+            "youtube_mbps": 0,  # YouTube下载的速率上限（MB/s）
+            "telegram_requests_per_second": 0,  # Telegram分片请求的频率上限
+            "edits_per_minute": 30,  # 所有状态消息每分钟的编辑次数上限
+            "bulk_share": 0.25,  # 有单个文件在下载时，批量任务可使用的带宽比例
+            "profiles": [],  # 按时段覆盖以上限速设置
+        },
+        "metrics": {
+            "enabled": False,  # 是否启动Prometheus指标接口
+            "host": "0.0.0.0",  # 指标接口监听地址
+            "port": 9100,  # 指标接口端口
+        },
         "log_level": "INFO",
+        "logging": {
+            "format": "text",  # text 或 json，json 时每行一条日志并附带任务ID、字节数等字段
+            "queue": True,  # 在后台线程中格式化和输出日志，不阻塞事件循环
+            "sample_interval": 5,  # 高频事件（如每个分片的下载）同一文件最多每隔几秒记录一次
+        },
         "proxy": {
             "enabled": False,
             "host": "127.0.0.1",
@@ -80,7 +179,7 @@ def load_config():
                     config = {}
                 # 合并默认配置和用户配置
                 for key, value in default_config.items():
-                    if key not in config:
+                    if config.get(key) is None:
                         config[key] = value
                     elif isinstance(value, dict) and isinstance(config[key], dict):
                         # 处理嵌套字典
@@ -118,25 +217,176 @@ def load_config():
 
 config = load_config()
 
+# 设置日志级别和格式
+LOGGING_CONFIG = config.get("logging", {})
+structured_log.configure(
+    level=config.get("log_level", "INFO"),
+    fmt=LOGGING_CONFIG.get("format", "text"),
+    use_queue=LOGGING_CONFIG.get("queue", True),
+    sample_interval=LOGGING_CONFIG.get("sample_interval", 5),
+)
+
 # Telegram API 配置
 API_ID = config.get("api_id", "")
 API_HASH = config.get("api_hash", "")
 BOT_TOKEN = config["bot_account"]["token"]
 
-# 下载目录配置
-BASE_DOWNLOAD_DIR = config.get("download_dir", "downloads")
-TELEGRAM_DIR = os.path.join(BASE_DOWNLOAD_DIR, "telegram")
-YOUTUBE_DIR = os.path.join(BASE_DOWNLOAD_DIR, "youtube")
-COOKIES_FILE = config.get("cookies_file", "cookies.txt")
-
 # YouTube下载配置
 YOUTUBE_CONFIG = config.get("youtube_download", {})
-YT_FORMAT = YOUTUBE_CONFIG.get("format", "best")
-YT_COOKIES = YOUTUBE_CONFIG.get("cookies", "")
+YT_WORKERS = max(1, int(YOUTUBE_CONFIG.get("workers", 2) or 1))
+YT_TEMP_MAX_AGE = YOUTUBE_CONFIG.get("temp_max_age_hours", 6) * 3600
+YT_LAZY_PLAYLIST = YOUTUBE_CONFIG.get("lazy_playlist", True)
+YT_PLAYLIST_CONCURRENCY = max(
+    1, int(YOUTUBE_CONFIG.get("playlist_concurrency", 2) or 1)
+)
+
+# YouTube下载线程池，yt-dlp的解析和下载都是阻塞调用，放到线程池中执行以免阻塞事件循环
+youtube_executor = ThreadPoolExecutor(
+    max_workers=YT_WORKERS, thread_name_prefix="youtube"
+)
+
+# 视频解析结果缓存，同一链接重复发送或任务重试时无需再次解析
+INFO_CACHE_CONFIG = config.get("info_cache", {})
+info_cache = InfoCache(
+    max_entries=INFO_CACHE_CONFIG.get("max_entries", 256),
+    ttl=INFO_CACHE_CONFIG.get("ttl_minutes", 60) * 60,
+    db_path=(
+        os.path.join(CONFIG_DIR, "info_cache.db")
+        if INFO_CACHE_CONFIG.get("persist", False)
+        else None
+    ),
+)
+
+# YouTube下载会话，下载参数和cookie文件只在配置变化时重新生成，
+# 每个下载线程复用自己的 YoutubeDL 实例
+youtube_session = YoutubeSession(
+    os.path.join(CONFIG_DIR, "config.yaml"),
+    os.path.join(CONFIG_DIR, "youtube_cookies.txt"),
+    os.path.join(
+        get_staging_dir(YOUTUBE_DEST_DIR, YOUTUBE_TEMP_DIR),
+        "%(title).100s-%(id)s.%(ext)s",
+    ),
+    info_cache=info_cache,
+)
+youtube_session.initialize(YOUTUBE_CONFIG, config.get("proxy") or {})
+
+# Telegram下载配置
+TELEGRAM_DOWNLOAD_CONFIG = config.get("telegram_download", {})
+TG_CONNECTIONS = max(1, int(TELEGRAM_DOWNLOAD_CONFIG.get("connections", 4) or 1))
+TG_PARALLEL_THRESHOLD = (
+    TELEGRAM_DOWNLOAD_CONFIG.get("parallel_threshold_mb", 10) * 1024 * 1024
+)
+TG_PART_MAX_AGE = TELEGRAM_DOWNLOAD_CONFIG.get("part_max_age_hours", 24) * 3600
+TG_ALBUM_CONCURRENCY = max(
+    1, int(TELEGRAM_DOWNLOAD_CONFIG.get("album_concurrency", 3) or 1)
+)
+
+# 下载进度汇报配置
+PROGRESS_CONFIG = config.get("progress", {})
+PROGRESS_INTERVAL = max(1, PROGRESS_CONFIG.get("interval", 5))
+PROGRESS_LOG_INTERVAL = PROGRESS_CONFIG.get("log_interval", 30)
+
+# 已下载媒体的索引，重复收到同一个文件时直接返回已有路径
+DEDUP_CONFIG = config.get("dedup", {})
+DEDUP_HASH_FILES = DEDUP_CONFIG.get("hash_files", False)
+media_index = MediaIndex(os.path.join(CONFIG_DIR, "media.db"))
+
+# 下载任务队列，任务记录保存在配置目录中，重启后自动恢复未完成的任务
+JOB_QUEUE_CONFIG = config.get("job_queue", {})
+job_queue = JobQueue(
+    os.path.join(CONFIG_DIR, "jobs.db"),
+    workers=JOB_QUEUE_CONFIG.get("workers", 4),
+    per_chat_limit=JOB_QUEUE_CONFIG.get("per_chat_limit", 2),
+    max_retries=JOB_QUEUE_CONFIG.get("max_retries", 2),
+    retry_delay=JOB_QUEUE_CONFIG.get("retry_delay", 30),
+)
+
+# 频道历史备份配置，每个会话备份到的位置保存在 config/backfill.db 中
+BACKFILL_CONFIG = config.get("backfill", {})
+BACKFILL_CONCURRENCY = max(1, int(BACKFILL_CONFIG.get("concurrency", 4) or 1))
+BACKFILL_BATCH_SIZE = max(1, int(BACKFILL_CONFIG.get("batch_size", 100) or 1))
+backfill_checkpoints = BackfillCheckpoints(os.path.join(CONFIG_DIR, "backfill.db"))
+
+# 定时消息的发送状态、上次执行时间和解析后的会话ID
+BROADCAST_CONFIG = config.get("broadcast", {})
+BROADCAST_MISFIRE_GRACE = BROADCAST_CONFIG.get("misfire_grace_minutes", 60) * 60
+broadcast_store = BroadcastStore(os.path.join(CONFIG_DIR, "scheduler.db"))
+backfill_tasks = {}  # chat_id -> 正在执行的备份任务
+
+# 下载完成后的转封装/转码，在后台运行 ffmpeg 子进程
+POSTPROCESS_CONFIG = config.get("postprocess", {})
+postprocess.PROCESSOR.configure(
+    enabled=POSTPROCESS_CONFIG.get("enabled", False),
+    rules=POSTPROCESS_CONFIG.get("rules"),
+    ffmpeg=POSTPROCESS_CONFIG.get("ffmpeg", "ffmpeg"),
+    workers=POSTPROCESS_CONFIG.get("workers", 0),
+    timeout_minutes=POSTPROCESS_CONFIG.get("timeout_minutes", 60),
+    keep_original=POSTPROCESS_CONFIG.get("keep_original", False),
+)
+
+# 磁盘空间准入控制，剩余空间低于 min_free_mb 时新的下载等待
+DISK_SPACE_CONFIG = config.get("disk_space", {})
+disk_space.SPACE.configure(
+    DISK_SPACE_CONFIG.get("min_free_mb", 1024),
+    DISK_SPACE_CONFIG.get("wait_timeout_minutes", 30),
+)
+
+# 带宽和请求频率限制，profiles 中的时段从指定时间开始覆盖默认限速
+RATE_LIMIT_CONFIG = config.get("rate_limit", {})
+RATE_LIMIT_KEYS = (
+    "global_mbps",
+    "telegram_mbps",
+    "youtube_mbps",
+    "telegram_requests_per_second",
+    "edits_per_minute",
+    "bulk_share",
+)
+
 
-# 创建必要的目录
-os.makedirs(TELEGRAM_DIR, exist_ok=True)
-os.makedirs(YOUTUBE_DIR, exist_ok=True)
+def load_rate_limit_profiles():
+    """解析限速时段，返回 (默认限速, 时段列表)"""
+    base = {
+        key: RATE_LIMIT_CONFIG[key]
+        for key in RATE_LIMIT_KEYS
+        if key in RATE_LIMIT_CONFIG
+    }
+    profiles = []
+    for idx, profile in enumerate(RATE_LIMIT_CONFIG.get("profiles") or []):
+        schedule_time = profile.get("time", "")
+        try:
+            hour, minute = map(int, str(schedule_time).split(":"))
+        except ValueError:
+            logger.error(f"限速时段 #{idx+1} 的时间格式错误: {schedule_time}")
+            continue
+        rates = dict(base)
+        rates.update({key: profile[key] for key in RATE_LIMIT_KEYS if key in profile})
+        profiles.append(
+            {"name": schedule_time, "start": (hour, minute), "rates": rates}
+        )
+    return base, profiles
+
+
+def apply_rate_limit(name, rates):
+    """应用一组限速设置"""
+    bandwidth.GOVERNOR.configure(**rates)
+    logger.info(f"已应用限速设置「{name}」: {bandwidth.GOVERNOR.describe()}")
+
+
+RATE_LIMIT_BASE, RATE_LIMIT_PROFILES = load_rate_limit_profiles()
+_profile = bandwidth.active_profile(RATE_LIMIT_PROFILES, datetime.now())
+if _profile:
+    apply_rate_limit(_profile["name"], _profile["rates"])
+else:
+    apply_rate_limit("默认", RATE_LIMIT_BASE)
+
+BACKFILL_USAGE = (
+    "用法：/backfill <频道用户名、链接或ID> [过滤条件]\n"
+    "过滤条件：\n"
+    "- type=video,audio,photo,document 媒体类型\n"
+    "- min_size=10 / max_size=2000 文件大小（MB）\n"
+    "- since=2024-01-01 / until=2024-12-31 消息日期\n"
+    "停止备份：/backfill stop <频道>"
+)
 
 
 # 在创建客户端之前添加代理配置
@@ -155,6 +405,180 @@ def get_proxy_config():
     }
 
 
+async def run_in_youtube_executor(func, *args):
+    """在YouTube线程池中执行阻塞函数并等待结果，线程中的日志带有当前任务的字段"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        youtube_executor, functools.partial(context.run, func, *args)
+    )
+
+
+def _iter_playlist(url, lazy, emit):
+    """
+    在工作线程中解析播放列表，先通过 emit 发送播放列表信息（不含条目），再逐个发送条目
+
+    lazy 为 True 时使用 process=False 的平铺解析，条目由提取器按页生成，
+    不会预先解析每个视频的详细信息。
+    """
+    info = youtube_session.extract_playlist(url, lazy=lazy)
+    emit({key: value for key, value in info.items() if key != "entries"})
+    for entry in info.get("entries") or []:
+        emit(entry)
+
+
+class _PlaylistClosed(Exception):
+    """播放列表的读取方已经停止，后台线程不再解析后续条目"""
+
+
+async def stream_playlist_entries(url):
+    """
+    异步流式解析播放列表
+
+    第一个产出的是播放列表信息，之后依次产出播放列表中的条目，
+    解析在后台线程中进行，不占用YouTube下载线程。
+    提前关闭（aclose）时后台线程在产出下一个条目时停止，不再继续翻页。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+    closed = threading.Event()
+
+    def emit(item):
+        if closed.is_set():
+            raise _PlaylistClosed()
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    def produce():
+        try:
+            _iter_playlist(url, YT_LAZY_PLAYLIST, emit)
+        except _PlaylistClosed:
+            pass
+        except Exception as e:
+            if not closed.is_set():
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            if not closed.is_set():
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        closed.set()
+        await producer
+
+
+async def extract_youtube_info(url, download=False, progress_hook=None, refresh=False):
+    """
+    异步解析YouTube链接，download为True时同时下载视频
+
+    下载前按选择的格式估算文件大小并预留磁盘空间，空间不足时等待。
+    下载时在写入过程中计算文件哈希（保存在 info["__sha256"] 中）并检查文件大小，
+    校验失败时删除文件，重新解析链接后再下载一次。
+    """
+    if not download:
+        return await run_in_youtube_executor(
+            youtube_session.extract_info, url, False, progress_hook, refresh
+        )
+    first_byte = metrics.FirstByteTimer("youtube")
+    staging_dir = get_staging_dir(YOUTUBE_DEST_DIR, YOUTUBE_TEMP_DIR)
+    for attempt in range(integrity.RETRIES + 1):
+        # 先解析（结果会被缓存，下载时不需要再次解析）以获取选择的格式的大小
+        info = await run_in_youtube_executor(
+            youtube_session.extract_info, url, False, None, refresh
+        )
+        size = disk_space.estimate_ytdlp_size(info or {})
+        hasher = integrity.StreamHasher()
+        async with disk_space.SPACE.reserve(staging_dir, size) as reservation:
+            with metrics.DOWNLOAD_SECONDS.time(source="youtube"):
+                info = await run_in_youtube_executor(
+                    youtube_session.extract_info,
+                    url,
+                    True,
+                    bandwidth.GOVERNOR.wrap_hook(
+                        first_byte.wrap_hook(
+                            reservation.wrap_hook(hasher.wrap_hook(progress_hook))
+                        )
+                    ),
+                    False,
+                )
+            path = get_downloaded_filepath(info)
+            try:
+                info["__sha256"] = await run_in_youtube_executor(
+                    integrity.verify_ytdlp_download, info, path, hasher
+                )
+                return info
+            except integrity.IntegrityError as e:
+                if path and os.path.exists(path):
+                    os.remove(path)
+                metrics.INTEGRITY_FAILURES.inc(source="youtube")
+                if attempt == integrity.RETRIES:
+                    raise
+                logger.warning(f"视频文件校验失败，重新下载: {str(e)}")
+                refresh = True
+
+
+def video_key(video_id, extractor="Youtube"):
+    """yt-dlp下载的视频的索引键，YouTube以外的网站在视频ID前加上提取器名称"""
+    if extractor and extractor != "Youtube":
+        video_id = f"{extractor.lower()}:{video_id}"
+    return youtube_video_key(video_id, youtube_session.video_format)
+
+
+def route_video_keys(route):
+    """
+    单个视频链接下载前查找已下载文件时使用的索引键
+
+    从链接中提取的视频ID可能与 yt-dlp 解析后的ID不同，缓存中有该链接的解析结果时
+    同时使用解析结果中的ID。
+    """
+    keys = []
+    if route.video_id:
+        keys.append(video_key(route.video_id, route.extractor))
+    cached = info_cache.get(route.url)
+    if cached and cached.get("id"):
+        keys.append(video_key(cached["id"], cached.get("extractor_key")))
+    return list(dict.fromkeys(keys))
+
+
+async def record_download(key, path, sha256=None, mime_type=None, aliases=()):
+    """
+    将下载完成的文件及其哈希加入媒体索引，返回文件最终的路径
+
+    匹配后处理规则的新文件随后在后台转封装或转码，完成后索引指向处理后的文件。
+    mime_type 为来源提供的文件类型（如 Telegram 文档的 MIME 类型），未提供时按扩展名判断。
+    aliases 为同样指向该文件的其他索引键（如从链接中提取的、与解析结果不同的视频ID）。
+    """
+
+    def add():
+        final_path = media_index.add_and_merge(key, path, DEDUP_HASH_FILES, sha256)
+        for alias in aliases:
+            if alias != key:
+                media_index.add(alias, final_path, sha256=sha256)
+        return final_path
+
+    loop = asyncio.get_running_loop()
+    final_path = await loop.run_in_executor(None, add)
+    if final_path == path:
+        postprocess.PROCESSOR.submit(path, mime_type, on_replaced=replace_indexed_file)
+    return final_path
+
+
+async def replace_indexed_file(old_path, new_path, sha256):
+    """后处理完成后更新媒体索引中的文件路径和哈希"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        None, media_index.replace_path, old_path, new_path, sha256
+    )
+
+
 # 将事件处理器改为函数定义
 def register_handlers(client):
     """注册所有事件处理器"""
@@ -166,368 +590,833 @@ def register_handlers(client):
 
     @client.on(events.NewMessage)
     async def download_video(event):
-        """处理接收到的视频消息或YouTube链接"""
-        status_message = None
+        """处理接收到的视频消息或视频链接，加入下载队列"""
         try:
-            message_text = event.message.text if event.message.text else ""
-            # 检查是否是YouTube链接
-            youtube_pattern = r"(https?://)?(www\.)?(youtube\.com|youtu\.be)/.*"
-            is_youtube = bool(re.match(youtube_pattern, message_text))
+            message = event.message
+            message_text = message.raw_text or ""
+            if message_text.startswith("/"):
+                return
+            # 链接预览不是可下载的媒体，带有媒体的消息只下载媒体，不处理说明文字中的链接
+            if message.media and not isinstance(
+                message.media, types.MessageMediaWebPage
+            ):
+                # 相册中的媒体由 download_album 作为一个任务处理
+                if not message.grouped_id:
+                    await job_queue.enqueue("telegram", event.chat_id, message.id)
+                return
+            # 消息中的每个链接作为一个任务，分派表第一次生成时较慢，在线程池中匹配
+            entities = message.get_entities_text()
+            if url_router.extract_urls(message_text, entities):
+                routes = await asyncio.get_running_loop().run_in_executor(
+                    None, url_router.ROUTER.routes, message_text, entities
+                )
+                for route in routes:
+                    await job_queue.enqueue(
+                        "youtube", event.chat_id, message.id, url=route.url
+                    )
+        except Exception as e:
+            error_message = f"添加下载任务失败: {str(e)}"
+            await event.reply(error_message)
+            logger.error(error_message)
 
-            if is_youtube:
+    @client.on(events.Album)
+    async def download_album(event):
+        """处理转发的相册，相册中的所有媒体作为一个任务加入下载队列"""
+        try:
+            message_ids = [message.id for message in event.messages]
+            await job_queue.enqueue(
+                "album", event.chat_id, message_ids[0], message_ids=message_ids
+            )
+        except Exception as e:
+            error_message = f"添加下载任务失败: {str(e)}"
+            await event.reply(error_message)
+            logger.error(error_message)
+
+
+def register_backfill_handlers(client, user_client, allowed_users):
+    """注册 /backfill 命令，使用用户账号备份频道或群组中的历史媒体"""
+
+    @client.on(events.NewMessage(pattern=r"^/backfill(?:@\w+)?(?:\s+(.*))?$"))
+    async def backfill(event):
+        """处理 /backfill 命令，备份在后台执行，进度显示在同一条状态消息中"""
+        if event.sender_id not in allowed_users:
+            await event.reply("没有使用备份命令的权限")
+            return
+        args = (event.pattern_match.group(1) or "").split()
+        stop = bool(args) and args[0] == "stop"
+        if stop:
+            args = args[1:]
+        if not args:
+            await event.reply(BACKFILL_USAGE)
+            return
+
+        try:
+            chat = args[0]
+            entity = await user_client.get_entity(
+                int(chat) if re.fullmatch(r"-?\d+", chat) else chat
+            )
+            chat_id = utils.get_peer_id(entity)
+            if stop:
+                task = backfill_tasks.get(chat_id)
+                if task:
+                    task.cancel()
+                else:
+                    await event.reply("该会话没有正在进行的备份")
+                return
+            if chat_id in backfill_tasks:
+                await event.reply("该会话正在备份中")
+                return
+            media_filter = MediaFilter.parse(args[1:])
+        except Exception as e:
+            error_message = f"无法开始备份: {str(e)}"
+            await event.reply(error_message)
+            logger.error(error_message)
+            return
+
+        task = asyncio.create_task(
+            run_backfill(event.message, user_client, entity, media_filter)
+        )
+        backfill_tasks[chat_id] = task
+        task.add_done_callback(lambda _: backfill_tasks.pop(chat_id, None))
+
+
+async def process_download_job(client, job):
+    """下载队列的任务处理函数，重新获取消息后执行下载"""
+    if job.source == "album":
+        messages = await client.get_messages(job.chat_id, ids=job.message_ids)
+        await process_album([message for message in messages if message])
+        return
+
+    message = await client.get_messages(job.chat_id, ids=job.message_id)
+    if message is None:
+        raise PermanentJobError(f"消息 {job.message_id} 不存在或已被删除")
+    route = None
+    if job.source == "youtube":
+        # 旧版本的任务中保存的是整条消息，取其中第一个可以下载的链接
+        routes = await asyncio.get_running_loop().run_in_executor(
+            None, url_router.ROUTER.routes, job.url or ""
+        )
+        if not routes:
+            raise PermanentJobError(f"不支持的链接: {job.url}")
+        route = routes[0]
+    # 播放列表作为批量任务，有单个文件在下载时让出带宽
+    priority = bandwidth.BULK if route and route.playlist else bandwidth.INTERACTIVE
+    with bandwidth.use_priority(priority):
+        # 重试的任务不使用缓存的解析结果
+        await process_download(message, refresh=job.retries > 0, route=route)
+
+
+async def process_album(messages):
+    """
+    下载相册中的所有媒体，下载失败时抛出异常以便队列重试
+
+    同时下载的文件数受 album_concurrency 限制，进度合并显示在同一条状态消息中，
+    全部完成后回复一条汇总消息。只有部分文件失败时不重试，以免重复发送汇总消息。
+    """
+    messages = [message for message in messages if message.media]
+    if not messages:
+        raise PermanentJobError("相册中的消息不存在或已被删除")
+    first_message = messages[0]
+    total = len(messages)
+    saved = []  # (序号, 文件路径)
+    failures = []  # (序号, 错误信息)
+    skipped_count = 0
+
+    status_message = await first_message.reply(f"开始下载相册，共{total}个文件...")
+    reporter = ProgressReporter(
+        status_message,
+        interval=PROGRESS_INTERVAL,
+        log_interval=PROGRESS_LOG_INTERVAL,
+    )
+
+    def update_header():
+        reporter.set_header(
+            f"正在下载相册：{len(saved) + len(failures)}/{total}\n"
+            f"成功：{len(saved)} 失败：{len(failures)}"
+        )
+
+    semaphore = asyncio.Semaphore(TG_ALBUM_CONCURRENCY)
+
+    async def download_member(index, message):
+        """下载相册中的单个文件并记录结果"""
+        nonlocal skipped_count
+        filename = f"文件 #{index}"
+        try:
+            filename, media_type, target_dir = describe_telegram_media(message)
+            media_key = telegram_media_key(message.media)
+            existing = media_index.lookup(media_key)
+            if existing:
+                skipped_count += 1
+                saved.append((index, existing))
+                reporter.add_note(f"⏭️ #{index} {filename}: 已存在")
+                return
+
+            async with semaphore:
                 try:
-                    status_message = await event.reply("开始解析youtube下载链接..")
-                    ydl_opts = {
-                        "format": YT_FORMAT,
-                        "outtmpl": os.path.join(
-                            YOUTUBE_TEMP_DIR, "%(title).100s-%(id)s.%(ext)s"
-                        ),
-                        "ignoreerrors": True,
-                        "ignore_no_formats_error": True,
-                        "restrictfilenames": True,  # 使用ASCII字符
-                        "windowsfilenames": True,  # 确保Windows兼容性
-                    }
-
-                    # 添加代理配置
-                    proxy_config = get_proxy_config()
-                    if proxy_config:
-                        ydl_opts["proxy"] = (
-                            f"socks5://{proxy_config['addr']}:{proxy_config['port']}"
-                        )
+                    downloaded_file, sha256 = await download_telegram_file(
+                        message, target_dir, reporter.track(index, filename)
+                    )
+                finally:
+                    reporter.finish(index)
+                if not downloaded_file:
+                    raise ValueError("文件为空")
+                target_path = await move_telegram_file(
+                    downloaded_file,
+                    target_dir,
+                    media_key,
+                    sha256,
+                    telegram_mime_type(message),
+                )
+            logger.info(f"已将相册中的{media_type}文件移动到: {target_path}")
+            saved.append((index, target_path))
+            reporter.add_note(f"✅ #{index} {filename}")
+        except Exception as e:
+            error_msg = str(e)
+            failures.append((index, f"#{index} {filename}: {error_msg[:100]}"))
+            metrics.DOWNLOAD_FAILURES.inc(source="telegram")
+            reporter.add_note(f"❌ #{index} {filename}: {error_msg[:100]}")
+            logger.error(f"相册文件 #{index} {filename} 下载失败: {error_msg}")
+        finally:
+            update_header()
+
+    update_header()
+    reporter.start()
+    try:
+        await asyncio.gather(
+            *[
+                download_member(index, message)
+                for index, message in enumerate(messages, start=1)
+            ]
+        )
+    finally:
+        await reporter.close()
+
+    # 相册下载完成后的汇总，按相册中的顺序排列
+    summary = (
+        f"📦 相册下载完成！\n"
+        f"总计：{total}个文件\n"
+        f"✅ 成功：{len(saved)}（其中{skipped_count}个已存在）\n"
+        f"❌ 失败：{len(failures)}"
+    )
+    if saved:
+        summary += "\n\n保存位置："
+        for _, path in sorted(saved)[:10]:
+            summary += f"\n- {path}"
+        if len(saved) > 10:
+            summary += f"\n...等共{len(saved)}个文件"
+    if failures:
+        summary += "\n\n失败文件列表："
+        for _, error in sorted(failures)[:10]:
+            summary += f"\n- {error}"
+    await first_message.reply(summary)
+
+    if not saved:
+        raise JobError("相册中的文件全部下载失败")
+
+
+async def run_backfill(command_message, client, entity, media_filter):
+    """
+    备份一个会话中的历史媒体，进度和结果回复到发送命令的会话
 
-                    # 添加cookies配置
-                    if YT_COOKIES:
-                        # 创建临时cookies文件
-                        import tempfile
-
-                        with tempfile.NamedTemporaryFile(
-                            mode="w", delete=False, suffix=".txt"
-                        ) as f:
-                            # 写入cookies文件头部
-                            f.write("# Netscape HTTP Cookie File\n")
-                            f.write("# https://curl.haxx.se/rfc/cookie_spec.html\n")
-                            f.write("# This is a generated file!  Do not edit.\n\n")
-
-                            # 写入cookies
-                            for cookie in YT_COOKIES.split(";"):
-                                if cookie.strip():
-                                    name_value = cookie.strip().split("=", 1)
-                                    if len(name_value) == 2:
-                                        name, value = name_value
-                                        f.write(
-                                            f".youtube.com\tTRUE\t/\tTRUE\t2999999999\t{name.strip()}\t{value.strip()}\n"
-                                        )
-                        temp_cookie_file = f.name
-                        ydl_opts["cookiefile"] = temp_cookie_file
-
-                    # 判断是否是播放列表
-                    is_playlist = "list" in message_text or message_text.endswith(
-                        "/videos"
+    消息由用户账号获取和下载，不会在被备份的会话中发送任何消息。
+    已下载过的文件由媒体索引跳过，下次备份从保存的检查点继续。
+    """
+    name = utils.get_display_name(entity) or str(utils.get_peer_id(entity))
+    status_message = await command_message.reply(
+        f"开始备份 {name}\n{media_filter.describe()}"
+    )
+    reporter = ProgressReporter(
+        status_message,
+        interval=PROGRESS_INTERVAL,
+        log_interval=PROGRESS_LOG_INTERVAL,
+    )
+    skipped_count = 0
+
+    async def download(message):
+        """下载单条消息中的媒体，已存在的文件直接跳过"""
+        nonlocal skipped_count
+        filename, media_type, target_dir = describe_telegram_media(message)
+        media_key = telegram_media_key(message.media)
+        if media_index.lookup(media_key):
+            skipped_count += 1
+            return
+        try:
+            try:
+                downloaded_file, sha256 = await download_telegram_file(
+                    message, target_dir, reporter.track(message.id, filename)
+                )
+            finally:
+                reporter.finish(message.id)
+            if not downloaded_file:
+                raise ValueError("文件为空")
+            await move_telegram_file(
+                downloaded_file,
+                target_dir,
+                media_key,
+                sha256,
+                telegram_mime_type(message),
+            )
+        except Exception as e:
+            metrics.DOWNLOAD_FAILURES.inc(source="telegram")
+            reporter.add_note(f"❌ {message.id} {filename}: {str(e)[:100]}")
+            raise
+
+    def update_header(backfill):
+        reporter.set_header(
+            f"正在备份 {name}\n"
+            f"已扫描：{backfill.scanned} 匹配：{backfill.matched}\n"
+            f"完成：{backfill.completed}（其中{skipped_count}个已存在）"
+            f" 失败：{backfill.failed}"
+        )
+
+    backfill = Backfill(
+        client,
+        entity,
+        media_filter,
+        backfill_checkpoints,
+        download,
+        concurrency=BACKFILL_CONCURRENCY,
+        batch_size=BACKFILL_BATCH_SIZE,
+    )
+    update_header(backfill)
+    reporter.start()
+    try:
+        with bandwidth.use_priority(bandwidth.BULK):
+            await backfill.run(on_progress=update_header)
+    except asyncio.CancelledError:
+        await command_message.reply(
+            f"已停止备份 {name}，下次从消息 {backfill.start_id()} 之后继续"
+        )
+        raise
+    except Exception as e:
+        error_message = f"备份 {name} 出错: {str(e)}"
+        logger.error(error_message)
+        await command_message.reply(error_message)
+        return
+    finally:
+        await reporter.close()
+
+    await command_message.reply(
+        f"📦 {name} 备份完成！\n"
+        f"扫描：{backfill.scanned}条消息，匹配：{backfill.matched}\n"
+        f"✅ 成功：{backfill.completed}（其中{skipped_count}个已存在）\n"
+        f"❌ 失败：{backfill.failed}"
+        + ("\n失败的文件会在下次备份时重新下载" if backfill.failed else "")
+    )
+
+
+def telegram_mime_type(message):
+    """Telegram文档的MIME类型，照片等没有文档的媒体返回None"""
+    document = getattr(message.media, "document", None)
+    return getattr(document, "mime_type", None)
+
+
+def describe_telegram_media(message):
+    """
+    获取Telegram消息中媒体的文件名、类型和保存目录
+
+    Returns:
+        tuple: (文件名, 媒体类型, 目标目录)
+    """
+    media = message.media
+
+    # 获取文件名
+    filename = None
+    if hasattr(media, "document"):
+        # 从文档属性中获取文件名
+        for attr in media.document.attributes:
+            if hasattr(attr, "title") and attr.title:
+                filename = attr.title
+                break
+
+        # 如果属性中没有文件名，尝试从MIME类型生成
+        if not filename and hasattr(media.document, "mime_type"):
+            mime_type = media.document.mime_type
+            ext = mime_type.split("/")[-1] if mime_type else "unknown"
+            filename = f"未命名文件.{ext}"
+
+    # 如果是照片，生成时间戳文件名
+    elif hasattr(media, "photo"):
+        filename = f"photo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+
+    # 如果以上都没有获取到文件名，使用消息文本或默认名称
+    if not filename:
+        filename = message.message or "未命名文件"
+
+    # 确定媒体类型和目标目录
+    if hasattr(media, "document"):
+        mime_type = media.document.mime_type
+        if mime_type:
+            if mime_type.startswith("video/"):
+                media_type = "video"
+                target_dir = TELEGRAM_VIDEOS_DIR
+            elif mime_type.startswith("audio/"):
+                media_type = "audio"
+                target_dir = TELEGRAM_AUDIOS_DIR
+            else:
+                media_type = "other"
+                target_dir = TELEGRAM_OTHERS_DIR
+        else:
+            media_type = "other"
+            target_dir = TELEGRAM_OTHERS_DIR
+    elif hasattr(media, "photo"):
+        media_type = "photo"
+        target_dir = TELEGRAM_PHOTOS_DIR
+    else:
+        media_type = "other"
+        target_dir = TELEGRAM_OTHERS_DIR
+
+    return filename, media_type, target_dir
+
+
+async def download_telegram_file(message, target_dir, progress_callback):
+    """
+    将消息中的媒体下载到目标目录对应的暂存目录
+
+    暂存目录与目标目录位于同一文件系统，下载完成后只需重命名。
+    下载使用连接池中负载最低且能访问该消息的会话。
+    下载前按文档大小预留磁盘空间，空间不足时等待；文件大小或分片校验失败时删除文件并重新下载。
+
+    Returns:
+        tuple: (下载后的文件路径, 文件的SHA-256)，下载结果为空时返回 (None, None)
+    """
+    staging_dir = get_staging_dir(target_dir, TELEGRAM_TEMP_DIR)
+    first_byte = metrics.FirstByteTimer("telegram")
+    progress_callback = first_byte.wrap_callback(progress_callback)
+    document = getattr(message.media, "document", None)
+    for attempt in range(integrity.RETRIES + 1):
+        try:
+            async with disk_space.SPACE.reserve(
+                staging_dir, document.size if document else 0
+            ) as reservation:
+                return await fetch_telegram_file(
+                    message, staging_dir, progress_callback, reservation
+                )
+        except integrity.IntegrityError as e:
+            metrics.INTEGRITY_FAILURES.inc(source="telegram")
+            if attempt == integrity.RETRIES:
+                raise
+            logger.warning(f"消息 {message.id} 的文件校验失败，重新下载: {str(e)}")
+
+
+async def fetch_telegram_file(message, staging_dir, progress_callback, reservation):
+    """下载消息中的媒体到暂存目录，返回 (文件路径, SHA-256)"""
+    async with client_pool.POOL.lease(message) as message:
+        media = message.media
+        with metrics.DOWNLOAD_SECONDS.time(source="telegram"):
+            if hasattr(media, "document"):
+                # 文档支持断点续传，大文件使用多连接并行下载
+                connections = (
+                    TG_CONNECTIONS
+                    if media.document.size >= TG_PARALLEL_THRESHOLD
+                    else 1
+                )
+                return await download_document_parallel(
+                    message,
+                    staging_dir,
+                    connections=connections,
+                    progress_callback=progress_callback,
+                    reservation=reservation,
+                )
+            # 图片等媒体由 Telethon 直接下载，同样计入Telegram的带宽限制
+            path = await message.download_media(
+                file=staging_dir,
+                progress_callback=bandwidth.GOVERNOR.wrap_callback(progress_callback),
+            )
+    if not path:
+        return None, None
+    # 图片等小文件由 Telethon 直接下载，完成后再计算哈希
+    loop = asyncio.get_running_loop()
+    if os.path.getsize(path) == 0:
+        os.remove(path)
+        raise integrity.IntegrityError(f"下载的文件为空: {path}")
+    return path, await loop.run_in_executor(None, integrity.file_sha256, path)
+
+
+async def move_telegram_file(
+    downloaded_file, target_dir, media_key, sha256=None, mime_type=None
+):
+    """将下载完成的文件移动到目标目录并加入媒体索引，返回文件最终的路径"""
+    os.makedirs(target_dir, exist_ok=True)
+    target_path = os.path.join(target_dir, os.path.basename(downloaded_file))
+    with metrics.FINALIZE_SECONDS.time(source="telegram"):
+        target_path = await finalize_file_async(downloaded_file, target_path)
+    metrics.DOWNLOADED_BYTES.inc(os.path.getsize(target_path), source="telegram")
+    return await record_download(media_key, target_path, sha256, mime_type)
+
+
+async def process_download(message, refresh=False, route=None):
+    """
+    处理接收到的视频消息或视频链接，下载失败时抛出异常以便队列重试
+
+    route 为消息中需要下载的链接（url_router.Route），为None时下载消息中的媒体。
+    refresh 为 True 时重新解析链接，不使用缓存的解析结果。
+    """
+    status_message = None
+    try:
+        if route:
+            message_text = route.url
+            try:
+                status_message = await message.reply("开始解析下载链接..")
+                is_playlist = route.playlist
+
+                if is_playlist:
+                    # 逐个解析播放列表条目，解析到第一个视频后即开始下载
+                    entries = stream_playlist_entries(message_text)
+                    info = await entries.__anext__()
+                    total_videos = info.get("playlist_count")  # 总数未知时为None
+                    discovered = 0  # 已解析到的视频数
+                    success_count = 0
+                    skipped_count = 0  # 已存在而跳过下载的视频数
+                    failures = []  # (序号, 失败原因)
+                    playlist_title = info.get("title") or "未知播放列表"
+
+                    def total_label():
+                        """视频总数，解析完成前显示为已解析数量+"""
+                        return str(total_videos) if total_videos else f"{discovered}+"
+
+                    # 播放列表的所有进度合并显示在同一条状态消息中
+                    reporter = ProgressReporter(
+                        status_message,
+                        interval=PROGRESS_INTERVAL,
+                        log_interval=PROGRESS_LOG_INTERVAL,
                     )
 
-                    if is_playlist:
-                        # 首先获取视频信息
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            info = ydl.extract_info(message_text, download=False)
-                        total_videos = len(info["entries"])
-                        success_count = 0
-                        failed_videos = []
-                        playlist_title = info.get("title", "未知播放列表")
-                        await status_message.edit(
-                            f"检测到播放列表：{playlist_title}\n"
-                            f"共{total_videos}个视频，开始下载..."
+                    def update_header():
+                        finished = success_count + len(failures)
+                        reporter.set_header(
+                            f"📋 播放列表：{playlist_title}\n"
+                            f"下载进度：{finished}/{total_label()}\n"
+                            f"成功：{success_count} 失败：{len(failures)}"
                         )
 
-                        # 下载播放列表中的每个视频
-                        for index, entry in enumerate(info["entries"], 1):
-                            if entry is None:
-                                error_msg = f"视频 #{index} 无法访问（可能是私密视频）"
-                                failed_videos.append(error_msg)
-                                await status_message.edit(
-                                    f"⚠️ 播放列表 {playlist_title} 中的视频无法访问\n"
-                                    f"序号: {index}/{total_videos}\n"
-                                    f"原因: 可能是私密视频"
+                    def add_failure(index, error, note):
+                        failures.append((index, error))
+                        metrics.DOWNLOAD_FAILURES.inc(source="youtube")
+                        reporter.add_note(note)
+                        update_header()
+
+                    async def download_entry(index, entry):
+                        """下载播放列表中的单个视频并记录结果"""
+                        nonlocal success_count, skipped_count
+                        if entry is None:
+                            add_failure(
+                                index,
+                                f"视频 #{index} 无法访问（可能是私密视频）",
+                                f"⚠️ #{index} 无法访问（可能是私密视频）",
+                            )
+                            return
+
+                        video_title = entry.get("title") or "未知标题"
+                        try:
+                            video_url = entry.get("webpage_url") or entry.get("url")
+                            if not video_url:
+                                add_failure(
+                                    index,
+                                    f"视频 #{index} ({video_title}) URL获取失败",
+                                    f"⚠️ #{index} {video_title}: URL获取失败",
                                 )
-                                continue
+                                return
+
+                            existing = media_index.lookup(
+                                video_key(entry.get("id"), entry.get("ie_key"))
+                            )
+                            if existing:
+                                success_count += 1
+                                skipped_count += 1
+                                reporter.add_note(f"⏭️ #{index} {video_title}: 已存在")
+                                update_header()
+                                return
 
                             try:
-                                video_url = entry.get("webpage_url") or entry.get("url")
-                                video_title = entry.get("title", "未知标题")
-                                if not video_url:
-                                    error_msg = (
-                                        f"视频 #{index} ({video_title}) URL获取失败"
-                                    )
-                                    failed_videos.append(error_msg)
-                                    await status_message.edit(
-                                        f"⚠️ 播放列表 {playlist_title} 中的视频URL获取失败\n"
-                                        f"序号: {index}/{total_videos}\n"
-                                        f"标题: {video_title}"
-                                    )
-                                    continue
-
-                                # 下载单个视频
-                                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                    # 更新下载开始的消息
-                                    await event.reply(
-                                        f"开始下载YouTube视频：{video_title}\n"
-                                        f"序号: {index}/{total_videos}"
-                                    )
-                                    try:
-                                        info = ydl.extract_info(
-                                            video_url, download=True
-                                        )
-                                        video_id = info["id"]
-                                        video_title = info["title"]
-
-                                        # 查找并移动文件
-                                        success, result = find_and_move_youtube_video(
-                                            video_id, video_title, info
-                                        )
-                                        if success:
-                                            success_count += 1
-                                            await event.reply(
-                                                f"✅ 播放列表 {playlist_title} 中的视频已下载并移动!\n"
-                                                f"序号: {index}/{total_videos}\n"
-                                                f"标题: {video_title}\n"
-                                                f"位置: {result}\n"
-                                                f"下载进度：{index}/{total_videos}\n"
-                                                f"成功：{success_count} 失败：{len(failed_videos)}"
-                                            )
-                                        else:
-                                            failed_videos.append(
-                                                f"视频 #{index} ({video_title}) - {result}"
-                                            )
-                                            await event.reply(
-                                                f"⚠️ 播放列表 {playlist_title} 中的视频下载完成但移动失败!\n"
-                                                f"序号: {index}/{total_videos}\n"
-                                                f"标题: {video_title}\n"
-                                                f"错误: {result}\n"
-                                                f"下载进度：{index}/{total_videos}\n"
-                                                f"成功：{success_count} 失败：{len(failed_videos)}"
-                                            )
-
-                                    except Exception as download_error:
-                                        error_msg = str(download_error)
-                                        if "No video formats found" in error_msg:
-                                            await status_message.edit(
-                                                f"⚠️ 播放列表 {playlist_title} 中的视频格式不可用\n"
-                                                f"序号: {index}/{total_videos}\n"
-                                                f"标题: {video_title}"
-                                            )
-                                            failed_videos.append(
-                                                f"视频 #{index} ({video_title}) - 格式不可用"
-                                            )
-                                        else:
-                                            failed_videos.append(
-                                                f"视频 #{index} ({video_title}) 下载失败: {error_msg[:100]}..."
-                                            )
-                                            await status_message.edit(
-                                                f"❌ 播放列表 {playlist_title} 中的视频下载失败\n"
-                                                f"序号: {index}/{total_videos}\n"
-                                                f"标题: {video_title}\n"
-                                                f"错误: {error_msg[:200]}..."
-                                            )
-                                        continue
-
-                            except Exception as e:
-                                error_msg = str(e)
-                                if (
-                                    "Video unavailable" in error_msg
-                                    and "private" in error_msg
-                                ):
-                                    await status_message.edit(
-                                        f"⚠️ 播放列表 {playlist_title} 中的视频为私密视频\n"
-                                        f"序号: {index}/{total_videos}\n"
-                                        f"标题: {video_title}"
+                                video_info = await extract_youtube_info(
+                                    video_url,
+                                    download=True,
+                                    progress_hook=reporter.ytdlp_hook(
+                                        index, video_title
+                                    ),
+                                    refresh=refresh,
+                                )
+                                video_id = video_info["id"]
+                                video_title = video_info["title"]
+
+                                # 查找并移动文件
+                                success, result = await run_in_youtube_executor(
+                                    find_and_move_youtube_video,
+                                    video_id,
+                                    video_title,
+                                    video_info,
+                                )
+                                if success:
+                                    result = await record_download(
+                                        video_key(
+                                            video_id, video_info.get("extractor_key")
+                                        ),
+                                        result,
+                                        video_info.get("__sha256"),
                                     )
-                                    failed_videos.append(
-                                        f"视频 #{index} ({video_title}) - 私密视频"
+                            except Exception as download_error:
+                                error_msg = str(download_error)
+                                if "No video formats found" in error_msg:
+                                    add_failure(
+                                        index,
+                                        f"视频 #{index} ({video_title}) - 格式不可用",
+                                        f"⚠️ #{index} {video_title}: 格式不可用",
                                     )
                                 else:
-                                    failed_videos.append(
-                                        f"视频 #{index} ({video_title}) 下载失败: {error_msg[:100]}..."
+                                    add_failure(
+                                        index,
+                                        f"视频 #{index} ({video_title}) 下载失败: {error_msg[:100]}...",
+                                        f"❌ #{index} {video_title}: {error_msg[:100]}",
                                     )
-                                    await status_message.edit(
-                                        f"❌ 播放列表 {playlist_title} 中的视频下载失败\n"
-                                        f"序号: {index}/{total_videos}\n"
-                                        f"标题: {video_title}\n"
-                                        f"错误: {error_msg[:200]}..."
-                                    )
-
-                        # 播放列表下载完成后的总结
-                        summary = (
-                            f"📋 播放列表 {playlist_title} 下载完成！\n"
-                            f"总计：{total_videos}个视频\n"
-                            f"✅ 成功：{success_count}\n"
-                            f"❌ 失败：{len(failed_videos)}"
-                        )
-                        if failed_videos:
-                            summary += "\n\n失败视频列表："
-                            for fail in failed_videos[:10]:  # 只显示前10个失败
-                                summary += f"\n- {fail}"
-                            if len(failed_videos) > 10:
-                                summary += f"\n...等共{len(failed_videos)}个视频失败"
-                        summary += f"\n\n📂 保存位置: {YOUTUBE_DEST_DIR}"
-
-                        # 发送最终汇总消息
-                        await status_message.edit(summary)
+                                return
+                            finally:
+                                reporter.finish(index)
 
-                    else:
-                        # 单个视频的处理
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            info = ydl.extract_info(message_text, download=True)
-                            video_id = info["id"]
-                            video_title = info["title"]
-
-                            # 查找并移动文件
-                            success, result = find_and_move_youtube_video(
-                                video_id, video_title, info
-                            )
                             if success:
-                                await event.reply(
-                                    f"✅ YouTube视频下载完成！\n"
-                                    f"标题: {video_title}\n"
-                                    f"位置: {result}"
-                                )
+                                success_count += 1
+                                reporter.add_note(f"✅ #{index} {video_title}")
+                                update_header()
                             else:
-                                await event.reply(
-                                    f"⚠️ YouTube视频下载完成但移动失败！\n"
-                                    f"标题: {video_title}\n"
-                                    f"错误: {result}"
+                                add_failure(
+                                    index,
+                                    f"视频 #{index} ({video_title}) - {result}",
+                                    f"⚠️ #{index} {video_title}: 下载完成但移动失败",
                                 )
 
-                    # 删除临时cookies文件
-                    if YT_COOKIES and os.path.exists(temp_cookie_file):
-                        os.unlink(temp_cookie_file)
+                        except Exception as e:
+                            error_msg = str(e)
+                            if (
+                                "Video unavailable" in error_msg
+                                and "private" in error_msg
+                            ):
+                                add_failure(
+                                    index,
+                                    f"视频 #{index} ({video_title}) - 私密视频",
+                                    f"⚠️ #{index} {video_title}: 私密视频",
+                                )
+                            else:
+                                add_failure(
+                                    index,
+                                    f"视频 #{index} ({video_title}) 下载失败: {error_msg[:100]}...",
+                                    f"❌ #{index} {video_title}: {error_msg[:100]}",
+                                )
 
-                    logger.info(
-                        f"Successfully downloaded {'playlist' if is_playlist else 'video'}: {info.get('title', '')}"
-                    )
+                    # 并发下载播放列表中的视频，同时下载的数量达到上限时暂停调度新条目
+                    semaphore = asyncio.Semaphore(YT_PLAYLIST_CONCURRENCY)
+                    tasks = set()
 
-                except Exception as e:
-                    error_msg = str(e)
-                    error_message = (
-                        f"YouTube下载失败: 需要验证。\n"
-                        f"请检查配置文件 config.yaml 中的 youtube_download.cookies 是否正确设置。"
-                        if "Sign in to confirm you're not a bot" in error_msg
-                        else f"YouTube视频下载失败: {error_msg}"
+                    async def run_entry(index, entry):
+                        try:
+                            await download_entry(index, entry)
+                        finally:
+                            semaphore.release()
+
+                    update_header()
+                    reporter.start()
+                    try:
+                        async for entry in entries:
+                            discovered += 1
+                            update_header()
+                            await semaphore.acquire()
+                            task = asyncio.create_task(run_entry(discovered, entry))
+                            tasks.add(task)
+                            task.add_done_callback(tasks.discard)
+                        total_videos = discovered
+                        update_header()
+                        await asyncio.gather(*tasks)
+                    except BaseException:
+                        # 解析中途失败或任务被取消时停止已开始的下载和后台解析，
+                        # 否则重试时会与仍在进行的下载重复下载同一视频
+                        running = list(tasks)
+                        for task in running:
+                            task.cancel()
+                        await asyncio.gather(*running, return_exceptions=True)
+                        await entries.aclose()
+                        await reporter.close()
+                        raise
+                    # 失败列表按播放列表中的顺序排列
+                    failed_videos = [error for _, error in sorted(failures)]
+
+                    # 播放列表下载完成后的总结
+                    summary = (
+                        f"📋 播放列表 {playlist_title} 下载完成！\n"
+                        f"总计：{total_videos}个视频\n"
+                        f"✅ 成功：{success_count}（其中{skipped_count}个已存在）\n"
+                        f"❌ 失败：{len(failed_videos)}"
                     )
-                    if status_message:
-                        await event.reply(error_message)
-                    else:
-                        await event.reply(error_message)
-                    logger.error(f"YouTube download error: {error_msg}")
-
-            # 处理Telegram视频
-            elif event.message.media:
-                media = event.message.media
-
-                # 获取文件名
-                filename = None
-                if hasattr(media, "document"):
-                    # 从文档属性中获取文件名
-                    for attr in media.document.attributes:
-                        if hasattr(attr, "title") and attr.title:
-                            filename = attr.title
-                            break
-
-                    # 如果属性中没有文件名，尝试从MIME类型生成
-                    if not filename and hasattr(media.document, "mime_type"):
-                        mime_type = media.document.mime_type
-                        ext = mime_type.split("/")[-1] if mime_type else "unknown"
-                        filename = f"未命名文件.{ext}"
-
-                # 如果是照片，生成时间戳文件名
-                elif hasattr(media, "photo"):
-                    from datetime import datetime
-
-                    filename = f"photo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-
-                # 如果以上都没有获取到文件名，使用消息文本或默认名称
-                if not filename:
-                    filename = event.message.message or "未命名文件"
-
-                # 确定媒体类型和目标目录
-                if hasattr(media, "document"):
-                    mime_type = media.document.mime_type
-                    if mime_type:
-                        if mime_type.startswith("video/"):
-                            media_type = "video"
-                            target_dir = TELEGRAM_VIDEOS_DIR
-                        elif mime_type.startswith("audio/"):
-                            media_type = "audio"
-                            target_dir = TELEGRAM_AUDIOS_DIR
-                        else:
-                            media_type = "other"
-                            target_dir = TELEGRAM_OTHERS_DIR
-                    else:
-                        media_type = "other"
-                        target_dir = TELEGRAM_OTHERS_DIR
-                elif hasattr(media, "photo"):
-                    media_type = "photo"
-                    target_dir = TELEGRAM_PHOTOS_DIR
-                else:
-                    media_type = "other"
-                    target_dir = TELEGRAM_OTHERS_DIR
+                    if failed_videos:
+                        summary += "\n\n失败视频列表："
+                        for fail in failed_videos[:10]:  # 只显示前10个失败
+                            summary += f"\n- {fail}"
+                        if len(failed_videos) > 10:
+                            summary += f"\n...等共{len(failed_videos)}个视频失败"
+                    summary += f"\n\n📂 保存位置: {YOUTUBE_DEST_DIR}"
 
-                status_message = await event.reply(
-                    f"开始下载 {media_type} 文件...{filename}"
-                )
+                    # 发送最终汇总消息
+                    await reporter.close(summary)
 
-                try:
-                    # 下载文件
-                    downloaded_file = await event.message.download_media(
-                        file=TELEGRAM_TEMP_DIR,
-                        progress_callback=lambda received, total: logger.info(
-                            f"下载进度: {filename} {received}/{total} bytes"
-                        ),
+                else:
+                    # 单个视频的处理
+                    route_keys = route_video_keys(route)
+                    existing = next(
+                        filter(None, map(media_index.lookup, route_keys)), None
                     )
-
-                    if downloaded_file:
+                    if existing:
+                        info = {"id": route.video_id}
+                        await message.reply(
+                            f"✅ YouTube视频已存在，跳过下载\n位置: {existing}"
+                        )
+                    else:
+                        reporter = ProgressReporter(
+                            status_message,
+                            header="正在下载YouTube视频",
+                            interval=PROGRESS_INTERVAL,
+                            log_interval=PROGRESS_LOG_INTERVAL,
+                        ).start()
                         try:
-                            os.makedirs(target_dir, exist_ok=True)
-                            target_path = os.path.join(
-                                target_dir, os.path.basename(downloaded_file)
+                            info = await extract_youtube_info(
+                                message_text,
+                                download=True,
+                                progress_hook=reporter.ytdlp_hook(
+                                    message_text, message_text
+                                ),
+                                refresh=refresh,
                             )
-                            shutil.move(downloaded_file, target_path)
-                            logger.info(f"已将{media_type}文件移动到: {target_path}")
-                            await event.reply(
-                                f"Telegram {media_type} 文件下载完成！\n"
-                                f"保存为: {os.path.basename(target_path)}\n"
-                                f"位置: {target_path}"
+                        finally:
+                            await reporter.close()
+                        video_id = info["id"]
+                        video_title = info["title"]
+
+                        # 查找并移动文件
+                        success, result = await run_in_youtube_executor(
+                            find_and_move_youtube_video, video_id, video_title, info
+                        )
+                        if success:
+                            result = await record_download(
+                                video_key(video_id, info.get("extractor_key")),
+                                result,
+                                info.get("__sha256"),
+                                aliases=route_keys,
                             )
-                        except Exception as move_error:
-                            error_msg = (
-                                f"{media_type}文件已下载但移动失败: {str(move_error)}"
+                            await message.reply(
+                                f"✅ YouTube视频下载完成！\n"
+                                f"标题: {video_title}\n"
+                                f"位置: {result}"
                             )
-                            logger.error(error_msg)
-                            await event.reply(
-                                f"Telegram {media_type} 文件下载完成，但移动失败！\n"
-                                f"文件名: {os.path.basename(downloaded_file)}\n"
-                                f"当前位置: {downloaded_file}\n"
-                                f"移动错误: {str(move_error)}"
+                        else:
+                            await message.reply(
+                                f"⚠️ YouTube视频下载完成但移动失败！\n"
+                                f"标题: {video_title}\n"
+                                f"错误: {result}"
                             )
-                    else:
-                        await event.reply("下载失败！文件为空")
-                        logger.error("Download failed: Empty file received")
 
-                except Exception as download_error:
-                    error_msg = (
-                        f"Telegram {media_type} 文件下载失败: {str(download_error)}"
-                    )
-                    if status_message:
-                        await event.reply(error_msg)
-                    else:
-                        await event.reply(error_msg)
-                    logger.error(error_msg)
+                logger.info(
+                    f"Successfully downloaded {'playlist' if is_playlist else 'video'}: {info.get('title', '')}"
+                )
 
-        except Exception as e:
-            error_message = f"处理过程中出现错误: {str(e)}"
-            if status_message:
-                await event.reply(error_message)
-            else:
-                await event.reply(error_message)
-            logger.error(error_message)
+            except Exception as e:
+                error_msg = str(e)
+                error_message = (
+                    f"YouTube下载失败: 需要验证。\n"
+                    f"请检查配置文件 config.yaml 中的 youtube_download.cookies 是否正确设置。"
+                    if "Sign in to confirm you're not a bot" in error_msg
+                    else f"YouTube视频下载失败: {error_msg}"
+                )
+                if status_message:
+                    await message.reply(error_message)
+                else:
+                    await message.reply(error_message)
+                logger.error(f"YouTube download error: {error_msg}")
+                if is_permanent_error(error_msg):
+                    raise PermanentJobError(error_message) from e
+                raise JobError(error_message) from e
+
+        # 处理Telegram视频
+        elif message.media:
+            filename, media_type, target_dir = describe_telegram_media(message)
+
+            # 已下载过的文件直接返回已有路径
+            media_key = telegram_media_key(message.media)
+            existing = media_index.lookup(media_key)
+            if existing:
+                await message.reply(
+                    f"Telegram {media_type} 文件已存在，跳过下载\n位置: {existing}"
+                )
+                logger.info(f"文件已存在，跳过下载: {existing}")
+                return
+
+            status_message = await message.reply(
+                f"开始下载 {media_type} 文件...{filename}"
+            )
+
+            reporter = ProgressReporter(
+                status_message,
+                header=f"正在下载 {media_type} 文件",
+                interval=PROGRESS_INTERVAL,
+                log_interval=PROGRESS_LOG_INTERVAL,
+            ).start()
+            try:
+                # 下载文件
+                downloaded_file, sha256 = await download_telegram_file(
+                    message, target_dir, reporter.track(filename, filename)
+                )
+                await reporter.close()
+
+                if downloaded_file:
+                    try:
+                        target_path = await move_telegram_file(
+                            downloaded_file,
+                            target_dir,
+                            media_key,
+                            sha256,
+                            telegram_mime_type(message),
+                        )
+                        logger.info(f"已将{media_type}文件移动到: {target_path}")
+                        await message.reply(
+                            f"Telegram {media_type} 文件下载完成！\n"
+                            f"保存为: {os.path.basename(target_path)}\n"
+                            f"位置: {target_path}"
+                        )
+                    except Exception as move_error:
+                        error_msg = (
+                            f"{media_type}文件已下载但移动失败: {str(move_error)}"
+                        )
+                        logger.error(error_msg)
+                        await message.reply(
+                            f"Telegram {media_type} 文件下载完成，但移动失败！\n"
+                            f"文件名: {os.path.basename(downloaded_file)}\n"
+                            f"当前位置: {downloaded_file}\n"
+                            f"移动错误: {str(move_error)}"
+                        )
+                else:
+                    await message.reply("下载失败！文件为空")
+                    logger.error("Download failed: Empty file received")
+                    # 投票、位置、联系人等媒体没有可下载的文件，重试也不会成功
+                    raise PermanentJobError("下载失败！文件为空")
+
+            except JobError:
+                raise
+            except Exception as download_error:
+                await reporter.close()
+                error_msg = f"Telegram {media_type} 文件下载失败: {str(download_error)}"
+                if status_message:
+                    await message.reply(error_msg)
+                else:
+                    await message.reply(error_msg)
+                logger.error(error_msg)
+                raise JobError(error_msg) from download_error
+
+    except JobError:
+        raise
+    except Exception as e:
+        error_message = f"处理过程中出现错误: {str(e)}"
+        if status_message:
+            await message.reply(error_message)
+        else:
+            await message.reply(error_message)
+        logger.error(error_message)
+        raise JobError(error_message) from e
 
 
 # 配置yt-dlp
@@ -539,9 +1428,17 @@ def sanitize_filename(s):
     return s
 
 
+def get_downloaded_filepath(info):
+    """从yt-dlp返回的信息中获取下载（及后处理）完成后的文件路径"""
+    for download in info.get("requested_downloads") or []:
+        if download.get("filepath"):
+            return download["filepath"]
+    return info.get("filepath")
+
+
 def find_and_move_youtube_video(video_id, video_title, info):
     """
-    在临时目录中查找并移动YouTube视频文件
+    移动yt-dlp下载完成的YouTube视频文件
 
     Args:
         video_id (str): YouTube视频ID
@@ -552,51 +1449,53 @@ def find_and_move_youtube_video(video_id, video_title, info):
         tuple: (是否成功, 目标路径或错误信息)
     """
     try:
-        # 遍历临时目录
-        for file in os.listdir(YOUTUBE_TEMP_DIR):
-            # 检查文件名中是否包含视频ID
-            if video_id in file and str(file).endswith(info["ext"]):
-                source_path = os.path.join(YOUTUBE_TEMP_DIR, file)
-                # 确保目标目录存在
-                os.makedirs(YOUTUBE_DEST_DIR, exist_ok=True)
-                # 构建目标路径
-                target_path = os.path.join(
-                    YOUTUBE_DEST_DIR, f"{sanitize_filename(video_title)}.{info['ext']}"
-                )
-                # 移动文件
-                shutil.move(source_path, target_path)
-                return True, target_path
-
-        return False, f"未找到ID为{video_id}的视频文件"
+        # 使用yt-dlp报告的最终文件路径，不再扫描暂存目录
+        source_path = get_downloaded_filepath(info)
+        if not source_path or not os.path.exists(source_path):
+            return False, f"未找到ID为{video_id}的视频文件"
+
+        # 构建目标路径，扩展名以实际文件为准（合并后的格式可能与info["ext"]不同）
+        ext = os.path.splitext(source_path)[1] or f".{info['ext']}"
+        target_path = os.path.join(
+            YOUTUBE_DEST_DIR, f"{sanitize_filename(video_title)}{ext}"
+        )
+        # 移动文件，暂存目录与目标目录在同一文件系统时只需重命名
+        with metrics.FINALIZE_SECONDS.time(source="youtube"):
+            target_path = finalize_file(source_path, target_path)
+        metrics.DOWNLOADED_BYTES.inc(os.path.getsize(target_path), source="youtube")
+        return True, target_path
     except Exception as e:
         return False, f"移动文件时出错: {str(e)}"
 
 
-async def send_scheduled_message(client, chat_id, message):
-    """发送定时消息"""
-    try:
-        await client.send_message(chat_id, message)
-        logger.info(f"成功发送消息到 {chat_id}")
-    except Exception as e:
-        logger.error(f"发送消息到 {chat_id} 失败: {str(e)}")
+def initialize_scheduler(client, scheduled_messages):
+    """
+    初始化定时任务，返回 (调度器, 启动时补发错过的消息的协程)
 
+    每个定时任务可以有多个目标，触发时登记所有目标后按频率限制发送；
+    发送状态保存在 config/scheduler.db 中，重启后继续未完成的发送并补发错过的消息。
+    """
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.cron import CronTrigger
 
-def initialize_scheduler(client, scheduled_messages):
-    """初始化定时任务"""
     scheduler = AsyncIOScheduler()
-
-    if not scheduled_messages:
-        logger.info("没有配置定时消息任务")
-        return scheduler
+    broadcaster = Broadcaster(
+        client,
+        broadcast_store,
+        concurrency=BROADCAST_CONFIG.get("concurrency", 4),
+        messages_per_second=BROADCAST_CONFIG.get("messages_per_second", 1),
+        misfire_grace=BROADCAST_MISFIRE_GRACE,
+    )
+    jobs = []
 
     # 添加所有定时任务
-    for idx, task in enumerate(scheduled_messages):
+    for idx, task in enumerate(scheduled_messages or []):
         try:
-            chat_id = task.get("chat_id")
+            targets = parse_targets(task)
             message = task.get("message")
             schedule_time = task.get("time", "08:00")  # 默认早上8点
 
-            if not chat_id or not message:
+            if not targets or not message:
                 logger.warning(f"定时任务 #{idx+1} 缺少必要的参数 (chat_id 或 message)")
                 continue
 
@@ -607,47 +1506,171 @@ def initialize_scheduler(client, scheduled_messages):
                 logger.error(f"定时任务 #{idx+1} 的时间格式错误: {schedule_time}")
                 continue
 
-            # 创建定时任务
+            # 创建定时任务，事件循环繁忙导致的延迟在补发期限内仍会执行
+            job_id = task.get("name") or f"message_{idx}"
             scheduler.add_job(
-                send_scheduled_message,
+                broadcaster.fire,
                 CronTrigger(hour=hour, minute=minute),
-                args=[client, chat_id, message],
-                id=f"message_{idx}",
+                args=[job_id, targets, message, hour, minute],
+                id=job_id,
                 replace_existing=True,
+                misfire_grace_time=BROADCAST_MISFIRE_GRACE,
+                coalesce=True,
             )
+            jobs.append((job_id, targets, message, hour, minute))
 
             logger.info(
-                f"已添加定时任务 #{idx+1}: 发送到 {chat_id}, 每天 {schedule_time}"
+                f"已添加定时任务 #{idx+1}: 发送到 {len(targets)} 个会话, "
+                f"每天 {schedule_time}"
             )
 
         except Exception as e:
             logger.error(f"添加定时任务 #{idx+1} 失败: {str(e)}")
 
+    if not jobs:
+        logger.info("没有配置定时消息任务")
+    return scheduler, broadcaster.catch_up(jobs)
+
+
+def cleanup_temp_files():
+    """清理临时目录和各暂存目录中过期的未完成下载"""
+    for directory in {TELEGRAM_TEMP_DIR, *staging_dirs()}:
+        cleanup_stale_parts(directory, TG_PART_MAX_AGE)
+
+    # YouTube暂存目录中只有下载中的文件，长时间未更新的分片和残留文件直接删除
+    youtube_dirs = {
+        YOUTUBE_TEMP_DIR,
+        get_staging_dir(YOUTUBE_DEST_DIR, YOUTUBE_TEMP_DIR),
+    }
+    for directory in youtube_dirs:
+        cleanup_stale_files(directory, YT_TEMP_MAX_AGE)
+
+
+def temp_dir_usage():
+    """临时目录和各暂存目录占用的空间"""
+    directories = {TEMP_DIR}
+    for directory in staging_dirs():
+        # 位于临时目录中的暂存目录已经统计过
+        if os.path.commonpath([TEMP_DIR, directory]) != TEMP_DIR:
+            directories.add(directory)
+    return sum(directory_size(directory) for directory in directories)
+
+
+metrics.TEMP_DIR_BYTES.set_function(temp_dir_usage)
+metrics.DISK_RESERVED_BYTES.set_function(disk_space.SPACE.outstanding)
+
+
+def initialize_maintenance_scheduler():
+    """初始化定期维护任务"""
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    scheduler = AsyncIOScheduler()
+
+    # 清理过期的未完成下载
+    scheduler.add_job(
+        cleanup_temp_files,
+        IntervalTrigger(hours=1),
+        id="cleanup_stale_parts",
+        next_run_time=datetime.now(),
+    )
+
+    # 按时段切换限速设置
+    for idx, profile in enumerate(RATE_LIMIT_PROFILES):
+        hour, minute = profile["start"]
+        scheduler.add_job(
+            apply_rate_limit,
+            CronTrigger(hour=hour, minute=minute),
+            args=[profile["name"], profile["rates"]],
+            id=f"rate_limit_{idx}",
+            replace_existing=True,
+        )
+
     return scheduler
 
 
-async def main():
-    """同时启动机器人和用户账号"""
-    try:
-        # 加载配置
-        global config
-        config = load_config()
+class StartupTimer:
+    """记录并输出启动各阶段的耗时"""
 
-        # 创建所有必要的目录
-        os.makedirs(TELEGRAM_TEMP_DIR, exist_ok=True)
-        os.makedirs(YOUTUBE_TEMP_DIR, exist_ok=True)
-        os.makedirs(TELEGRAM_VIDEOS_DIR, exist_ok=True)
-        os.makedirs(TELEGRAM_AUDIOS_DIR, exist_ok=True)
-        os.makedirs(TELEGRAM_PHOTOS_DIR, exist_ok=True)
-        os.makedirs(TELEGRAM_OTHERS_DIR, exist_ok=True)
-        os.makedirs(YOUTUBE_DEST_DIR, exist_ok=True)
+    def __init__(self, start):
+        self.start = start
+        self.last = start
+        self.phases = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        logger.info(f"启动阶段「{name}」完成，耗时 {now - self.last:.2f}s")
+        self.last = now
 
-        # 设置日志级别
-        logging.getLogger().setLevel(config.get("log_level", "INFO"))
+    def summary(self):
+        total = time.perf_counter() - self.start
+        phases = ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in self.phases)
+        logger.info(f"启动完成，总耗时 {total:.2f}s（{phases}）")
 
-        # 创建客户端列表
-        global clients
-        clients = []
+
+async def main():
+    """先启动机器人，再启动用户账号和其他后台任务"""
+    timer = StartupTimer(STARTUP_BEGIN)
+    timer.mark("加载模块和配置")
+
+    clients = []
+    bot_client = None
+    scheduler = None
+    maintenance_scheduler = None
+    metrics_server = None
+    loop = asyncio.get_running_loop()
+
+    async def shutdown(signal_=None):
+        """优雅关闭"""
+        if signal_:
+            logger.info(f"收到信号 {signal_.name}...")
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        [task.cancel() for task in tasks]
+        logger.info(f"取消 {len(tasks)} 个待处理的任务")
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # 关闭下载队列
+        await job_queue.stop()
+
+        # 关闭缓存的文件下载连接，然后关闭所有客户端
+        await telegram_download.SENDERS.close_idle()
+        for client in clients:
+            await client.disconnect()
+
+        # 关闭调度器
+        if scheduler and scheduler.running:
+            scheduler.shutdown()
+        if maintenance_scheduler and maintenance_scheduler.running:
+            maintenance_scheduler.shutdown()
+        broadcast_store.close()
+
+        # 关闭指标接口
+        if metrics_server:
+            await metrics_server.stop()
+
+        # 关闭YouTube下载线程池
+        youtube_executor.shutdown(wait=False, cancel_futures=True)
+        youtube_session.close()
+
+        # 结束正在运行的后处理
+        await postprocess.PROCESSOR.shutdown()
+
+        loop.stop()
+
+    try:
+        # 创建所有必要的目录
+        for directory in (
+            TELEGRAM_TEMP_DIR,
+            YOUTUBE_TEMP_DIR,
+            TELEGRAM_VIDEOS_DIR,
+            TELEGRAM_AUDIOS_DIR,
+            TELEGRAM_PHOTOS_DIR,
+            TELEGRAM_OTHERS_DIR,
+            YOUTUBE_DEST_DIR,
+        ):
+            os.makedirs(directory, exist_ok=True)
 
         # 配置代理
         proxy = None
@@ -663,6 +1686,39 @@ async def main():
                 "port": proxy_config["port"],
             }
 
+        # 首先启动机器人客户端，尽快开始响应消息
+        bot_config = config.get("bot_account", {})
+        if bot_config.get("token"):
+            logger.info("正在启动机器人客户端...")
+            session_name = bot_config.get("session_name", "bot_session")
+            session_path = os.path.join(CONFIG_DIR, session_name)
+
+            bot_client = TelegramClient(
+                session_path, config["api_id"], config["api_hash"], proxy=proxy
+            )
+            clients.append(bot_client)
+
+            # 启动机器人客户端
+            await bot_client.start(bot_token=bot_config["token"])
+            logger.info("机器人启动成功！")
+            client_pool.POOL.add("bot", bot_client, bot=True)
+
+            # 为机器人注册下载处理器
+            register_handlers(bot_client)
+
+            # 启动下载队列
+            job_queue.start(functools.partial(process_download_job, bot_client))
+            timer.mark("连接机器人")
+
+        # 启动指标接口
+        metrics_config = config.get("metrics", {})
+        if metrics_config.get("enabled", False):
+            metrics_server = metrics.MetricsServer(
+                metrics_config.get("host", "0.0.0.0"),
+                metrics_config.get("port", 9100),
+            )
+            await metrics_server.start()
+
         # 创建并启动用户客户端
         user_config = config.get("user_account", {})
         if user_config.get("enabled", False):
@@ -678,57 +1734,55 @@ async def main():
             phone = user_config.get("phone", "")
             await user_client.start(phone=phone)
             logger.info(f"用户账号 {phone} 登录成功！")
+            client_pool.POOL.add(session_name, user_client)
+
+            # 其他用户账号只用于分担Telegram下载，不处理消息
+            for account in user_config.get("extra_accounts") or []:
+                extra_session = account.get("session_name")
+                if not extra_session:
+                    logger.warning("extra_accounts 中的账号缺少 session_name，已跳过")
+                    continue
+                extra_client = TelegramClient(
+                    os.path.join(CONFIG_DIR, extra_session),
+                    config["api_id"],
+                    config["api_hash"],
+                    proxy=proxy,
+                    receive_updates=False,
+                )
+                clients.append(extra_client)
+                await extra_client.start(phone=account.get("phone", ""))
+                client_pool.POOL.add(extra_session, extra_client)
+
+            # 通过机器人接收备份命令，使用用户账号读取历史消息
+            if bot_client:
+                me = await user_client.get_me()
+                allowed_users = set(BACKFILL_CONFIG.get("allowed_users") or [])
+                register_backfill_handlers(
+                    bot_client, user_client, allowed_users | {me.id}
+                )
 
-            # 初始化定时任务
-            scheduler = initialize_scheduler(
+            # 初始化定时任务，在后台补发停机期间错过的消息
+            scheduler, catch_up = initialize_scheduler(
                 user_client, config.get("scheduled_messages", [])
             )
             scheduler.start()
-
-        # 创建并启动机器人客户端
-        bot_config = config.get("bot_account", {})
-        if bot_config.get("token"):
-            logger.info("正在启动机器人客户端...")
-            session_name = bot_config.get("session_name", "bot_session")
-            session_path = os.path.join(CONFIG_DIR, session_name)
-
-            bot_client = TelegramClient(
-                session_path, config["api_id"], config["api_hash"], proxy=proxy
-            )
-            clients.append(bot_client)
-
-            # 启动机器人客户端
-            await bot_client.start(bot_token=bot_config["token"])
-            logger.info("机器人启动成功！")
-
-            # 为机器人注册下载处理器
-            register_handlers(bot_client)
+            asyncio.create_task(catch_up)
+            timer.mark("连接用户账号")
 
         if not clients:
             raise ValueError("未启用任何客户端，请在配置文件中至少启用一个客户端")
 
-        # 设置信号处理
-        loop = asyncio.get_event_loop()
+        # 启动定期维护任务
+        maintenance_scheduler = initialize_maintenance_scheduler()
+        maintenance_scheduler.start()
+        timer.mark("启动后台任务")
+        timer.summary()
 
-        async def shutdown(signal_=None):
-            """优雅关闭"""
-            if signal_:
-                logger.info(f"收到信号 {signal_.name}...")
-            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
-            [task.cancel() for task in tasks]
-            logger.info(f"取消 {len(tasks)} 个待处理的任务")
-            await asyncio.gather(*tasks, return_exceptions=True)
-
-            # 关闭所有客户端
-            for client in clients:
-                await client.disconnect()
-
-            # 关闭调度器
-            if "scheduler" in locals() and scheduler.running:
-                scheduler.shutdown()
-
-            loop.stop()
+        # 在后台加载yt-dlp并生成链接分派表，收到第一个链接时无需等待
+        loop.run_in_executor(youtube_executor, youtube_session.warm_up)
+        loop.run_in_executor(None, url_router.ROUTER.warm_up)
 
+        # 设置信号处理
         for sig in (signal.SIGTERM, signal.SIGINT):
             loop.add_signal_handler(sig, lambda s=sig: asyncio.create_task(shutdown(s)))
 
@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 计算文件哈希时每次读取的大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def telegram_media_key(media):
+    """
+    生成Telegram媒体的索引键，无法识别的媒体返回None
+
+    access_hash 对每个账号不同（机器人和备份用的用户账号收到的同一文件也不同），
+    不能作为键的一部分，只使用全局唯一的文件ID。
+    """
+    document = getattr(media, "document", None)
+    if document is not None:
+        return f"telegram:{document.id}:{document.size}"
+    photo = getattr(media, "photo", None)
+    if photo is not None:
+        return f"telegram_photo:{photo.id}"
+    return None
+
+
+def _legacy_telegram_key(key):
+    """将旧版本包含 access_hash 的Telegram索引键转换为当前格式，其他键返回None"""
+    parts = key.split(":")
+    if parts[0] == "telegram" and len(parts) == 4:
+        return f"telegram:{parts[1]}:{parts[3]}"
+    if parts[0] == "telegram_photo" and len(parts) == 3:
+        return f"telegram_photo:{parts[1]}"
+    return None
+
+
+def youtube_video_key(video_id, video_format):
+    """生成YouTube视频的索引键"""
+    return f"youtube:{video_id}:{video_format}"
+
+
+def file_sha256(path):
+    """计算文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaIndex:
+    """
+    已下载媒体的持久化索引
+
+    以来源相关的键（Telegram 文档ID、YouTube 视频ID等）记录文件保存的位置，
+    重复收到同一个文件时可以直接返回已有路径。可选地记录文件内容的哈希，
+    用于合并来自不同来源的相同文件。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()  # 索引会在下载线程中更新
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS media (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER,
+                sha256 TEXT,
+                created_at REAL NOT NULL
+            )
+            """)
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media (sha256)"
+        )
+        self._migrate_telegram_keys()
+        self._db.commit()
+
+    def _migrate_telegram_keys(self):
+        """转换旧版本的Telegram索引键，已下载的文件不会因为键的格式变化被重复下载"""
+        rows = self._db.execute(
+            "SELECT key FROM media WHERE key LIKE 'telegram%'"
+        ).fetchall()
+        for (key,) in rows:
+            new_key = _legacy_telegram_key(key)
+            if new_key is None:
+                continue
+            self._db.execute(
+                "UPDATE OR IGNORE media SET key = ? WHERE key = ?", (new_key, key)
+            )
+            # 同一文件有多条旧记录时只保留第一条
+            self._db.execute("DELETE FROM media WHERE key = ?", (key,))
+
+    def lookup(self, key):
+        """返回键对应的文件路径，文件已被删除时移除该记录并返回None"""
+        if not key:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path FROM media WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if not os.path.exists(row[0]):
+            self.remove(key)
+            return None
+        return row[0]
+
+    def add(self, key, path, sha256=None):
+        """记录已下载的文件"""
+        if not key:
+            return
+        size = os.path.getsize(path) if os.path.exists(path) else None
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO media (key, path, size, sha256, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, path, size, sha256, time.time()),
+            )
+            self._db.commit()
+
+    def replace_path(self, old_path, new_path, sha256=None):
+        """文件被转封装或转码后，将指向原文件的记录改为指向新文件"""
+        size = os.path.getsize(new_path) if os.path.exists(new_path) else None
+        with self._lock:
+            self._db.execute(
+                "UPDATE media SET path = ?, size = ?, sha256 = ? WHERE path = ?",
+                (new_path, size, sha256, old_path),
+            )
+            self._db.commit()
+
+    def remove(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM media WHERE key = ?", (key,))
+            self._db.commit()
+
+    def find_by_hash(self, sha256, exclude_path=None):
+        """查找内容相同且仍然存在的文件"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path FROM media WHERE sha256 = ? AND size IS NOT NULL",
+                (sha256,),
+            ).fetchall()
+        for (path,) in rows:
+            if path != exclude_path and os.path.exists(path):
+                return path
+        return None
+
+    def add_and_merge(self, key, path, hash_files=False, sha256=None):
+        """
+        记录已下载的文件，sha256 为下载过程中计算的哈希，会直接保存到索引中；
+        没有时 hash_files 为 True 才读取文件计算哈希。
+        hash_files 为 True 时如果已有内容相同的文件则删除新文件，索引指向已有文件
+
+        Returns:
+            str: 文件最终的路径
+        """
+        if not hash_files:
+            self.add(key, path, sha256=sha256)
+            return path
+
+        sha256 = sha256 or file_sha256(path)
+        existing = self.find_by_hash(sha256, exclude_path=path)
+        if existing:
+            os.remove(path)
+            logger.info(f"文件 {path} 与 {existing} 内容相同，已合并")
+            path = existing
+        self.add(key, path, sha256=sha256)
+        return path
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 下载耗时类直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类，按标签保存数值，下载线程和事件循环都会更新，所有操作都需要加锁"""
+
+    type = ""
+
+    def __init__(self, name, documentation, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def _samples(self):
+        """返回 (名称后缀, 标签, 数值) 列表"""
+        with self._lock:
+            return [("", key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self._samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """当前值，可以由回调函数在采集时计算"""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, registry=None):
+        super().__init__(name, documentation, registry)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """采集时调用 function 获取当前值"""
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def _samples(self):
+        samples = super()._samples()
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                samples.append(("", key, function()))
+            except Exception as e:
+                logger.warning(f"获取指标 {self.name} 失败: {str(e)}")
+        return samples
+
+
+class Histogram(_Metric):
+    """分桶统计的直方图"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录 with 代码块的耗时（代码块抛出异常时不记录）"""
+        start = time.monotonic()
+        yield
+        self.observe(time.monotonic() - start, **labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            items = [
+                (key, list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            ]
+        for key, counts, total, count in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append(
+                    ("_bucket", key + (("le", _format_value(bound)),), bucket_count)
+                )
+            samples.append(("_sum", key, total))
+            samples.append(("_count", key, count))
+        return samples
+
+
+class Registry:
+    """所有指标的集合"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """生成 Prometheus 文本格式的输出"""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# 下载任务指标，source 为 telegram 或 youtube
+JOBS = Counter(
+    "video_scraper_jobs_total", "处理完成的下载任务数，status 为 done 或 failed"
+)
+DOWNLOAD_FAILURES = Counter(
+    "video_scraper_download_failures_total",
+    "下载失败次数（包括会重试的任务和播放列表中的单个视频）",
+)
+RETRIES = Counter("video_scraper_job_retries_total", "下载任务的重试次数")
+DOWNLOADED_BYTES = Counter(
+    "video_scraper_downloaded_bytes_total", "保存到下载目录的字节数"
+)
+TIME_TO_FIRST_BYTE = Histogram(
+    "video_scraper_time_to_first_byte_seconds", "从开始下载到收到第一个字节的时间"
+)
+DOWNLOAD_SECONDS = Histogram(
+    "video_scraper_download_seconds", "单个文件的下载时间（不含移动文件）"
+)
+FINALIZE_SECONDS = Histogram(
+    "video_scraper_finalize_seconds",
+    "将下载完成的文件移动到下载目录的时间",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+THROTTLED_SECONDS = Counter(
+    "video_scraper_throttled_seconds_total", "因带宽或请求频率限制而等待的时间"
+)
+INTEGRITY_FAILURES = Counter(
+    "video_scraper_integrity_failures_total", "下载后校验失败而重新下载的次数"
+)
+DISK_RESERVED_BYTES = Gauge(
+    "video_scraper_disk_reserved_bytes", "正在进行的下载预留但尚未写入的磁盘空间"
+)
+DISK_WAIT_SECONDS = Counter(
+    "video_scraper_disk_wait_seconds_total", "因磁盘空间不足而等待的时间"
+)
+SCHEDULED_MESSAGES = Counter(
+    "video_scraper_scheduled_messages_total", "定时消息的发送结果"
+)
+POSTPROCESSED = Counter(
+    "video_scraper_postprocessed_total", "下载后转封装或转码的文件数"
+)
+POSTPROCESS_SECONDS = Histogram(
+    "video_scraper_postprocess_seconds",
+    "单个文件转封装或转码的时间",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+FLOOD_WAITS = Counter("video_scraper_flood_waits_total", "各会话被限流的次数")
+CLIENT_IN_FLIGHT = Gauge("video_scraper_client_in_flight", "各会话正在下载的文件数")
+ACTIVE_WORKERS = Gauge("video_scraper_active_workers", "正在处理任务的worker数")
+QUEUE_DEPTH = Gauge("video_scraper_queue_depth", "等待处理的下载任务数")
+TEMP_DIR_BYTES = Gauge(
+    "video_scraper_temp_dir_bytes", "临时目录和暂存目录中文件占用的字节数"
+)
+
+
+class FirstByteTimer:
+    """记录从创建到收到第一个字节的时间，包装进度回调使用"""
+
+    def __init__(self, source):
+        self.source = source
+        self.start = time.monotonic()
+        self.done = False
+
+    def mark(self):
+        if not self.done:
+            self.done = True
+            TIME_TO_FIRST_BYTE.observe(
+                time.monotonic() - self.start, source=self.source
+            )
+
+    def wrap_callback(self, callback):
+        """包装 Telegram 格式的进度回调 callback(received, total)"""
+
+        def wrapped(received, total):
+            if received:
+                self.mark()
+            callback(received, total)
+
+        return wrapped
+
+    def wrap_hook(self, hook):
+        """包装 yt-dlp 的 progress hook，hook 可以为None"""
+
+        def wrapped(d):
+            if d.get("status") == "downloading" and d.get("downloaded_bytes"):
+                self.mark()
+            if hook:
+                hook(d)
+
+        return wrapped
+
+
+class MetricsServer:
+    """
+    提供 /metrics 接口的HTTP服务
+
+    只实现 Prometheus 采集所需的最小 HTTP/1.0 功能，指标在线程池中生成，
+    避免统计目录大小等操作阻塞事件循环。
+    """
+
+    def __init__(self, host="0.0.0.0", port=9100, registry=None):
+        self.host = host
+        self.port = port
+        self.registry = registry or REGISTRY
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            # 读取并丢弃请求头
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) > 1 else ""
+            if len(parts) > 1 and parts[0] == "GET" and path in ("/metrics", "/"):
+                loop = asyncio.get_running_loop()
+                body = await loop.run_in_executor(None, self.registry.render)
+                status = "200 OK"
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                body = "Not Found\n"
+                status = "404 Not Found"
+                content_type = "text/plain; charset=utf-8"
+            data = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.0 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + data
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.warning(f"处理指标请求失败: {str(e)}")
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"指标接口已启动: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
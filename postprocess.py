@@ -0,0 +1,231 @@
+import asyncio
+import fnmatch
+import logging
+import mimetypes
+import os
+import time
+
+import metrics
+from media_index import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# 各处理方式默认的 ffmpeg 参数，规则中的 args 会替换这些参数
+DEFAULT_ARGS = {
+    "remux": ["-c", "copy"],
+    "transcode": [
+        "-c:v",
+        "libx264",
+        "-preset",
+        "veryfast",
+        "-crf",
+        "23",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "160k",
+    ],
+}
+
+# 将索引移到文件开头，媒体服务器无需读完整个文件即可开始播放
+FASTSTART_CONTAINERS = {"mp4", "m4v", "mov"}
+
+
+def available_cores():
+    """当前进程可以使用的CPU核心数"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class Rule:
+    """
+    一条处理规则：匹配的文件按 action 处理后保存为 container 格式
+
+    match 中以 . 开头的是扩展名，包含 / 的是 MIME 类型（支持 video/* 这样的通配符）。
+    """
+
+    def __init__(self, match, action="remux", container="mp4", args=None):
+        if action not in DEFAULT_ARGS:
+            raise ValueError(f"未知的处理方式: {action}，可选: remux, transcode")
+        if isinstance(match, str):
+            match = [match]
+        self.match = [pattern.lower() for pattern in match or []]
+        self.action = action
+        self.container = container.lstrip(".").lower()
+        self.args = list(args) if args else DEFAULT_ARGS[action]
+
+    def matches(self, path, mime_type):
+        ext = os.path.splitext(path)[1].lower()
+        if self.action == "remux" and ext == f".{self.container}":
+            # 已经是目标格式，不需要重新封装
+            return False
+        for pattern in self.match:
+            if pattern.startswith("."):
+                if ext == pattern:
+                    return True
+            elif mime_type and fnmatch.fnmatch(mime_type, pattern):
+                return True
+        return False
+
+
+async def run_ffmpeg(ffmpeg, source, target, args, timeout):
+    """
+    用 ffmpeg 处理 source 并保存为 target
+
+    输出先写入同目录下的临时文件，完成后再替换 target；失败、超时或被取消时
+    结束 ffmpeg 并删除临时文件。
+    """
+    directory, name = os.path.split(target)
+    temp_target = os.path.join(
+        directory, f".{name}.processing{os.path.splitext(name)[1]}"
+    )
+    command = [
+        ffmpeg,
+        "-nostdin",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        source,
+        "-map",
+        "0:v?",
+        "-map",
+        "0:a?",
+        *args,
+    ]
+    if os.path.splitext(name)[1].lstrip(".").lower() in FASTSTART_CONTAINERS:
+        command += ["-movflags", "+faststart"]
+    command.append(temp_target)
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"ffmpeg 超过 {timeout:.0f} 秒未完成") from None
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        if process.returncode != 0:
+            error = stderr.decode("utf-8", "replace").strip()
+            raise RuntimeError(f"ffmpeg 退出码 {process.returncode}: {error[-500:]}")
+        if not os.path.getsize(temp_target):
+            raise RuntimeError("ffmpeg 输出的文件为空")
+        os.replace(temp_target, target)
+    except BaseException:
+        if os.path.exists(temp_target):
+            os.remove(temp_target)
+        raise
+
+
+class PostProcessor:
+    """
+    下载完成后的转封装/转码
+
+    匹配规则的文件在后台启动 ffmpeg 子进程处理，同时运行的 ffmpeg 数量受 workers 限制，
+    不占用下载worker，也不阻塞事件循环。处理完成后新文件替换原文件，
+    并通过 on_replaced 回调更新索引。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.rules = []
+        self.ffmpeg = "ffmpeg"
+        self.timeout = None
+        self.keep_original = False
+        self.workers = 1
+        self._semaphore = asyncio.Semaphore(1)
+        self._tasks = set()
+
+    def configure(
+        self,
+        enabled=False,
+        rules=None,
+        ffmpeg="ffmpeg",
+        workers=0,
+        timeout_minutes=0,
+        keep_original=False,
+    ):
+        self.rules = []
+        for idx, rule in enumerate(rules or []):
+            try:
+                self.rules.append(Rule(**rule))
+            except (TypeError, ValueError) as e:
+                logger.error(f"后处理规则 #{idx+1} 配置错误: {str(e)}")
+        self.enabled = bool(enabled) and bool(self.rules)
+        self.ffmpeg = ffmpeg or "ffmpeg"
+        self.workers = max(1, int(workers or 0) or available_cores())
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self.timeout = (timeout_minutes or 0) * 60 or None
+        self.keep_original = bool(keep_original)
+
+    def rule_for(self, path, mime_type=None):
+        """返回第一条匹配文件的规则，没有时返回None"""
+        mime_type = mime_type or mimetypes.guess_type(path)[0]
+        for rule in self.rules:
+            if rule.matches(path, mime_type):
+                return rule
+        return None
+
+    def submit(self, path, mime_type=None, on_replaced=None):
+        """
+        如果文件匹配规则则在后台处理，立即返回
+
+        on_replaced(原路径, 新路径, sha256) 为处理完成后调用的协程函数。
+        """
+        if not self.enabled:
+            return None
+        rule = self.rule_for(path, mime_type)
+        if rule is None:
+            return None
+        task = asyncio.create_task(self._process(path, rule, on_replaced))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _process(self, path, rule, on_replaced):
+        stem = os.path.splitext(path)[0]
+        target = f"{stem}.{rule.container}"
+        index = 1
+        while target != path and os.path.exists(target):
+            # 不覆盖已有的同名文件
+            target = f"{stem} ({index}).{rule.container}"
+            index += 1
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._semaphore:
+                start = time.perf_counter()
+                await run_ffmpeg(self.ffmpeg, path, target, rule.args, self.timeout)
+                elapsed = time.perf_counter() - start
+            sha256 = await loop.run_in_executor(None, file_sha256, target)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.POSTPROCESSED.inc(action=rule.action, status="failed")
+            logger.error(f"后处理 {path} 失败，保留原文件: {str(e)}")
+            return
+        metrics.POSTPROCESS_SECONDS.observe(elapsed, action=rule.action)
+        metrics.POSTPROCESSED.inc(action=rule.action, status="done")
+        if target != path and not self.keep_original:
+            os.remove(path)
+        logger.info(f"后处理完成（{rule.action}）: {target}，耗时 {elapsed:.1f}s")
+        if on_replaced:
+            await on_replaced(path, target, sha256)
+
+    async def shutdown(self):
+        """取消所有处理，正在运行的 ffmpeg 被结束，原文件保持不变"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+PROCESSOR = PostProcessor()
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from telethon.errors import FloodWaitError, MessageNotModifiedError
+
+import bandwidth
+
+logger = logging.getLogger(__name__)
+
+
+def format_size(size):
+    """格式化字节数"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def format_duration(seconds):
+    """格式化剩余时间"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class _Item:
+    """单个文件的下载进度"""
+
+    def __init__(self, name):
+        self.name = name
+        self.received = 0
+        self.total = 0
+        self.speed = 0.0
+        self.last_received = 0
+        self.last_time = time.monotonic()
+        self.last_log = 0.0
+
+    def sample(self, now):
+        """按固定频率采样，使用指数移动平均计算速度"""
+        elapsed = now - self.last_time
+        if elapsed <= 0:
+            return
+        current = (self.received - self.last_received) / elapsed
+        self.speed = current if not self.speed else 0.3 * current + 0.7 * self.speed
+        self.last_received = self.received
+        self.last_time = now
+
+    def render(self):
+        text = f"{self.name[:40]}: {format_size(self.received)}"
+        if self.total:
+            percent = self.received * 100 / self.total
+            text += f"/{format_size(self.total)} ({percent:.1f}%)"
+        if self.speed:
+            text += f" {format_size(self.speed)}/s"
+            if self.total and self.received < self.total:
+                text += (
+                    f" 剩余{format_duration((self.total - self.received) / self.speed)}"
+                )
+        return text
+
+
+class ProgressReporter:
+    """
+    统一的下载进度汇报
+
+    Telegram 的 progress_callback 和 yt-dlp 的 progress_hooks 只更新内存中的进度，
+    后台任务按固定间隔采样计算速度和剩余时间，并把所有进度合并到同一条状态消息中。
+    遇到 FloodWaitError 时暂停编辑直到限制解除，日志也按固定间隔输出。
+    """
+
+    def __init__(self, message, header="", interval=5, log_interval=30):
+        self.message = message  # 用于显示进度的状态消息
+        self.header = header
+        self.interval = interval
+        self.log_interval = log_interval
+        self.items = {}
+        self.notes = deque(maxlen=5)  # 最近的事件
+        self._last_text = None
+        self._blocked_until = 0.0
+        self._task = None
+
+    def set_header(self, header):
+        self.header = header
+
+    def add_note(self, note):
+        """添加一条事件（如某个视频下载完成），显示在进度下方"""
+        self.notes.append(note)
+
+    def track(self, key, name):
+        """开始跟踪一个文件，返回 Telegram 格式的进度回调 callback(received, total)"""
+        item = self.items[key] = _Item(name)
+
+        def callback(received, total):
+            item.received = received
+            item.total = total or item.total
+
+        return callback
+
+    def ytdlp_hook(self, key, name):
+        """开始跟踪一个文件，返回 yt-dlp 的 progress hook"""
+        item = self.items[key] = _Item(name)
+
+        def hook(d):
+            if d.get("status") != "downloading":
+                return
+            item.received = d.get("downloaded_bytes") or 0
+            item.total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
+
+        return hook
+
+    def finish(self, key):
+        """停止跟踪一个文件"""
+        self.items.pop(key, None)
+
+    def render(self):
+        lines = [self.header] if self.header else []
+        lines += [item.render() for item in self.items.values()]
+        if self.notes:
+            lines.append("")
+            lines += list(self.notes)
+        return "\n".join(lines)
+
+    async def _edit(self, text, wait=False):
+        """
+        编辑状态消息，被限流时记录解除时间，返回是否成功
+
+        超过全局的编辑频率时，定期更新直接跳过，wait 为 True 时等待后编辑。
+        """
+        if self.message is None or text == self._last_text:
+            return True
+        if time.monotonic() < self._blocked_until:
+            return False
+        if wait:
+            await bandwidth.GOVERNOR.acquire_edit()
+        elif not bandwidth.GOVERNOR.try_edit():
+            return False
+        try:
+            await self.message.edit(text)
+            self._last_text = text
+            return True
+        except MessageNotModifiedError:
+            self._last_text = text
+            return True
+        except FloodWaitError as e:
+            logger.warning(f"编辑进度消息被限流，{e.seconds} 秒后重试")
+            self._blocked_until = time.monotonic() + e.seconds
+        except Exception as e:
+            logger.warning(f"编辑进度消息失败: {str(e)}")
+        return False
+
+    def _log(self, now):
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        for item in self.items.values():
+            if now - item.last_log >= self.log_interval:
+                item.last_log = now
+                logger.info(
+                    "下载进度: %s",
+                    item.render(),
+                    extra={
+                        "bytes": item.received,
+                        "total_bytes": item.total,
+                        "speed": item.speed,
+                    },
+                )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            for item in self.items.values():
+                item.sample(now)
+            self._log(now)
+            await self._edit(self.render())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def close(self, text=None):
+        """停止汇报，text 不为空时将状态消息更新为最终内容（被限流时等待后重试）"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if text is None:
+            return
+        for _ in range(3):
+            if await self._edit(text, wait=True):
+                return
+            await asyncio.sleep(max(1.0, self._blocked_until - time.monotonic()))
@@ -0,0 +1,170 @@
+import asyncio
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 跨文件系统复制时使用的缓冲区大小
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
+
+# 目标目录中的暂存目录名，目标目录与临时目录不在同一文件系统时使用
+STAGING_DIR_NAME = ".staging"
+
+_staging_dirs = {}
+_staging_lock = threading.Lock()
+
+
+def same_filesystem(path_a, path_b):
+    """判断两个已存在的路径是否位于同一文件系统"""
+    return os.stat(path_a).st_dev == os.stat(path_b).st_dev
+
+
+def get_staging_dir(dest_dir, temp_dir):
+    """
+    为目标目录选择下载暂存目录
+
+    临时目录与目标目录位于同一文件系统时直接使用临时目录，否则（例如 Docker 中
+    分别挂载的目录）在目标目录下创建 .staging 目录，使最终移动只需一次 rename。
+    """
+    with _staging_lock:
+        key = (dest_dir, temp_dir)
+        if key not in _staging_dirs:
+            os.makedirs(dest_dir, exist_ok=True)
+            os.makedirs(temp_dir, exist_ok=True)
+            staging_dir = temp_dir
+            if not same_filesystem(dest_dir, temp_dir):
+                staging_dir = os.path.join(dest_dir, STAGING_DIR_NAME)
+                try:
+                    os.makedirs(staging_dir, exist_ok=True)
+                    logger.info(
+                        f"{temp_dir} 与 {dest_dir} 不在同一文件系统，"
+                        f"使用 {staging_dir} 作为暂存目录"
+                    )
+                except OSError as e:
+                    logger.warning(
+                        f"无法创建暂存目录 {staging_dir}，继续使用 {temp_dir}: {str(e)}"
+                    )
+                    staging_dir = temp_dir
+            _staging_dirs[key] = staging_dir
+        return _staging_dirs[key]
+
+
+def staging_dirs():
+    """已经选定的所有暂存目录"""
+    with _staging_lock:
+        return sorted(set(_staging_dirs.values()))
+
+
+def cleanup_stale_files(directory, max_age):
+    """删除目录中超过 max_age 秒未更新的文件"""
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for entry in os.scandir(directory):
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+                logger.info(f"已删除过期的临时文件: {entry.path}")
+        except OSError as e:
+            logger.warning(f"删除过期文件 {entry.path} 失败: {str(e)}")
+
+
+def directory_size(directory):
+    """统计目录中（包括子目录）所有文件占用的字节数"""
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # 统计过程中文件可能已被移动
+    return total
+
+
+def _numbered(path, index):
+    """文件名后加上 (n)，index 为0时返回原路径"""
+    if not index:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem} ({index}){ext}"
+
+
+def _move_new(source, target):
+    """
+    将 source 移动到 target，不覆盖已有文件，同名文件已存在时在文件名后加上 (n)
+
+    使用硬链接创建目标文件，已存在时失败，不会与其他任务同时写入的同名文件冲突；
+    文件系统不支持硬链接时先检查再重命名。跨文件系统时抛出 EXDEV。
+
+    Returns:
+        str: 最终的路径
+    """
+    index = 0
+    while True:
+        candidate = _numbered(target, index)
+        index += 1
+        try:
+            os.link(source, candidate)
+        except FileExistsError:
+            continue
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP):
+                raise
+            if os.path.lexists(candidate):
+                continue
+            os.replace(source, candidate)
+            return candidate
+        os.remove(source)
+        return candidate
+
+
+def _copy_new(source, target):
+    """跨文件系统复制文件，先写入目标目录中的临时文件，完成后移动到不重名的路径"""
+    directory, name = os.path.split(target)
+    fd, temp_target = tempfile.mkstemp(
+        prefix=f".{name}.", suffix=".copying", dir=directory
+    )
+    try:
+        with open(source, "rb") as src, os.fdopen(fd, "wb") as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+            dst.flush()
+            os.fsync(dst.fileno())
+        shutil.copystat(source, temp_target)
+        target = _move_new(temp_target, target)
+    except BaseException:
+        if os.path.exists(temp_target):
+            os.remove(temp_target)
+        raise
+    os.remove(source)
+    return target
+
+
+def finalize_file(source, target):
+    """
+    将下载完成的文件移动到目标位置，不覆盖已有的文件
+
+    同名文件已存在时（例如标题相同的不同视频）在文件名后加上 (n)。
+    同一文件系统内直接移动；跨文件系统时使用大缓冲区复制。
+
+    Returns:
+        str: 最终的路径
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        return _move_new(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        logger.info(f"{source} 与 {target} 不在同一文件系统，复制文件")
+        return _copy_new(source, target)
+
+
+async def finalize_file_async(source, target):
+    """在后台线程中移动文件，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, finalize_file, source, target)
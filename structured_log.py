@@ -0,0 +1,161 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# 当前任务的日志字段（任务ID、来源等），由 bind 设置，会被该任务中的所有日志继承
+_context = contextvars.ContextVar("log_context", default={})
+
+# LogRecord 自带的属性，其余属性是通过 extra 传入的字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "sample",
+}
+
+_listener = None
+_lock = threading.Lock()
+
+
+@contextmanager
+def bind(**fields):
+    """在当前任务（及其创建的子任务）的日志中附加字段"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def context():
+    """当前任务的日志字段，传给其他线程时使用 contextvars.copy_context"""
+    return _context.get()
+
+
+class ContextFilter(logging.Filter):
+    """在产生日志的线程中把当前任务的字段写入日志记录"""
+
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    高频事件的采样
+
+    通过 extra={"sample": key} 标记的日志，同一 logger 和 key 每 interval 秒最多输出一条，
+    输出的日志中 suppressed 字段为上次输出后丢弃的条数。
+    """
+
+    def __init__(self, interval=5):
+        super().__init__()
+        self.interval = interval
+        self._last = {}  # (logger, key) -> [上次输出时间, 丢弃的条数]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None or not self.interval:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            state = self._last.setdefault((record.name, key), [0.0, 0])
+            if now - state[0] < self.interval:
+                state[1] += 1
+                return False
+            record.suppressed = state[1]
+            state[0], state[1] = now, 0
+            if len(self._last) > 10000:
+                # 已完成的下载不会再产生日志，定期清理
+                self._last = {
+                    k: v for k, v in self._last.items() if now - v[0] < self.interval
+                }
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，包含任务字段和通过 extra 传入的字段"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key in _RECORD_ATTRS or key.startswith("_"):
+                continue
+            if isinstance(value, float):
+                value = round(value, 3)
+            entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """只把日志记录放入队列，格式化在输出线程中进行"""
+
+    def prepare(self, record):
+        # 默认实现会在调用线程中格式化消息，同一进程内的队列不需要
+        return record
+
+
+def configure(level="INFO", fmt="text", use_queue=True, sample_interval=5):
+    """
+    配置根 logger
+
+    fmt 为 text 时使用原有的文本格式，为 json 时每行输出一条 JSON；
+    use_queue 为 True 时日志先放入队列，由后台线程格式化并写入标准输出，不阻塞事件循环。
+    """
+    global _listener
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(
+        JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+    )
+
+    root = logging.getLogger()
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+        for old in root.handlers[:]:
+            root.removeHandler(old)
+            old.close()
+        if use_queue:
+            log_queue = queue.SimpleQueue()
+            _listener = logging.handlers.QueueListener(
+                log_queue, handler, respect_handler_level=True
+            )
+            _listener.start()
+            handler = _QueueHandler(log_queue)
+        # 过滤器在产生日志的线程中执行，才能读取到当前任务的字段
+        handler.addFilter(ContextFilter())
+        handler.addFilter(SamplingFilter(sample_interval))
+        root.addHandler(handler)
+        root.setLevel(level)
+
+
+@atexit.register
+def _flush():
+    """退出时输出队列中剩余的日志"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
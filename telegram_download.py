@@ -0,0 +1,461 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from telethon import TelegramClient, utils
+from telethon.errors import FloodWaitError
+from telethon.network import MTProtoSender
+from telethon.tl import functions, types
+from telethon.tl.alltlobjects import LAYER
+
+import bandwidth
+import client_pool
+import disk_space
+from integrity import IntegrityError, OrderedHasher
+
+logger = logging.getLogger(__name__)
+
+# GetFileRequest 单次请求的最大长度，偏移量需要按该大小对齐，且单次请求不能跨越1MB边界
+PART_SIZE = 512 * 1024
+
+# 分片记录的保存间隔（秒）
+CHECKPOINT_INTERVAL = 2
+
+# 每个数据中心最多保留的空闲下载连接数，以及空闲连接的保留时间（秒）
+SENDER_MAX_IDLE = 8
+SENDER_IDLE_TIMEOUT = 300
+
+# 文档ID -> [锁, 使用该锁的任务数]
+_document_locks = {}
+
+
+class SenderCache:
+    """
+    按 (客户端, 数据中心) 复用下载连接和导入的授权
+
+    每个文件都新建连接时，其他数据中心的文件每次都要重新导出/导入授权，
+    Telegram 会对这些请求限流（FLOOD_WAIT），相册中的多个小文件很快就会触发。
+    下载完成后连接放回缓存，之后的下载直接复用，空闲超过 SENDER_IDLE_TIMEOUT 秒的连接被关闭。
+    """
+
+    def __init__(self):
+        self._auth_keys = {}  # (客户端, 数据中心) -> 导入授权后的密钥
+        self._idle = {}  # (客户端, 数据中心) -> [(发送器, 放回的时间)]
+        self._keys = {}  # 发送器 -> (客户端, 数据中心)
+        self._locks = {}  # (客户端, 数据中心) -> 导入授权的锁
+
+    async def _connect(self, client, dc_id, auth_key):
+        dc = await client._get_dc(dc_id)
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(
+            client._connection(
+                dc.ip_address,
+                dc.port,
+                dc.id,
+                loggers=client._log,
+                proxy=client._proxy,
+                local_addr=client._local_addr,
+            )
+        )
+        return sender
+
+    async def _create(self, client, dc_id):
+        """创建一个连接到指定数据中心的发送器，其他数据中心的授权只导入一次"""
+        key = (client, dc_id)
+        if dc_id == client.session.dc_id:
+            return await self._connect(client, dc_id, client.session.auth_key)
+        auth_key = self._auth_keys.get(key)
+        if auth_key:
+            return await self._connect(client, dc_id, auth_key)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            auth_key = self._auth_keys.get(key)
+            sender = await self._connect(client, dc_id, auth_key)
+            if not auth_key:
+                auth = await client(functions.auth.ExportAuthorizationRequest(dc_id))
+                client._init_request.query = functions.auth.ImportAuthorizationRequest(
+                    id=auth.id, bytes=auth.bytes
+                )
+                await sender.send(
+                    functions.InvokeWithLayerRequest(LAYER, client._init_request)
+                )
+                self._auth_keys[key] = sender.auth_key
+            return sender
+
+    async def acquire(self, client, dc_id):
+        """取出一个空闲的连接，没有时新建"""
+        await self.close_idle(SENDER_IDLE_TIMEOUT)
+        idle = self._idle.get((client, dc_id)) or []
+        while idle:
+            sender, _ = idle.pop()
+            if sender.is_connected():
+                return sender
+            await self._disconnect(sender)
+        sender = await self._create(client, dc_id)
+        self._keys[sender] = (client, dc_id)
+        return sender
+
+    async def release(self, sender):
+        """下载结束后将连接放回缓存，断开的连接或超过数量上限时关闭"""
+        key = self._keys.get(sender)
+        idle = self._idle.setdefault(key, []) if key else []
+        if key is None or not sender.is_connected() or len(idle) >= SENDER_MAX_IDLE:
+            await self._disconnect(sender)
+            return
+        idle.append((sender, time.monotonic()))
+
+    async def _disconnect(self, sender):
+        self._keys.pop(sender, None)
+        await sender.disconnect()
+
+    async def close_idle(self, max_idle=0):
+        """关闭空闲超过 max_idle 秒的连接，max_idle 为0时关闭所有空闲连接"""
+        now = time.monotonic()
+        expired = []
+        for idle in self._idle.values():
+            keep = []
+            for sender, released in idle:
+                if now - released < max_idle:
+                    keep.append((sender, released))
+                else:
+                    expired.append(sender)
+            idle[:] = keep
+        await asyncio.gather(
+            *[self._disconnect(sender) for sender in expired], return_exceptions=True
+        )
+
+
+SENDERS = SenderCache()
+
+
+class ParallelDownloader:
+    """
+    多连接并行下载Telegram文件
+
+    文件按 PART_SIZE 切分为多个分片，每个连接使用独立的 MTProtoSender
+    通过 GetFileRequest 并发拉取分片，并直接写入预分配文件的对应偏移位置。
+    连接从 SENDERS 中取出，下载结束后放回，供之后的下载复用。
+    """
+
+    def __init__(self, client, connections=4):
+        self.client = client
+        self.connections = max(1, int(connections))
+
+    async def _create_sender(self, dc_id):
+        """获取一个连接到指定数据中心的发送器"""
+        return await SENDERS.acquire(self.client, dc_id)
+
+    async def _close_sender(self, sender):
+        await SENDERS.release(sender)
+
+    async def _fetch_part(self, sender, location, offset, limit):
+        """通过指定发送器拉取一个分片，遇到限流时等待后重试"""
+        while True:
+            try:
+                result = await sender.send(
+                    functions.upload.GetFileRequest(
+                        location, offset=offset, limit=limit
+                    )
+                )
+                return result.bytes
+            except FloodWaitError as e:
+                logger.warning(f"下载分片被限流，等待 {e.seconds} 秒后重试")
+                client_pool.POOL.report_flood_wait(self.client, e.seconds)
+                await asyncio.sleep(e.seconds)
+
+    async def _download_parts(
+        self, dc_id, location, part_file, fd, hasher, progress_callback
+    ):
+        size = part_file.size
+        parts = asyncio.Queue()
+        for index in part_file.missing_parts():
+            parts.put_nowait(index)
+        received = part_file.done_bytes()
+        written = []  # 已写入但尚未同步到分片记录的分片
+        loop = asyncio.get_running_loop()
+        hash_lock = threading.Lock()
+        writes = set()  # 线程池中尚未完成的写入，关闭文件前需要等待
+
+        def write_part(index, offset, data):
+            """写入分片并计算哈希，在线程池中执行"""
+            os.pwrite(fd, data, offset)
+            # 写入的同时按顺序计算哈希，下载完成后不需要再读一遍文件
+            with hash_lock:
+                hasher.add(index, data)
+
+        async def worker(sender):
+            nonlocal received
+            while True:
+                try:
+                    index = parts.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                offset = index * PART_SIZE
+                expected = min(PART_SIZE, size - offset)
+                # 超过全局带宽或请求频率限制时等待
+                await bandwidth.GOVERNOR.acquire("telegram", expected)
+                start = time.monotonic()
+                data = await self._fetch_part(sender, location, offset, PART_SIZE)
+                if len(data) != expected:
+                    raise IOError(
+                        f"分片 {index} 长度错误: 期望 {expected}，实际 {len(data)}"
+                    )
+                # 写入和哈希计算不阻塞事件循环，其他连接可以继续收发分片
+                write = loop.run_in_executor(None, write_part, index, offset, data)
+                writes.add(write)
+                write.add_done_callback(writes.discard)
+                # 下载被取消时已开始的写入仍会完成，不会在文件关闭后写入
+                await asyncio.shield(write)
+                written.append(index)
+                received += len(data)
+                if logger.isEnabledFor(logging.DEBUG):
+                    # 每个分片都会产生一条，按文件采样输出
+                    logger.debug(
+                        "分片 %d 下载完成",
+                        index,
+                        extra={
+                            "sample": part_file.path,
+                            "bytes": len(data),
+                            "duration": time.monotonic() - start,
+                            "received": received,
+                        },
+                    )
+                if progress_callback:
+                    progress_callback(received, size)
+
+        async def checkpoint():
+            """将已写入的分片落盘后记录到分片文件中"""
+            if not written:
+                return
+            indexes = written[:]
+            await loop.run_in_executor(None, os.fsync, fd)
+            del written[: len(indexes)]
+            part_file.done.update(indexes)
+            part_file.save()
+
+        if parts.empty():
+            return
+
+        # 第一个连接创建完成后（可能需要导入授权）再并发创建其余连接
+        connections = min(self.connections, parts.qsize())
+        senders = [await self._create_sender(dc_id)]
+        try:
+            senders += await asyncio.gather(
+                *[self._create_sender(dc_id) for _ in range(connections - 1)]
+            )
+            tasks = [asyncio.create_task(worker(sender)) for sender in senders]
+            try:
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, timeout=CHECKPOINT_INTERVAL
+                    )
+                    for task in done:
+                        task.result()
+                    await checkpoint()
+            except BaseException:
+                # 任一分片失败时取消其余连接上的下载
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        finally:
+            await asyncio.gather(*writes, return_exceptions=True)
+            # 下载失败时同样记录已完成的分片，下次从断点继续
+            await checkpoint()
+            await asyncio.gather(
+                *[self._close_sender(sender) for sender in senders],
+                return_exceptions=True,
+            )
+
+    async def download(
+        self,
+        dc_id,
+        location,
+        size,
+        part_path,
+        progress_callback=None,
+        reservation=None,
+    ):
+        """
+        下载文件到 part_path，已有的分片记录会被复用以断点续传
+
+        下载成功后删除分片记录，返回 (part_path, sha256)，失败时保留 .part 文件和分片记录。
+        下载完成后分片不完整时删除 .part 文件和分片记录并抛出 IntegrityError。
+        """
+        loop = asyncio.get_running_loop()
+        part_file = PartFile(part_path, size)
+        # 读取分片记录和预分配都是阻塞的文件操作，在线程池中进行
+        if await loop.run_in_executor(None, part_file.load):
+            logger.info(
+                f"继续未完成的下载: {part_path} "
+                f"已完成 {part_file.done_bytes()}/{size} bytes"
+            )
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # 预分配磁盘空间，各分片直接写入对应偏移位置，空间不足时在下载前失败。
+            # 文件系统不支持 fallocate 时 glibc 会逐块写入模拟，大文件需要数秒
+            await loop.run_in_executor(None, disk_space.preallocate, fd, size)
+            if reservation:
+                reservation.consume(size)
+            hasher = OrderedHasher(fd, size, PART_SIZE, done=part_file.done)
+            await self._download_parts(
+                dc_id, location, part_file, fd, hasher, progress_callback
+            )
+            try:
+                # 每个分片的长度在写入前已经检查过，这里检查所有分片都已写入。
+                # 剩余的分片需要从文件中读回计算哈希，同样在线程池中进行
+                sha256 = await loop.run_in_executor(None, hasher.hexdigest)
+            except IntegrityError:
+                # 损坏的文件不能续传，删除后重新下载
+                part_file.remove_meta()
+                os.remove(part_path)
+                raise
+        finally:
+            os.close(fd)
+        part_file.remove_meta()
+        return part_path, sha256
+
+
+class PartFile:
+    """
+    未完成的下载文件（.part）及其分片记录
+
+    分片记录保存在同名的 .json 文件中，以字节区间的形式记录已经写入磁盘的数据，
+    只有 fsync 之后的分片才会被记录，因此记录中的区间都是可信的。
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.meta_path = path + ".json"
+        self.size = size
+        self.done = set()
+
+    @property
+    def part_count(self):
+        return (self.size + PART_SIZE - 1) // PART_SIZE
+
+    def missing_parts(self):
+        return [i for i in range(self.part_count) if i not in self.done]
+
+    def done_bytes(self):
+        return sum(min(PART_SIZE, self.size - i * PART_SIZE) for i in self.done)
+
+    def load(self):
+        """读取分片记录，记录与文件不一致时从头下载，返回是否可以续传"""
+        self.done = set()
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            if (
+                meta.get("size") != self.size
+                or meta.get("part_size") != PART_SIZE
+                or os.path.getsize(self.path) != self.size
+            ):
+                return False
+            for start, end in meta.get("ranges", []):
+                self.done.update(range(start // PART_SIZE, -(-end // PART_SIZE)))
+        except (OSError, ValueError, TypeError):
+            self.done = set()
+        return bool(self.done)
+
+    def save(self):
+        """以字节区间形式保存已完成的分片"""
+        ranges = []
+        for index in sorted(self.done):
+            start = index * PART_SIZE
+            end = min(start + PART_SIZE, self.size)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        temp_path = self.meta_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {"size": self.size, "part_size": PART_SIZE, "ranges": ranges}, file
+            )
+        os.replace(temp_path, self.meta_path)
+
+    def remove_meta(self):
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+
+
+def cleanup_stale_parts(directory, max_age):
+    """删除超过 max_age 秒未更新的 .part 文件及其分片记录"""
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for name in os.listdir(directory):
+        if not name.endswith((".part", ".part.json", ".part.json.tmp")):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                logger.info(f"已删除过期的未完成下载: {path}")
+        except OSError as e:
+            logger.warning(f"删除过期文件 {path} 失败: {str(e)}")
+
+
+async def download_document_parallel(
+    message, directory, connections=4, progress_callback=None, reservation=None
+):
+    """
+    使用多个连接并行下载消息中的文档，文件名规则与 download_media 保持一致
+
+    下载过程中写入 <文档ID>.part 文件，中断后重新下载同一文档时会从断点继续。
+    reservation 为 disk_space 中预留的磁盘空间，预分配文件后不再计入预留。
+
+    Returns:
+        tuple: (下载后的文件路径, 文件的SHA-256)
+    """
+    document = message.media.document
+    location = types.InputDocumentFileLocation(
+        id=document.id,
+        access_hash=document.access_hash,
+        file_reference=document.file_reference,
+        thumb_size="",
+    )
+    part_path = os.path.join(directory, f"{document.id}.part")
+    downloader = ParallelDownloader(message.client, connections)
+    # 同一文档（如转发到多个会话的同一视频）同时只有一个任务写入 .part 文件，
+    # 后面的任务在前一个任务完成并重命名文件后重新下载
+    async with _document_lock(document.id):
+        _, sha256 = await downloader.download(
+            document.dc_id,
+            location,
+            document.size,
+            part_path,
+            progress_callback,
+            reservation,
+        )
+
+        kind, possible_names = TelegramClient._get_kind_and_names(document.attributes)
+        file_path = TelegramClient._get_proper_filename(
+            directory,
+            kind,
+            utils.get_extension(document),
+            date=message.date,
+            possible_names=possible_names,
+        )
+        os.replace(part_path, file_path)
+    return file_path, sha256
+
+
+@asynccontextmanager
+async def _document_lock(document_id):
+    """同一文档的下载锁，没有任务使用时删除"""
+    entry = _document_locks.setdefault(document_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _document_locks[document_id]
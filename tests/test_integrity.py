@@ -0,0 +1,73 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import integrity  # noqa: E402
+
+
+def _ytdlp_download(hasher, directory, chunks):
+    """按 yt-dlp HttpFD 的回调格式模拟一次下载：写入 .part，完成时重命名"""
+    filename = os.path.join(directory, "v.mp4")
+    tmpfilename = filename + ".part"
+    downloaded = 0
+    with open(tmpfilename, "wb") as file:
+        for chunk in chunks:
+            file.write(chunk)
+            file.flush()
+            downloaded += len(chunk)
+            hasher.hook(
+                {
+                    "status": "downloading",
+                    "downloaded_bytes": downloaded,
+                    "total_bytes": sum(map(len, chunks)),
+                    "tmpfilename": tmpfilename,
+                    "filename": filename,
+                    "eta": 0,
+                    "speed": 1.0,
+                    "elapsed": 0.1,
+                }
+            )
+    os.replace(tmpfilename, filename)
+    # finished 事件中没有 tmpfilename
+    hasher.hook(
+        {
+            "status": "finished",
+            "downloaded_bytes": downloaded,
+            "total_bytes": downloaded,
+            "filename": filename,
+            "elapsed": 0.2,
+        }
+    )
+    return filename
+
+
+def test_stream_hasher_records_digest_under_final_name(tmp_path):
+    chunks = [b"a" * 1000, b"b" * 2000, b"c" * 10]
+    hasher = integrity.StreamHasher()
+    path = _ytdlp_download(hasher, str(tmp_path), chunks)
+
+    expected = hashlib.sha256(b"".join(chunks)).hexdigest()
+    assert hasher.digests[path][:2] == (expected, 3010)
+    assert not hasher._files and not hasher._tmpnames
+
+
+def test_verify_uses_streamed_digest_and_checks_filesize(tmp_path, monkeypatch):
+    chunks = [b"x" * 4096, b"y" * 100]
+    hasher = integrity.StreamHasher()
+    path = _ytdlp_download(hasher, str(tmp_path), chunks)
+
+    def no_rehash(path):
+        raise AssertionError("未经后处理的文件不应重新读取")
+
+    monkeypatch.setattr(integrity, "file_sha256", no_rehash)
+    info = {"requested_downloads": [{"filepath": path, "filesize": 4196}]}
+    sha256 = integrity.verify_ytdlp_download(info, path, hasher)
+    assert sha256 == hashlib.sha256(b"".join(chunks)).hexdigest()
+
+    info = {"requested_downloads": [{"filepath": path, "filesize": 5000}]}
+    with pytest.raises(integrity.IntegrityError):
+        integrity.verify_ytdlp_download(info, path, hasher)
@@ -0,0 +1,78 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import youtube_session  # noqa: E402
+from youtube_session import ExtractionError, YoutubeSession  # noqa: E402
+
+
+class StubYDL:
+    """extract_info 返回 None，与 ignoreerrors 时 yt-dlp 吞掉错误的行为相同"""
+
+    params = {}
+
+    def extract_info(self, url, download=False, process=True):
+        return None
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    session = YoutubeSession(
+        str(tmp_path / "config.yaml"),
+        str(tmp_path / "cookies.txt"),
+        str(tmp_path / "%(id)s.%(ext)s"),
+    )
+    session.initialize({}, {})
+    yield session
+    session.close()
+
+
+def test_missing_info_raises_instead_of_returning_none(session, monkeypatch):
+    monkeypatch.setattr(session, "_get_ydl", lambda **kwargs: StubYDL())
+    with pytest.raises(ExtractionError):
+        session.extract_info("https://example.com/v", download=True)
+    with pytest.raises(ExtractionError):
+        session.extract_playlist("https://example.com/list", lazy=True)
+
+
+def test_only_playlist_instances_ignore_errors(session):
+    assert not session._get_ydl().params.get("ignoreerrors")
+    assert session._get_ydl(playlist=True, flat=True).params.get("ignoreerrors")
+    assert session._get_ydl(playlist=True).params.get("ignoreerrors")
+
+
+def test_permanent_errors():
+    assert youtube_session.is_permanent_error(
+        "ERROR: [youtube] abc: Private video. "
+        "Sign in if you've been granted access to this video"
+    )
+    assert youtube_session.is_permanent_error(
+        "ERROR: [youtube] abc: The uploader has not made this video "
+        "available in your country"
+    )
+    assert not youtube_session.is_permanent_error("HTTP Error 503")
+
+
+def test_private_video_error_reaches_caller(session, monkeypatch):
+    import yt_dlp
+    from yt_dlp.extractor.common import InfoExtractor
+    from yt_dlp.utils import DownloadError, ExtractorError
+
+    class PrivateIE(InfoExtractor):
+        _VALID_URL = r"https://private\.example/(?P<id>\w+)"
+
+        def _real_extract(self, url):
+            raise ExtractorError("Private video", expected=True)
+
+    class StubYoutubeDL(yt_dlp.YoutubeDL):
+        def __init__(self, params=None):
+            super().__init__(params, auto_init=False)
+            self.add_info_extractor(PrivateIE())
+
+    monkeypatch.setattr(yt_dlp, "YoutubeDL", StubYoutubeDL)
+    with pytest.raises(DownloadError) as error:
+        session.extract_info("https://private.example/abc", download=True)
+    assert youtube_session.is_permanent_error(error.value)
@@ -0,0 +1,139 @@
+import logging
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from telethon import types
+
+logger = logging.getLogger(__name__)
+
+# 消息中的链接，没有协议头的只识别 www. 开头的链接和YouTube链接
+URL_PATTERN = re.compile(
+    r"(?:https?://|www\.|(?:m\.)?youtube\.com/|youtu\.be/)[^\s<>\"'`]+",
+    re.IGNORECASE,
+)
+# 链接末尾通常属于句子而不属于链接的字符
+TRAILING_CHARS = ".,;:!?)]}>'\"，。；：！？）》」"
+
+# 返回类型为 any 的提取器中，按播放列表处理的提取器（频道、播放列表页面）
+PLAYLIST_EXTRACTORS = {"YoutubeTab"}
+
+
+class Route:
+    """一个链接的下载方式"""
+
+    def __init__(self, url, extractor, playlist, video_id=None):
+        self.url = url
+        self.extractor = extractor  # yt-dlp 提取器名称，如 Youtube
+        self.playlist = playlist
+        self.video_id = video_id  # 能直接从链接中获取时为视频ID
+
+    def __repr__(self):
+        mode = "playlist" if self.playlist else "video"
+        return f"Route({self.extractor}, {mode}, {self.url})"
+
+
+def _normalize(url):
+    url = url.rstrip(TRAILING_CHARS)
+    if not re.match(r"https?://", url, re.IGNORECASE):
+        url = "https://" + url
+    return url
+
+
+def extract_urls(text, entities=None):
+    """
+    提取消息中的所有链接，按出现顺序去重
+
+    entities 为 Telethon 的 get_entities_text() 结果，可以识别隐藏在文字中的链接。
+    """
+    urls = []
+    for entity, entity_text in entities or []:
+        if isinstance(entity, types.MessageEntityTextUrl):
+            urls.append(entity.url)
+        elif isinstance(entity, types.MessageEntityUrl):
+            urls.append(entity_text)
+    urls += URL_PATTERN.findall(text or "")
+    return list(dict.fromkeys(_normalize(url) for url in urls))
+
+
+class UrlRouter:
+    """
+    根据 yt-dlp 的提取器列表判断链接能否下载以及下载方式
+
+    所有提取器的 URL 正则在第一次使用时编译为分派表，之后一直复用；
+    正则匹配后再调用提取器的 suitable 确认（部分提取器会排除特定链接）。
+    通用提取器（Generic）不参与匹配，避免把任意网页链接加入下载队列。
+    """
+
+    def __init__(self):
+        self._table = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        from yt_dlp.extractor import gen_extractor_classes
+
+        start = time.perf_counter()
+        table = []
+        for ie in gen_extractor_classes():
+            if ie.ie_key() == "Generic":
+                continue
+            patterns = getattr(ie, "_VALID_URL", None)
+            if not patterns:
+                continue
+            if isinstance(patterns, str):
+                patterns = [patterns]
+            table.append((ie, [re.compile(pattern) for pattern in patterns]))
+        logger.info(
+            f"已生成 {len(table)} 个提取器的链接分派表，"
+            f"耗时 {time.perf_counter() - start:.2f}s"
+        )
+        return table
+
+    @property
+    def table(self):
+        if self._table is None:
+            with self._lock:
+                if self._table is None:
+                    self._table = self._build()
+        return self._table
+
+    def warm_up(self):
+        """在后台线程中提前生成分派表"""
+        return self.table
+
+    def route(self, url):
+        """返回链接的下载方式，不支持的链接返回None"""
+        url = _normalize(url)
+        for ie, patterns in self.table:
+            if not any(pattern.match(url) for pattern in patterns):
+                continue
+            if not ie.suitable(url):
+                continue
+            extractor = ie.ie_key()
+            playlist = (
+                getattr(ie, "_RETURN_TYPE", None) == "playlist"
+                or extractor in PLAYLIST_EXTRACTORS
+                # 带播放列表参数的视频链接下载整个播放列表
+                or (extractor == "Youtube" and "list" in parse_qs(urlsplit(url).query))
+            )
+            video_id = None
+            if not playlist:
+                try:
+                    video_id = ie._match_id(url)
+                except Exception:
+                    pass
+            return Route(url, extractor, playlist, video_id)
+        return None
+
+    def routes(self, text, entities=None):
+        """提取消息中所有可以下载的链接"""
+        routes = []
+        for url in extract_urls(text, entities):
+            route = self.route(url)
+            if route:
+                routes.append(route)
+        return routes
+
+
+ROUTER = UrlRouter()
@@ -0,0 +1,304 @@
+import copy
+import logging
+import os
+import threading
+import time
+
+import yaml
+
+import bandwidth
+
+logger = logging.getLogger(__name__)
+
+# yt-dlp 返回这些错误时重试也不会成功
+PERMANENT_ERRORS = (
+    "Unsupported URL",
+    "Private video",
+    "Video unavailable",
+    "This video has been removed",
+    "available in your country",
+)
+
+
+class ExtractionError(Exception):
+    """yt-dlp 没有返回解析结果"""
+
+
+def is_permanent_error(error):
+    """yt-dlp 的错误是否是重试也无法解决的（私密、已删除、地区限制、不支持的链接）"""
+    message = str(error)
+    return any(marker in message for marker in PERMANENT_ERRORS)
+
+
+def write_cookie_file(path, cookies):
+    """将 "name=value; name2=value2" 格式的cookies写入Netscape格式的cookie文件"""
+    temp_path = path + ".tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        # 写入cookies文件头部
+        f.write("# Netscape HTTP Cookie File\n")
+        f.write("# https://curl.haxx.se/rfc/cookie_spec.html\n")
+        f.write("# This is a generated file!  Do not edit.\n\n")
+
+        # 写入cookies
+        for cookie in cookies.split(";"):
+            if cookie.strip():
+                name_value = cookie.strip().split("=", 1)
+                if len(name_value) == 2:
+                    name, value = name_value
+                    f.write(
+                        f".youtube.com\tTRUE\t/\tTRUE\t2999999999\t{name.strip()}\t{value.strip()}\n"
+                    )
+    os.replace(temp_path, path)
+
+
+class YoutubeSession:
+    """
+    长期复用的YouTube下载会话
+
+    下载参数和cookie文件在启动时生成一次，配置文件修改后才会重新生成。
+    每个工作线程持有自己的 YoutubeDL 实例（提取器和HTTP连接状态会被复用），
+    配置变化后旧实例在下次使用时被替换。单次任务的进度回调通过线程局部变量传递。
+    指定 info_cache 时复用缓存的解析结果，下载时只需重新选择格式。
+    """
+
+    def __init__(self, config_file, cookies_file, outtmpl, info_cache=None):
+        self.config_file = config_file
+        self.cookies_file = cookies_file
+        self.outtmpl = outtmpl
+        self.info_cache = info_cache
+        self.video_format = "best"
+        self._opts = None
+        self._settings = None
+        self._config_mtime = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._instances = []
+
+    def _dispatch_progress(self, d):
+        """将yt-dlp的进度转发给当前线程正在执行的任务"""
+        hook = getattr(self._local, "progress_hook", None)
+        if hook:
+            hook(d)
+
+    def configure(self, youtube_config, proxy_config):
+        """根据配置生成下载参数，配置未变化时不做任何操作"""
+        settings = (
+            youtube_config.get("format", "best"),
+            youtube_config.get("cookies", ""),
+            bool(proxy_config.get("enabled")),
+            proxy_config.get("host", "127.0.0.1"),
+            proxy_config.get("port", 7890),
+        )
+        with self._lock:
+            if settings == self._settings:
+                return
+            video_format, cookies, proxy_enabled, host, port = settings
+            opts = {
+                "format": video_format,
+                "outtmpl": self.outtmpl,
+                "ignore_no_formats_error": True,
+                "restrictfilenames": True,  # 使用ASCII字符
+                "windowsfilenames": True,  # 确保Windows兼容性
+                "progress_hooks": [self._dispatch_progress],
+            }
+
+            # 添加代理配置
+            if proxy_enabled:
+                opts["proxy"] = f"socks5://{host}:{port}"
+
+            # 添加cookies配置
+            if cookies:
+                write_cookie_file(self.cookies_file, cookies)
+                opts["cookiefile"] = self.cookies_file
+
+            self.video_format = video_format
+            self._opts = opts
+            self._settings = settings
+            self._generation += 1
+            logger.info("YouTube下载参数已更新")
+            changed = self._generation > 1
+        # cookies或代理变化后可用的格式可能不同，丢弃之前的解析结果
+        if changed and self.info_cache is not None:
+            self.info_cache.clear()
+
+    def initialize(self, youtube_config, proxy_config):
+        """使用启动时已读取的配置生成下载参数，之后只在配置文件修改后重新读取"""
+        try:
+            self._config_mtime = os.path.getmtime(self.config_file)
+        except OSError:
+            self._config_mtime = None
+        self.configure(youtube_config, proxy_config)
+
+    def reload_if_changed(self):
+        """配置文件修改后重新读取YouTube和代理配置"""
+        try:
+            mtime = os.path.getmtime(self.config_file)
+        except OSError:
+            return
+        if mtime == self._config_mtime:
+            return
+        self._config_mtime = mtime
+        try:
+            with open(self.config_file, "r", encoding="utf-8") as file:
+                config = yaml.safe_load(file) or {}
+            self.configure(
+                config.get("youtube_download") or {}, config.get("proxy") or {}
+            )
+        except Exception as e:
+            logger.error(f"重新加载YouTube配置失败: {str(e)}")
+
+    def _get_ydl(self, playlist=False, flat=False):
+        """
+        获取当前线程的 YoutubeDL 实例
+
+        单个视频的实例在出错时抛出异常；播放列表的实例忽略单个条目的错误，
+        flat 为 True 时平铺解析播放列表。
+        """
+        self.reload_if_changed()
+        instances = getattr(self._local, "instances", None)
+        if instances is None:
+            instances = self._local.instances = {}
+        key = (playlist, flat)
+        cached = instances.get(key)
+        if cached and cached[0] == self._generation:
+            return cached[1]
+        if cached:
+            self._close(cached[1])
+
+        with self._lock:
+            opts = dict(self._opts)
+            generation = self._generation
+        if playlist:
+            opts["ignoreerrors"] = True
+        if flat:
+            opts["extract_flat"] = "in_playlist"
+        # yt-dlp 及其提取器加载较慢，在第一次使用时才导入
+        import yt_dlp
+
+        ydl = yt_dlp.YoutubeDL(opts)
+        instances[key] = (generation, ydl)
+        with self._lock:
+            self._instances.append(ydl)
+        return ydl
+
+    def _close(self, ydl):
+        with self._lock:
+            if ydl in self._instances:
+                self._instances.remove(ydl)
+        ydl.close()
+        self._remove_unused_cookie_file()
+
+    def _remove_unused_cookie_file(self):
+        """配置中已删除cookies时删除cookie文件（旧实例关闭时会写回cookie文件）"""
+        with self._lock:
+            unused = self._opts is not None and "cookiefile" not in self._opts
+        if unused and os.path.exists(self.cookies_file):
+            os.remove(self.cookies_file)
+
+    def warm_up(self):
+        """预先加载yt-dlp并创建当前线程的 YoutubeDL 实例"""
+        start = time.perf_counter()
+        try:
+            self._get_ydl()
+            logger.info(f"yt-dlp 加载完成，耗时 {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logger.warning(f"预加载yt-dlp失败: {str(e)}")
+
+    def extract_info(self, url, download=False, progress_hook=None, refresh=False):
+        """
+        在当前线程中解析（并下载）视频，progress_hook 只接收本次任务的进度
+
+        refresh 为 True 时忽略缓存的解析结果重新解析。
+        yt-dlp 的错误直接抛出，没有返回解析结果时抛出 ExtractionError。
+        """
+        ydl = self._get_ydl()
+        self._local.progress_hook = progress_hook
+        # 单个下载的速率上限随限速时段变化，所有下载的总速率由 progress hook 控制
+        ydl.params["ratelimit"] = bandwidth.GOVERNOR.rate_limit("youtube")
+        try:
+            if self.info_cache is None:
+                return self._checked(ydl.extract_info(url, download=download), url)
+            cached = None if refresh else self.info_cache.get(url)
+            info = self._checked(cached or self._extract_and_cache(ydl, url), url)
+            if not download:
+                return info
+            if cached is None:
+                return self._checked(
+                    ydl.process_ie_result(copy.deepcopy(info), download=True), url
+                )
+            try:
+                result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                if result and self._downloaded(result):
+                    return result
+            except Exception as e:
+                logger.warning(f"使用缓存的解析结果下载出错: {str(e)}")
+            # 缓存中的下载地址可能已经失效，重新解析后再下载一次
+            logger.info(f"使用缓存的解析结果下载失败，重新解析: {url}")
+            info = self._checked(self._extract_and_cache(ydl, url), url)
+            return self._checked(
+                ydl.process_ie_result(copy.deepcopy(info), download=True), url
+            )
+        finally:
+            self._local.progress_hook = None
+
+    @staticmethod
+    def _checked(info, url):
+        if info is None:
+            raise ExtractionError(f"无法解析链接: {url}")
+        return info
+
+    def _extract_and_cache(self, ydl, url):
+        """解析视频（不下载）并缓存结果"""
+        self.info_cache.remove(url)
+        info = ydl.extract_info(url, download=False)
+        if info is None:
+            return None
+        info = ydl.sanitize_info(info, remove_private_keys=True)
+        self.info_cache.put(url, info)
+        return info
+
+    @staticmethod
+    def _downloaded(info):
+        """判断 process_ie_result 是否真正下载了文件"""
+        downloads = info.get("requested_downloads") or []
+        return any(os.path.exists(d.get("filepath") or "") for d in downloads)
+
+    def extract_playlist(self, url, lazy=True):
+        """
+        解析播放列表，lazy 为 True 时使用平铺解析，返回的条目由提取器按页生成
+
+        返回的结果中 entries 可能是生成器，只能在当前线程中迭代。
+        """
+        ydl = self._get_ydl(playlist=True, flat=lazy)
+        info = self._checked(
+            ydl.extract_info(url, download=False, process=not lazy), url
+        )
+        # 跳转类型的结果（如带list参数的视频链接）需要继续解析目标地址
+        for _ in range(3):
+            if info.get("_type") not in ("url", "url_transparent"):
+                break
+            info = self._checked(
+                ydl.extract_info(info["url"], download=False, process=not lazy), url
+            )
+        # 完整解析时每个条目都已包含格式信息，缓存后下载时无需再次解析
+        if not lazy and self.info_cache is not None:
+            for entry in info.get("entries") or []:
+                if entry and entry.get("webpage_url"):
+                    self.info_cache.put(
+                        entry["webpage_url"],
+                        ydl.sanitize_info(entry, remove_private_keys=True),
+                    )
+        return info
+
+    def close(self):
+        """关闭所有 YoutubeDL 实例"""
+        with self._lock:
+            instances, self._instances = self._instances, []
+        for ydl in instances:
+            try:
+                ydl.close()
+            except Exception as e:
+                logger.warning(f"关闭YouTube下载实例失败: {str(e)}")
+        self._remove_unused_cookie_file()